@@ -0,0 +1,91 @@
+"""Run many get_variation_sets.py jobs in one invocation. The manifest is a text file with the arguments of one
+get_variation_sets.py run per line, e.g.:
+
+    # Chintang, words and morphemes
+    -f chintang.sqlite3 -w 2 -w 5 -m 1 -m 3
+    -f chintang.sqlite3 -t morphemes -w 2 -w 5 -m 1 -m 3 -z 0.6 -z 0.8 -n
+    -f bnc.sqlite3 -e -w 2 -m 1 -o
+
+Blank lines and lines starting with # are skipped. The jobs that read the same view of a database (the same file,
+tier, -v, -e, -c, -r and --case-folding, read with the same --cache and --sqlite3) share one loaded corpus and all
+jobs share one pool of worker processes, whose size is the -j of batch.py; the jobs can't have a -j of their own.
+The output files are named as with get_variation_sets.py.
+To see all of the options, you can call this script with the -h flag."""
+
+import sys
+import time
+import shlex
+import argparse
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+
+import get_variation_sets as gvs
+
+
+def read_manifest(filename):
+    """Returns the parsed and checked arguments of every job in the manifest."""
+    jobs = []
+    with open(filename) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            args = gvs.parse_args(shlex.split(line))
+            if args.jobs != 1:
+                sys.exit("%s, line %d: the jobs share one pool of workers, pass -j to batch.py instead" %
+                         (filename, number))
+            jobs.append(args)
+    return jobs
+
+
+def corpus_key(args):
+    """The jobs with the same key read the same sessions, in the same way."""
+    return (args.filename, args.tier, args.nouns_verbs, args.english_bnc, args.chintang_adults, args.random_text,
+            tuple(args.case_folding or []), args.cache, args.raw_sqlite)
+
+
+def group_jobs(jobs):
+    """Group the jobs by corpus_key, in the order their corpora first appear in the manifest."""
+    groups = OrderedDict()
+    for args in jobs:
+        groups.setdefault(corpus_key(args), []).append(args)
+    return list(groups.values())
+
+
+def main(args):
+    jobs = read_manifest(args.manifest)
+    print("%d jobs on %d corpora" % (len(jobs), len(group_jobs(jobs))))
+
+    with ExitStack() as stack:
+        executor = None
+        if args.jobs > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.jobs))
+
+        for group in group_jobs(jobs):
+            start_time = time.time()
+            # Only one corpus is kept in memory at a time
+            sessions = list(gvs.read_sessions(group[0]))
+            print("%s seconds --- Loaded %s" % (time.time() - start_time, group[0].filename))
+
+            for job in group:
+                start_time = time.time()
+                job.jobs = args.jobs
+                gvs.write_output(sessions, job, executor)
+                print("%s seconds --- Finished %s" % (time.time() - start_time, ", ".join(gvs._out_filename(job))))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a manifest of get_variation_sets.py jobs")
+    parser.add_argument("manifest", type=str, help="file with the get_variation_sets.py arguments of one job per line")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="number of processes shared by all of the jobs")
+    args = parser.parse_args()
+
+    if args.jobs < 1:
+        sys.exit("-j|--jobs must be at least 1")
+
+    start_time = time.time()
+    main(args)
+    print("%s seconds --- Finished" % (time.time() - start_time))
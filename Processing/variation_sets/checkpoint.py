@@ -0,0 +1,61 @@
+"""Checkpoints of a run of get_variation_sets.py, so that a run that was killed can be resumed with --resume instead
+of starting over. The checkpoint is a small sqlite database next to the output files. After all rows of a session
+have been written, it records the session and the size of every output file. Resuming truncates the output files to
+the sizes of the last recorded session, which drops whatever a killed run wrote of the session it was working on,
+and skips the recorded sessions. The checkpoint is removed once the run is finished."""
+
+import os
+import json
+import sqlite3
+
+
+def _remove(path):
+    """Remove the sqlite database at path, along with its write-ahead log."""
+    for suffix in ['', '-wal', '-shm']:
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+class Checkpoint(object):
+    """The sessions of a run that are completely written to its output files."""
+
+    def __init__(self, path, key, resume=False):
+        """Open the checkpoint at path for the run described by key (any JSON-serializable value). Unless resume,
+        any old checkpoint is thrown away. Raises ValueError if the checkpoint is of a run with a different key."""
+        self.path = path
+        if not resume:
+            _remove(path)
+        # Recorded by the pipeline's writer thread
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # The output files are only flushed, not synced, so the checkpoint doesn't need to be either
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS run (key TEXT)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (position INTEGER PRIMARY KEY, session_id, sizes TEXT)")
+        key = json.dumps(key, sort_keys=True)
+        stored = self.db.execute("SELECT key FROM run").fetchone()
+        if stored is None:
+            self.db.execute("INSERT INTO run VALUES (?)", (key,))
+            self.db.commit()
+        elif stored[0] != key:
+            self.db.close()
+            raise ValueError("the checkpoint %s is of a run with other arguments" % path)
+
+    def sessions(self):
+        """The ids of the recorded sessions."""
+        return set(row[0] for row in self.db.execute("SELECT session_id FROM sessions"))
+
+    def sizes(self):
+        """The sizes of the output files after the last recorded session, or None if there isn't any."""
+        row = self.db.execute("SELECT sizes FROM sessions ORDER BY position DESC LIMIT 1").fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def record(self, session, sizes):
+        """Record that session has been written, the output files now having the given sizes."""
+        self.db.execute("INSERT INTO sessions (session_id, sizes) VALUES (?, ?)", (session, json.dumps(sizes)))
+        self.db.commit()
+
+    def finish(self):
+        """The run is done, remove the checkpoint."""
+        self.db.close()
+        _remove(self.path)
@@ -0,0 +1,183 @@
+"""Typed columnar output files, as an alternative to the CSV files of get_variation_sets.py that are much faster to
+read back (e.g. with arrow::read_parquet in R) and keep integers as integers. Every output file keeps its name with
+another extension:
+
+    parquet  Apache Parquet (requires pyarrow)
+    feather  Apache Arrow IPC / Feather v2 (requires pyarrow)
+    npz      one NumPy array per column (requires numpy); a text column is stored as integer codes into the array
+             of its distinct values, which is named after the column with _levels appended
+    sqlite   one table, named counts, utterances, pairs or texts like the file, in a sqlite database
+
+The rows are collected column by column and appended to the file every ROWS_PER_BATCH rows, as a row group of a
+Parquet file, a record batch of a Feather file or an INSERT of many rows into the sqlite table, so that a long run
+doesn't hold all of its output in memory. A zip of NumPy arrays can't be appended to, so the npz format keeps the
+batches as arrays, whose values take far less memory than Python objects, and writes the file at the end. Every file
+is written under a temporary name and only gets its own at the end of the run, so these formats can't be resumed."""
+
+import os
+import sqlite3
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+FORMATS = ['csv', 'columnar', 'parquet', 'feather', 'npz', 'sqlite']
+
+EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather', 'npz': '.npz', 'sqlite': '.sqlite3'}
+
+# Rows a ColumnWriter collects before it appends them to its file
+ROWS_PER_BATCH = 1 << 16
+
+
+def available(output_format):
+    """Whether the modules the format needs could be imported."""
+    if output_format in ['parquet', 'feather']:
+        return pa is not None
+    if output_format == 'npz':
+        return np is not None
+    return True
+
+
+def resolve(output_format):
+    """The format to write for --format columnar: Parquet if pyarrow is installed, otherwise npz or sqlite."""
+    if output_format != 'columnar':
+        return output_format
+    if pa is not None:
+        return 'parquet'
+    return 'npz' if np is not None else 'sqlite'
+
+
+def filename(csv_filename, output_format):
+    """Name of the file in the format that stands in for a CSV output file."""
+    return os.path.splitext(csv_filename)[0] + EXTENSIONS[output_format]
+
+
+def _kind(values):
+    """'int', 'float' or 'str', whichever holds all of the values of a column. None is only held by 'str'."""
+    if all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return 'int'
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return 'float'
+    return 'str'
+
+
+class ColumnWriter(object):
+    """Has the writerow and writerows of a csv.writer: the first row is the header, which names the columns, and
+    the values of the rows after it are appended to a list per column, which are written out every ROWS_PER_BATCH
+    rows. The types of the columns are those of the first batch. close() writes the rest and gives the file its
+    name."""
+
+    def __init__(self, path, output_format):
+        self.path = path
+        self.format = output_format
+        self.temporary = path + '.tmp'
+        self.names = None
+        self.columns = None
+        self.kinds = None
+        # The pyarrow writer or the sqlite connection, and the schema or table name they write
+        self.writer = None
+        self.schema = None
+        self.table = None
+        # npz: the arrays of the batches of every column, and the code of every value of its text columns
+        self.arrays = None
+        self.levels = None
+
+    def writerow(self, row):
+        if self.names is None:
+            self.names = list(row)
+            self.columns = [[] for _ in self.names]
+        else:
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            if len(self.columns[0]) >= ROWS_PER_BATCH:
+                self.flush()
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        """Append the rows collected so far to the temporary file."""
+        if self.kinds is None:
+            self.kinds = [_kind(column) for column in self.columns]
+            self._open()
+        # A missing text is null, except in npz, which has no null and gets the empty field of the CSV file instead
+        missing = '' if self.format == 'npz' else None
+        columns = [[missing if value is None else str(value) for value in column] if kind == 'str' else column
+                   for column, kind in zip(self.columns, self.kinds)]
+        if self.format in ['parquet', 'feather']:
+            self.writer.write_table(pa.table(columns, schema=self.schema))
+
+        elif self.format == 'npz':
+            for arrays, levels, column, kind in zip(self.arrays, self.levels, columns, self.kinds):
+                if kind == 'str':
+                    arrays.append(np.array([levels.setdefault(value, len(levels)) for value in column],
+                                           dtype=np.int32))
+                else:
+                    arrays.append(np.array(column, dtype=np.int64 if kind == 'int' else np.float64))
+
+        else:
+            with self.writer:
+                self.writer.executemany('INSERT INTO %s VALUES (%s)' % (self.table, ', '.join('?' * len(self.names))),
+                                        zip(*columns))
+        self.columns = [[] for _ in self.names]
+
+    def _open(self):
+        """Start the temporary file, once the types of the columns are known."""
+        if os.path.exists(self.temporary):
+            os.remove(self.temporary)
+        if self.format in ['parquet', 'feather']:
+            types = {'int': pa.int64(), 'float': pa.float64(), 'str': pa.string()}
+            self.schema = pa.schema([(name, types[kind]) for name, kind in zip(self.names, self.kinds)])
+            if self.format == 'parquet':
+                self.writer = pq.ParquetWriter(self.temporary, self.schema)
+            else:
+                # Compressed like pyarrow.feather.write_feather does
+                options = pa.ipc.IpcWriteOptions(compression='lz4' if pa.Codec.is_available('lz4_frame') else None)
+                self.writer = pa.ipc.new_file(self.temporary, self.schema, options=options)
+
+        elif self.format == 'npz':
+            self.arrays = [[] for _ in self.names]
+            self.levels = [{} for _ in self.names]
+
+        else:
+            types = {'int': 'INTEGER', 'float': 'REAL', 'str': 'TEXT'}
+            self.table = os.path.splitext(self.path)[0].rsplit('_', 1)[-1]
+            # Batches may be written by the writer thread of the pipeline and the last one by the main thread
+            self.writer = sqlite3.connect(self.temporary, check_same_thread=False)
+            with self.writer:
+                self.writer.execute('CREATE TABLE %s (%s)' % (
+                    self.table, ', '.join('"%s" %s' % (name, types[kind]) for name, kind in zip(self.names,
+                                                                                                 self.kinds))))
+
+    def close(self):
+        """Write the rest of the rows and replace path with the file."""
+        if self.kinds is None or self.columns[0]:
+            self.flush()
+        if self.format == 'npz':
+            arrays = {}
+            for name, chunks, levels, kind in zip(self.names, self.arrays, self.levels, self.kinds):
+                column = np.concatenate(chunks)
+                if kind == 'str':
+                    # NumPy strings are all as wide as the longest, so a text column is stored like an R factor, with
+                    # its levels sorted like np.unique does
+                    values = np.array(list(levels), dtype=np.str_)
+                    order = np.argsort(values, kind='stable')
+                    codes = np.empty(len(values), dtype=np.int32)
+                    codes[order] = np.arange(len(values), dtype=np.int32)
+                    arrays[name] = codes[column]
+                    arrays[name + '_levels'] = values[order]
+                else:
+                    arrays[name] = column
+            with open(self.temporary, 'wb') as f:
+                np.savez(f, **arrays)
+        else:
+            self.writer.close()
+        os.replace(self.temporary, self.path)
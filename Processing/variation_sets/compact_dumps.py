@@ -0,0 +1,104 @@
+"""Compact utterance dumps for -o. The utterances file repeats the text of both utterances of a matched pair for
+every window size and minimum matches they match in, so with --compact get_variation_sets.py writes two files in
+its place:
+
+    ..._pairs.csv  session_id, anchor, partner, window_size, matches: one row per matched pair, the utterances given
+                   by their position in the session (counting the utterances with tokens only)
+    ..._texts.csv  session_id, utterance, utterance_id, text: the text of every utterance of a session that is in a
+                   pair, once, with its position and its id in the database
+
+The pairs are given by position rather than by database id because that is what the matching works on (and what
+the result cache and the overlap index store); the texts file maps the positions to the ids.
+
+Both are in session order. `python compact_dumps.py results/..._pairs.csv` expands them back into the
+..._utterances.csv file get_variation_sets.py writes without --compact.
+To see all of the options, you can call this script with the -h flag."""
+
+import csv
+import sys
+import argparse
+
+from itertools import groupby
+
+import utils as vs
+
+PAIRS_HEADER = ["session_id", "anchor", "partner", "window_size", "matches"]
+TEXTS_HEADER = ["session_id", "utterance", "utterance_id", "text"]
+UTTERANCES_HEADER = ["unit", "session_id", "utterance", "window_size", "matches"]
+
+# Write buffer of the output files, so that the rows go to disk in large blocks
+BUFFER_SIZE = 1 << 20
+
+
+def filenames(utterances_filename):
+    """The pairs and texts files that replace an utterances file."""
+    root = utterances_filename[:-len("_utterances.csv")]
+    return root + "_pairs.csv", root + "_texts.csv"
+
+
+def utterance_text(utterance):
+    """The tokens of an utterance (interned or not) as written in the dumps."""
+    tokens = getattr(utterance, 'tokens', utterance)
+    return ' '.join([token for token in tokens if token is not None])
+
+
+def pair_rows(pairs, window, matches, session_id):
+    """Rows for the utterance pairs, given as pairs of indices into the session's utterances."""
+    for i, j in pairs:
+        yield [session_id, i, j, window, matches]
+
+
+def text_rows(cell_pairs, utterances, session_id):
+    """Rows with the position, database id and text of every utterance in any of the lists of pairs of cell_pairs,
+    in order. The id is None if utterances (see utils.Utterances) doesn't have them."""
+    used = set()
+    for pairs in cell_pairs:
+        for pair in pairs:
+            used.update(pair)
+    ids = vs.utterance_ids(utterances)
+    for i in sorted(used):
+        yield [session_id, i, ids[i], utterance_text(utterances[i])]
+
+
+def expand(pairs_file, texts_file, utterances_file):
+    """Write the rows of the utterances file that the pairs and texts files (all open files) stand for."""
+    pairs = csv.reader(pairs_file, dialect='unix')
+    texts = csv.reader(texts_file, dialect='unix')
+    utterances = csv.writer(utterances_file, dialect='unix')
+    next(pairs)
+    next(texts)
+    utterances.writerow(UTTERANCES_HEADER)
+
+    # Both files are in session order, so only one session's texts are kept at a time
+    sessions_texts = groupby(texts, lambda row: row[0])
+    for session, session_pairs in groupby(pairs, lambda row: row[0]):
+        text_session, session_texts = next(sessions_texts)
+        while text_session != session:
+            text_session, session_texts = next(sessions_texts)
+        text = {i: t for _, i, _, t in session_texts}
+
+        rows = []
+        for cell, cell_pairs in groupby(session_pairs, lambda row: row[3:]):
+            for unit, (_, i, j, window, matches) in enumerate(cell_pairs, 1):
+                rows.append([unit, session, text[i], window, matches])
+                rows.append([unit, session, text[j], window, matches])
+        utterances.writerows(rows)
+
+
+def main(args):
+    texts_filename = args.pairs[:-len("_pairs.csv")] + "_texts.csv"
+    utterances_filename = args.pairs[:-len("_pairs.csv")] + "_utterances.csv"
+    with open(args.pairs, newline='') as pairs_file, open(texts_filename, newline='') as texts_file, \
+            open(utterances_filename, 'w', buffering=BUFFER_SIZE) as utterances_file:
+        expand(pairs_file, texts_file, utterances_file)
+    print("Wrote", utterances_filename)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Expand compact utterance dumps into an utterances file")
+    parser.add_argument("pairs", type=str, help="..._pairs.csv file written with --compact, next to its _texts.csv")
+    args = parser.parse_args()
+
+    if not args.pairs.endswith("_pairs.csv"):
+        sys.exit("Give the _pairs.csv file of a run with --compact")
+    main(args)
@@ -1,6 +1,6 @@
 """ ORM declarations, database table definitions for ACQDIV-DB """
 
-from sqlalchemy import create_engine, Text, Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import create_engine, Text, Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -54,6 +54,10 @@ class Speaker(Base):
     """ Speaker table includes a row for each speaker in a session. Speakers may appear in > 1 session.
     """
     __tablename__ = 'speakers'
+    __table_args__ = (
+        # BNC links speakers to utterances by session and label
+        Index('ix_speakers_session_label', 'session_id_fk', 'speaker_label', 'macrorole'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id_fk = Column(Integer, ForeignKey('sessions.id'))
@@ -99,6 +103,10 @@ class Utterance(Base):
             - x_raw vs x is distinction between original input and cleaned/manipulated output
     """
     __tablename__ = 'utterances'
+    __table_args__ = (
+        Index('ix_utterances_session_speaker', 'session_id_fk', 'speaker_id_fk', 'id'),
+        Index('ix_utterances_source_label', 'source_id', 'speaker_label', 'session_id_fk', 'id'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id_fk = Column(Integer, ForeignKey('sessions.id'))
@@ -132,6 +140,10 @@ class Word(Base):
     TODO: get unique words and assign ids in the postprocessor
     """
     __tablename__ = 'words'
+    __table_args__ = (
+        # covers looking up and ordering the words of utterances
+        Index('ix_words_utterance', 'utterance_id_fk', 'id', 'session_id_fk', 'word', 'pos'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id_fk = Column(Integer, ForeignKey('sessions.id'))
@@ -151,6 +163,10 @@ class Morpheme(Base):
     """ Morphemes table
     """
     __tablename__ = 'morphemes'
+    __table_args__ = (
+        # covers looking up and ordering the morphemes of utterances
+        Index('ix_morphemes_utterance', 'utterance_id_fk', 'id', 'morpheme', 'pos'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id_fk = Column(Integer, ForeignKey('sessions.id'))
@@ -165,3 +181,60 @@ class Morpheme(Base):
     pos_raw = Column(Text, nullable=True, unique=False)
     pos = Column(Text, nullable=True, unique=False)
     warning = Column(Text, nullable=True, unique=False)
+
+
+class AdultUtterance(Base):
+    """ Adult utterances per session, materialized by prepare_db.py from the utterances/speakers join.
+
+        Note:
+            - id is the utterance id
+    """
+    __tablename__ = 'adult_utterances'
+    __table_args__ = (
+        Index('ix_adult_utterances_session', 'session_id_fk', 'id'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    session_id_fk = Column(Integer, nullable=True, unique=False)
+
+
+class SpeakerResolution(Base):
+    """ The speaker of each utterance of a BNC-format database, resolved by prepare_db.py from the utterance's source
+    id and speaker label (BNC's speakers table has the source id as session_id_fk) to the speakers.id.
+
+        Note:
+            - utterance_id_fk and speaker_id_fk are utterances.id and speakers.id
+    """
+    __tablename__ = 'speaker_resolution'
+    __table_args__ = (
+        Index('ix_speaker_resolution_session', 'session_id_fk', 'utterance_id_fk', 'speaker_id_fk'),
+    )
+
+    utterance_id_fk = Column(Integer, primary_key=True)
+    speaker_id_fk = Column(Integer, primary_key=True)
+    session_id_fk = Column(Integer, nullable=True, unique=False)
+
+
+class PreparedTable(Base):
+    """ Which tables prepare_db.py has filled in, and for what.
+
+        Note:
+            - mode is the kind of database the table was made for (acqdiv or bnc)
+            - the rows are deleted by the triggers of prepared_triggers() as soon as the utterances or speakers change
+    """
+    __tablename__ = 'prepared_tables'
+
+    name = Column(Text, primary_key=True)
+    mode = Column(Text, nullable=False, unique=False)
+
+
+def prepared_triggers():
+    """(name, CREATE TRIGGER statement) of the triggers that empty prepared_tables whenever a row of the utterances or
+    speakers tables, which the prepared tables are made from, is inserted, updated or deleted."""
+    triggers = []
+    for table in ['utterances', 'speakers']:
+        for event in ['INSERT', 'UPDATE', 'DELETE']:
+            name = 'forget_prepared_on_%s_%s' % (table, event.lower())
+            triggers.append((name, 'CREATE TRIGGER IF NOT EXISTS %s AFTER %s ON %s BEGIN DELETE FROM %s; END' % (
+                name, event, table, PreparedTable.__tablename__)))
+    return triggers
@@ -1,6 +1,6 @@
 """ Quick backend for randomized data from NAL """
 
-from sqlalchemy import create_engine, Text, Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import create_engine, Text, Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -29,8 +29,16 @@ def create_tables(engine):
 
 
 class Result(Base):
+    """ One word/morpheme per row, many rows per session. The rows of a session are in the order of its (randomized)
+    utterances. The table doesn't have an id column of its own, its rowid is the row identity.
+    """
     __tablename__ = 'randomized'
-    session_id_fk = Column(Integer, primary_key=True)
+    __table_args__ = (
+        # in sqlite an index also has the rowid, so this gives the rows of a session in order
+        Index('ix_randomized_session', 'session_id_fk'),
+    )
+    id = Column('rowid', Integer, primary_key=True)
+    session_id_fk = Column(Integer, nullable=False, unique=False)
     utterance_id_fk_rand = Column(Integer, nullable=True, unique=False)
     word = Column(Text, nullable=False, unique=False)
     pos_word_stem = Column(Text, nullable=False, unique=False)
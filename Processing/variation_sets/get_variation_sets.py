@@ -7,6 +7,9 @@ import csv
 import time
 import argparse
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import partial
 from itertools import groupby
 
 import sqlalchemy as sa
@@ -14,19 +17,42 @@ import db_backend as db
 import db_backend_randomized as db_randomized
 
 import utils as vs
+import numpy_backend
+import scheduler
+import loaders
+import sqlite_backend
+import token_cache
+import checkpoint
+import result_cache
+import pipeline
+import compact_dumps
+import columnar
 
 engine = None
 conn = None
+raw = None  # sqlite3 connection of --sqlite3
 
+vocabulary = {}  # Corpus-level token ids, shared by all sessions
+similarities = {}  # SimilarityEngine by difflib threshold
 
-def setup(url):
-    """Sqlite DB connection."""
+
+def setup(url, raw_sqlite=False):
+    """Sqlite DB connection, and a read-only sqlite3 one to load the corpus with if raw_sqlite."""
+    global engine, conn, raw
+    raw = sqlite_backend.connect(url) if raw_sqlite else None
     url = "sqlite:///" + url
-    global engine, conn
-    engine = sa.create_engine(url)
+    # The pipeline loads the corpus in a thread of its own, but only ever one thread uses the connections
+    engine = sa.create_engine(url, connect_args={'check_same_thread': False})
     conn = engine.connect()
 
 
+def execute(s):
+    """Rows of a select, from the sqlite3 connection if there is one."""
+    if raw is not None:
+        return sqlite_backend.execute(raw, s)
+    return conn.execute(s)
+
+
 def file_check(out_file_name):
     """Checks to see whether a file already exists."""
     if out_file_name in os.listdir():
@@ -38,7 +64,7 @@ def file_check(out_file_name):
         return True
 
 
-def _multi_field(name):
+def _multi_field(name, args):
     """There's no way this is the most efficient way to do this but it iterates through every possible permutation of
     window size and match size.
     TODO: unnest
@@ -70,9 +96,9 @@ def _create_fields(args):
     """Create the header for the columns in the output data."""
     fields = ['session_id', 'total_utterances']
     if args.fuzzy[0] is None:
-        fields.extend(_multi_field("strict"))
+        fields.extend(_multi_field("strict", args))
     else:
-        fields.extend(_multi_field("fuzzy"))
+        fields.extend(_multi_field("fuzzy", args))
     return fields
 
 
@@ -95,21 +121,26 @@ def _win_min_iter(args):
             yield int(args.window[0]), int(args.minimum_matches[0])
 
 
-def write_dumps(utterances_to_dump, count, dump_out, window, matches, session_id, args):
-    """Write utterance pair along with item number to csv, one utterance per line"""
+def dump_rows(pairs, utterances, window, matches, session_id):
+    """Rows for the utterance pairs, given as pairs of indices into utterances, along with item number, one
+    utterance per row"""
     count = 0
-    for utterance_pair in utterances_to_dump:
+    for i, j in pairs:
         count += 1
-        if args.write_output:
-            to_write = ' '.join([i for i in utterance_pair[0] if not isinstance(i, type(None))])
-            dump_out.writerow([count, session_id, to_write, window, matches])
-            to_write = ' '.join([i for i in utterance_pair[1] if not isinstance(i, type(None))])
-            dump_out.writerow([count, session_id, to_write, window, matches])
-    return count
-
+        # interned utterances keep their tokens around for dumping
+        first = getattr(utterances[i], 'tokens', utterances[i])
+        second = getattr(utterances[j], 'tokens', utterances[j])
+        to_write = ' '.join([i for i in first if not isinstance(i, type(None))])
+        yield [count, session_id, to_write, window, matches]
+        to_write = ' '.join([i for i in second if not isinstance(i, type(None))])
+        yield [count, session_id, to_write, window, matches]
+
+
+def _out_filename(args, fuzzy=None):
+    """Create file name for output file, for the given -z value (defaults to the first)"""
+    if fuzzy is None:
+        fuzzy = args.fuzzy[0]
 
-def _out_filename(args):
-    """Create file name for output file"""
     base_name = os.path.basename(args.filename)
     file_root_name = os.path.splitext(base_name)[0]
 
@@ -129,8 +160,11 @@ def _out_filename(args):
     if args.incremental:
         filename_root += "_n"
 
-    if args.fuzzy[0]:
-        to_add = str(args.fuzzy[0])
+    if args.tail:
+        filename_root += "_t"
+
+    if fuzzy:
+        to_add = str(fuzzy)
         # remove decimal point
         to_add = to_add.replace(".", "")
         filename_root = filename_root + "_z" + to_add
@@ -144,72 +178,432 @@ def _out_filename(args):
     return counts_filename, utterances_filename
 
 
-def write_output(query, args):
-    """Write the output to disk. TODO: expand args to incorporate this."""
-    tier = args.tier  # Identify if word or morpheme tier
-    fields = _create_fields(args)  # Create column names for CSV output
+def match_session(utterances, args, stop=None, cells=None):
+    """Find the variation sets in one session, given its utterances as lists of tokens. Returns the interned
+    utterances and, for every -z value in args.fuzzy, a list of (count, matched pairs of utterance indices) for
+    every (window size, minimum matches) cell, or only the given cells. With stop, only the windows starting before
+    stop are counted (see scheduler.chunk_bounds)."""
+    if cells is None:
+        cells = list(_win_min_iter(args))  # All (window size, minimum matches) combinations
+    utterances, results, _ = match_cells(utterances, args, [cells] * len(args.fuzzy), stop=stop)
+    return utterances, results
+
+
+def match_cells(utterances, args, cells, tables=None, stop=None):
+    """Find the variation sets of a session for the (window size, minimum matches) cells of each -z value in
+    args.fuzzy, given as a list of cells per -z value. tables may have, for every -z value, a (distance, overlap
+    table) of the session worked out before (see result_cache.py), from which the cells are swept if it reaches far
+    enough and which is otherwise extended by scoring only the utterances beyond it. Returns the interned utterances,
+    the (count, matched pairs) of the cells of every -z value and the (distance, overlap table) of the -z values whose
+    table was scored here (None for the others). With stop, only the windows starting before stop are counted."""
+    # Interning every utterance once means strict matching only needs set intersections of precomputed sets and
+    # fuzzy matching can look up word pairs by id
+    utterances = vs.intern_utterances(utterances, vocabulary)
+    scored = [None] * len(args.fuzzy)
+    if not any(cells):
+        return utterances, [[] for _ in cells], scored
+    max_window = max(window_size for fuzzy_cells in cells for window_size, _ in fuzzy_cells)
+    # Incremental matching only ever compares neighbours
+    max_distance = 1 if args.incremental else max_window - 1
+
+    if args.fuzzy[0] is None and args.numpy:
+        band = numpy_backend.overlap_band(utterances, max_distance, len(vocabulary))
+        return utterances, [numpy_backend.sweep(band, cells[0], args.incremental, args.tail, args.write_output,
+                                                stop)], scored
+
+    # Scan the session once per -z value that needs it, scoring each anchor against the utterances that follow it up
+    # to the largest window (beyond what is known already), then derive every cell from that scan
+    tables = list(tables or [None] * len(args.fuzzy))
+    todo = [k for k, fuzzy_cells in enumerate(cells)
+            if fuzzy_cells and (tables[k] is None or tables[k][0] < max_distance)]
+    if todo:
+        known = min(tables[k][0] if tables[k] is not None else 0 for k in todo)
+        todo_args = argparse.Namespace(**dict(vars(args), fuzzy=[args.fuzzy[k] for k in todo]))
+        for k, score in zip(todo, session_scores(utterances, todo_args, max_distance, known + 1)):
+            if tables[k] is None:
+                table = vs.overlap_table(utterances, max_distance, score)
+            else:
+                table = vs.extend_overlap_table(utterances, [list(row) for row in tables[k][1]], max_distance, score)
+            tables[k] = scored[k] = max_distance, table
+
+    # Without -o only the counts are needed, so the matched pairs aren't kept around
+    results = [vs.sweep(tables[k][1], fuzzy_cells, args.incremental, args.tail, args.write_output, stop)
+               if fuzzy_cells else [] for k, fuzzy_cells in enumerate(cells)]
+    return utterances, results, scored
+
+
+def session_scores(utterances, args, max_distance, min_distance=1):
+    """The score of two utterances (see utils.overlap_table) for every -z value in args.fuzzy, given the interned
+    utterances of a session and the smallest and largest distance between utterances that will be scored."""
+    if args.fuzzy[0] is None:
+        return [partial(vs.match_score, match_type=None)]
+
+    elif isinstance(args.fuzzy[0], int):
+        # Find the words within levenstein distance once for the session's vocabulary, matching utterances is
+        # then a set lookup per word
+        session_vocabulary = {token: vocabulary[token] for utterance in utterances
+                              for token in utterance.tokens if token is not None}
+        if len(args.fuzzy) == 1:
+            neighbours = [vs.levenshtein_neighbours(session_vocabulary, args.fuzzy[0])]
+        else:
+            # Several distances share one graph of distances up to the largest
+            graph = vs.levenshtein_graph(session_vocabulary, max(args.fuzzy))
+            neighbours = [vs.graph_neighbours(graph, fuzzy) for fuzzy in args.fuzzy]
+        return [partial(vs.levenshtein_indexed, neighbours=n) for n in neighbours]
 
-    counts_filename, utterances_filename = _out_filename(args) # Create the filenames for counts and utterances output
+    elif len(args.fuzzy) == 1:
+        # The same word pairs recur all through a session, so difflib ratios are memoized by token id
+        return [_similarity(args.fuzzy[0]).score]
 
-    if isinstance(args.fuzzy, type(None)):
-        fuzzy = None
     else:
-        fuzzy = args.fuzzy[0]
+        # Several thresholds share one graph of the ratios of the word pairs that co-occur within the window
+        lowest = min(args.fuzzy)
+        graph = vs.similarity_graph(utterances, max_distance, lowest, _similarity(lowest), min_distance)
+        return [partial(vs.graph_score, graph=graph, threshold=fuzzy) for fuzzy in args.fuzzy]
 
-    with open(counts_filename, 'w') as counts_output, open(utterances_filename, 'w') as utterances_output:
-        counts_out = csv.writer(counts_output, dialect='unix')
-        counts_out.writerow(fields)
 
-        utterances_out = csv.writer(utterances_output, dialect='unix')
-        utterances_out.writerow(["unit", "session_id", "utterance", "window_size", "matches"])
-        count = 0
+def _similarity(threshold):
+    """SimilarityEngine for a difflib threshold, kept for the whole run."""
+    if threshold not in similarities:
+        similarities[threshold] = vs.SimilarityEngine(threshold)
+    return similarities[threshold]
 
-        # Iterate over utterances by session
-        for session, rows in groupby(query, lambda r: r['session_id']):
-            # Here are the fields being returned and an example:
-            # sesssion_id_fk, utterance_id, speaker_id, speaker macrorole, utterance
-            # e.g.: (1, 1, 5, 'Adult', 5, 'habinɨŋ habinɨŋ')
 
-            print('Processing session number:', session)
-            everything = [row for row in rows]
-
-            utterance_ids = [row[1] for row in everything]
-
-            utterances = None
-            if args.english_bnc:
-                # Special case for BNC's different database format (argh!)
-                # Note: get_utterances returns [['a', 'b'], ['x', 'a']] by type
-                utterances = get_utterances_bnc(tier, utterance_ids, args, session)
-            elif args.random_text:
-                # Case for randomized denormalized tables from NAL
-                utterances = get_utterances_randomized(tier, utterance_ids, args, session)
-            else:
-                utterances = get_utterances(tier, utterance_ids, args)
+def sessions_from_query(query, args):
+    """Yields (session_id, total_utterances, utterances) from the rows of get_session_utterances, querying the
+    words or morphemes of every session separately."""
+    tier = args.tier  # Identify if word or morpheme tier
 
-            # Begin writing output for counts
-            to_write = [session]
-            to_write.append(len(utterance_ids))
+    # Iterate over utterances by session
+    for session, rows in groupby(query, lambda r: r[0]):
+        # Here are the fields being returned and an example:
+        # sesssion_id_fk, utterance_id, speaker_id, speaker macrorole, utterance
+        # e.g.: (1, 1, 5, 'Adult', 5, 'habinɨŋ habinɨŋ')
+        everything = [row for row in rows]
+
+        utterance_ids = [row[1] for row in everything]
+
+        utterances = None
+        if args.english_bnc:
+            # Special case for BNC's different database format (argh!)
+            # Note: get_utterances returns [['a', 'b'], ['x', 'a']] by type
+            utterances = get_utterances_bnc(tier, utterance_ids, args, session)
+        elif args.random_text:
+            # Case for randomized denormalized tables from NAL
+            utterances = get_utterances_randomized(tier, utterance_ids, args, session)
+        else:
+            utterances = get_utterances(tier, utterance_ids, args)
+        yield session, len(utterance_ids), utterances
+
+
+def _lookup(utterances, args, cache):
+    """Look the cells of a session up in the result cache. Returns the session's hash, the cached results (with None
+    for the cells that aren't cached) and, for every -z value, the cells that have to be computed."""
+    digest = result_cache.session_hash(utterances)
+    cells = list(_win_min_iter(args))
+    cached = cache.get(digest, args, cells)
+    missing = [[cell for cell, result in zip(cells, fuzzy_results) if result is None] for fuzzy_results in cached]
+    return digest, cached, missing
+
+
+def _merge(cached, cells, missing, computed):
+    """Put the cached results and the results computed for the missing cells together, in the order of cells."""
+    results = []
+    for cached_results, fuzzy_missing, computed_results in zip(cached, missing, computed):
+        computed_results = dict(zip(fuzzy_missing, computed_results))
+        results.append([computed_results.get(cell, result) for cell, result in zip(cells, cached_results)])
+    return results
+
+
+def session_results(utterances, args, cache=None):
+    """match_session results of a session, computing only the cells that aren't in the result cache, from its cached
+    overlap tables where they reach far enough."""
+    if cache is None:
+        return match_session(utterances, args)[1]
+    digest, cached, missing = _lookup(utterances, args, cache)
+    if not any(missing):
+        return cached
+    tables = cache.get_tables(digest, args, missing)
+    computed, scored = match_cells(utterances, args, missing, tables)[1:]
+    cache.put(digest, args, missing, computed, scored)
+    return _merge(cached, list(_win_min_iter(args)), missing, computed)
+
+
+def session_rows(session, total_utterances, utterances, args, results=None, cache=None):
+    """Find the variation sets in one session (unless the results of match_session are given) and return, for every
+    -z value, its row of counts and the rows of each of its dump files: the utterances file, or with args.compact
+    the pairs and texts files (see compact_dumps.py)."""
+    if results is None:
+        results = session_results(utterances, args, cache)
+    cells = list(_win_min_iter(args))
+
+    rows = []
+    for fuzzy_results in results:
+        # Begin writing output for counts
+        to_write = [session]
+        to_write.append(total_utterances)
+        to_dump = []
+
+        for pair, (num_variation_sets, pairs) in zip(cells, fuzzy_results):
+            if args.compact:
+                to_dump.extend(compact_dumps.pair_rows(pairs, pair[0], pair[1], session))
+            else:
+                to_dump.extend(dump_rows(pairs, utterances, pair[0], pair[1], session))
+            to_write.append(num_variation_sets)
+        if args.compact:
+            texts = list(compact_dumps.text_rows([pairs for _, pairs in fuzzy_results], utterances, session))
+            rows.append((to_write, [to_dump, texts]))
+        else:
+            rows.append((to_write, [to_dump]))
+    return session, rows
 
-            utterances_to_dump = None
-            num_variation_sets = None
 
-            # Iterate over pairs of utterances
-            for pair in _win_min_iter(args):
-                utterances_by_window = vs.window(utterances, pair[0])
+def _similarity_counts():
+    """The hits and misses of every similarity cache of this process, by threshold."""
+    return {threshold: (similarity.hits, similarity.misses) for threshold, similarity in similarities.items()}
 
-                if args.incremental:
-                    num_variation_sets, utterances_to_dump = vs.matches_incremental(utterances_by_window, pair[1], fuzzy)
-                    if len(utterances_to_dump) > 0:
-                        count = write_dumps(utterances_to_dump, count, utterances_out, pair[0], pair[1], session, args)
 
-                # Default: anchor method
+def _match_chunk(task):
+    """match_cells results for a (utterances, stop, args, cells, tables, keep) chunk of a session, for the process
+    pool, along with the rows of the scored overlap tables for the windows of the chunk if keep, and the similarity
+    cache hits and misses of matching it, which only the worker process sees."""
+    utterances, stop, args, cells, tables, keep = task
+    before = _similarity_counts()
+    _, results, scored = match_cells(utterances, args, cells, tables, stop)
+    if keep:
+        scored = [None if table is None else (table[0], table[1][:stop]) for table in scored]
+    else:
+        scored = None
+    counts = {}
+    for threshold, (hits, misses) in _similarity_counts().items():
+        hits_before, misses_before = before.get(threshold, (0, 0))
+        counts[threshold] = hits - hits_before, misses - misses_before
+    return results, scored, counts
+
+
+def _chunk_tables(tables, first, end):
+    """The rows of the (distance, overlap table) of every -z value (or None) for the utterances of a chunk of a
+    session from first up to end, leaving out the scores of utterances beyond the chunk."""
+    return [None if table is None else
+            (table[0], [row[:end - i - 1] for i, row in enumerate(table[1][first:end], first)]) for table in tables]
+
+
+def _add_similarity_counts(counts):
+    """Add the similarity cache hits and misses of a worker to the ones reported by this process."""
+    for threshold, (hits, misses) in counts.items():
+        similarity = _similarity(threshold)
+        similarity.hits += hits
+        similarity.misses += misses
+
+
+def parallel_session_rows(sessions, args, executor=None, cache=None):
+    """Yields session_rows for every session in order, matched by a pool of args.jobs processes (or the given
+    executor). The sessions are read and scheduled in batches (see scheduler.batches), and the next batch is read
+    while the one before it is matched, so that a run still loads its sessions while the workers are busy. Within a
+    batch, the sessions are handed out largest first, splitting the ones that are too large for one process into
+    chunks. Only the cells that aren't in the result cache are computed, from its overlap tables where it has them."""
+    with ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=args.jobs))
+        submitted = None
+        for batch in scheduler.batches(sessions):
+            previous, submitted = submitted, _submit_batch(batch, args, executor, cache)
+            if previous is not None:
+                yield from _collect_batch(previous, args, cache)
+        if submitted is not None:
+            yield from _collect_batch(submitted, args, cache)
+
+
+def _submit_batch(sessions, args, executor, cache):
+    """Look a batch of sessions up in the result cache and submit the chunks of the ones with cells to compute to
+    executor. Returns what _collect_batch needs."""
+    cells = list(_win_min_iter(args))
+    if cache is None:
+        lookups = [(None, None, [cells] * len(args.fuzzy)) for _ in sessions]
+    else:
+        lookups = [_lookup(utterances, args, cache) for _, _, utterances in sessions]
+    # Only the sessions with cells to compute are scheduled
+    todo = [index for index, (_, _, missing) in enumerate(lookups) if any(missing)]
+    tables = {}
+    if cache is not None:
+        tables = {index: cache.get_tables(lookups[index][0], args, lookups[index][2]) for index in todo}
+
+    max_window = max(window_size for window_size, _ in cells)
+    max_distance = 1 if args.incremental else max_window - 1
+    costs = [scheduler.estimate_cost(sessions[index][2], max_distance,
+                                     [fuzzy for fuzzy, missing in zip(args.fuzzy, lookups[index][2]) if missing])
+             for index in todo]
+    tasks, chunks = scheduler.plan(costs, [len(sessions[index][2]) for index in todo], max_window, args.jobs)
+
+    futures = {}
+    firsts = {}
+    for k, chunk, first, stop, end in tasks:
+        index = todo[k]
+        utterances = sessions[index][2][first:end]
+        chunk_tables = _chunk_tables(tables[index], first, end) if cache is not None else None
+        futures.setdefault(index, [None] * chunks[k])[chunk] = executor.submit(
+            _match_chunk, (utterances, stop, args, lookups[index][2], chunk_tables, cache is not None))
+        firsts.setdefault(index, [None] * chunks[k])[chunk] = first
+    return sessions, lookups, futures, firsts
+
+
+def _collect_batch(batch, args, cache):
+    """Yields session_rows for every session of a batch submitted by _submit_batch, in order, storing the computed
+    cells in the result cache."""
+    sessions, lookups, futures, firsts = batch
+    cells = list(_win_min_iter(args))
+    for index, (session, total_utterances, utterances) in enumerate(sessions):
+        digest, cached, missing = lookups[index]
+        if any(missing):
+            chunk_results = []
+            chunk_tables = []
+            for future in futures.pop(index):
+                results, scored, counts = future.result()
+                _add_similarity_counts(counts)
+                chunk_results.append(results)
+                chunk_tables.append(scored)
+            results = scheduler.stitch(chunk_results, firsts[index])
+        if cache is not None and any(missing):
+            cache.put(digest, args, missing, results, scheduler.stitch_tables(chunk_tables))
+            results = _merge(cached, cells, missing, results)
+        elif cache is not None:
+            results = cached
+        yield session_rows(session, total_utterances, utterances, args, results)
+
+
+def _checkpoint_filename(args):
+    """Name of the checkpoint of a run, next to its output files."""
+    counts_filename, _ = _out_filename(args)
+    return counts_filename[:-len("_counts.csv")] + "_checkpoint.sqlite3"
+
+
+def _run_key(args):
+    """The arguments that decide what a run writes, so that a checkpoint is only resumed by the same run."""
+    options = ['filename', 'tier', 'window', 'minimum_matches', 'incremental', 'nouns_verbs', 'fuzzy', 'english_bnc',
+               'chintang_adults', 'random_text', 'write_output', 'tail', 'case_folding', 'compact']
+    return {option: getattr(args, option) for option in options}
+
+
+def write_output(sessions, args, executor=None, index=None):
+    """Write the output to disk, one counts and one utterances file for every -z value, given the
+    (session_id, total_utterances, utterances) of every session. The sessions are matched in parallel with
+    args.jobs > 1 or if a process pool executor is given, or not at all if their results are looked up in an
+    overlap_index.OverlapIndex. With args.checkpoint every finished session is checkpointed, and with args.resume the
+    sessions of an earlier run with a checkpoint that was cut short are skipped and the rest appended. Unless
+    args.queue_size is 0, the sessions are loaded and written by threads of their own while others are matched (see
+    pipeline.py), also with args.jobs > 1 (see parallel_session_rows).
+    TODO: expand args to incorporate this."""
+    fields = _create_fields(args)  # Create column names for CSV output
+    filenames = []
+    headers = []
+    for fuzzy in args.fuzzy:
+        # Create the filenames for counts and utterances output
+        counts_filename, utterances_filename = _out_filename(args, fuzzy)
+        filenames.append(counts_filename)
+        headers.append(fields)
+        if args.compact:
+            filenames.extend(compact_dumps.filenames(utterances_filename))
+            headers.extend([compact_dumps.PAIRS_HEADER, compact_dumps.TEXTS_HEADER])
+        else:
+            filenames.append(utterances_filename)
+            headers.append(compact_dumps.UTTERANCES_HEADER)
+    if args.output_format != 'csv':
+        filenames = [columnar.filename(filename, args.output_format) for filename in filenames]
+
+    stats = []
+    if args.queue_size:
+        # Load the next sessions while this one is matched
+        sessions = loaded = pipeline.prefetch(sessions, stats, args.queue_size)
+
+    journal = None
+    sizes = None
+    if args.checkpoint:
+        try:
+            journal = checkpoint.Checkpoint(_checkpoint_filename(args), _run_key(args), args.resume)
+        except ValueError as e:
+            sys.exit("Can't resume: %s, run again without --resume" % e)
+        sizes = journal.sizes()
+    if sizes is not None:
+        if not all(os.path.exists(filename) and os.path.getsize(filename) >= size
+                   for filename, size in zip(filenames, sizes)):
+            sys.exit("Can't resume: the output files are missing or shorter than in the checkpoint, run again without "
+                     "--resume")
+        finished = journal.sessions()
+        print("Resuming after %d finished sessions" % len(finished))
+        sessions = ((session, total, utterances) for session, total, utterances in sessions
+                    if session not in finished)
+
+    with ExitStack() as stack:
+        if args.queue_size:
+            # Stop the loader if the run stops early
+            stack.callback(loaded.close)
+        cache = None
+        if args.result_cache:
+            cache = result_cache.ResultCache(args.result_cache, args.result_cache_size << 20)
+            stack.callback(cache.close)
+
+        if index is not None:
+            results = (session_rows(session, total, utterances, args, index.results(session, args))
+                       for session, total, utterances in sessions)
+        elif executor is not None or args.jobs > 1:
+            results = parallel_session_rows(sessions, args, executor, cache)
+        else:
+            results = (session_rows(session, total, utterances, args, cache=cache)
+                       for session, total, utterances in sessions)
+
+        files = []
+        if args.output_format == 'csv':
+            for k, filename in enumerate(filenames):
+                if sizes is None:
+                    files.append(stack.enter_context(open(filename, 'w', buffering=compact_dumps.BUFFER_SIZE)))
                 else:
-                    num_variation_sets, utterances_to_dump = vs.matches_anchor(utterances_by_window, pair[1], fuzzy)
-                    if len(utterances_to_dump) > 0:
-                        count = write_dumps(utterances_to_dump, count, utterances_out, pair[0], pair[1], session, args)
+                    # Drop whatever was written of the session the earlier run was cut short in
+                    os.truncate(filename, sizes[k])
+                    files.append(stack.enter_context(open(filename, 'a', buffering=compact_dumps.BUFFER_SIZE)))
+            outputs = [csv.writer(f, dialect='unix') for f in files]
+        else:
+            outputs = [columnar.ColumnWriter(filename, args.output_format) for filename in filenames]
+        if sizes is None:
+            for out, header in zip(outputs, headers):
+                out.writerow(header)
+        # The counts file and the dump files of each -z value
+        per_fuzzy = len(outputs) // len(args.fuzzy)
+
+        def write_session(result):
+            session, rows = result
+            print('Processing session number:', session)
+            for k, (to_write, dumps) in enumerate(rows):
+                counts_out, *dump_outs = outputs[k * per_fuzzy:(k + 1) * per_fuzzy]
+                for dump_out, to_dump in zip(dump_outs, dumps):
+                    dump_out.writerows(to_dump)
+                counts_out.writerow(to_write)
+            if journal is not None:
+                for f in files:
+                    f.flush()
+                journal.record(session, [f.tell() for f in files])
+
+        if args.queue_size:
+            with pipeline.Writer(write_session, stats, args.queue_size) as writer:
+                for result in results:
+                    writer.put(result)
+        else:
+            for result in results:
+                write_session(result)
+        if args.output_format != 'csv':
+            for out in outputs:
+                out.close()
+
+        for stage in stats:
+            print("Pipeline:", stage.describe())
+        if cache is not None:
+            print("Result cache: %d cells cached, %d computed (%.1f%% hit rate)" % (
+                cache.hits, cache.misses, 100 * cache.hit_rate()))
+    if journal is not None:
+        journal.finish()
 
-                to_write.append(num_variation_sets)
-            counts_out.writerow(to_write)
+    for threshold, similarity in sorted(similarities.items()):
+        print("Similarity cache for %s: %d hits, %d misses (%.1f%% hit rate)" % (
+            threshold, similarity.hits, similarity.misses, 100 * similarity.hit_rate()))
 
 
 def _range_check(the_args):
@@ -227,17 +621,19 @@ def _range_check(the_args):
 
 
 def _type_checker(the_args):
-    try:
-        the_args = the_args[0]
-    except TypeError:
-        pass
-
+    """Turn the -z values into a list of integers (levenstein) or floats (difflib), or [None] for strict."""
     if the_args is None:
         return [None]
-    try:
-        return [int(the_args)]
-    except ValueError:
-        return [float(the_args)]
+    if isinstance(the_args, str):
+        the_args = [the_args]
+
+    fuzzy = []
+    for the_arg in the_args:
+        try:
+            fuzzy.append(int(the_arg))
+        except ValueError:
+            fuzzy.append(float(the_arg))
+    return fuzzy
 
 
 def get_utterances(tier, utterance_ids, args):
@@ -248,8 +644,8 @@ def get_utterances(tier, utterance_ids, args):
         s = sa.select([
             db.Word.utterance_id_fk.label('uid'), db.Word.word, db.Word.pos
         ], db.Word.utterance_id_fk.in_(utterance_ids)).order_by(db.Word.id)
-        query = conn.execute(s)
-        for utterance, words in groupby(query, lambda r: r['uid']):
+        query = execute(s)
+        for utterance, words in groupby(query, lambda r: r[0]):
             temp = []
             for word in words:
                 if args.nouns_verbs:
@@ -264,8 +660,8 @@ def get_utterances(tier, utterance_ids, args):
             [db.Morpheme.utterance_id_fk.label('uid'), db.Morpheme.morpheme,
                 db.Morpheme.pos],
             db.Morpheme.utterance_id_fk.in_(utterance_ids)).order_by(db.Morpheme.id)
-        query = conn.execute(s)
-        for utterance, morphemes in groupby(query, lambda r: r['uid']):
+        query = execute(s)
+        for utterance, morphemes in groupby(query, lambda r: r[0]):
             temp = []
             for morpheme in morphemes:
                 if morpheme[1]:
@@ -285,8 +681,8 @@ def get_utterances_randomized(tier, utterance_ids, args, session):
                        db_randomized.Result.word,
                        db_randomized.Result.pos,
                        db_randomized.Result.session_id_fk]).where(db_randomized.Result.session_id_fk == session)
-        query = conn.execute(s)
-        for utterance, words in groupby(query, lambda r: r['uid']):
+        query = execute(s)
+        for utterance, words in groupby(query, lambda r: r[0]):
             temp = []
             for word in words:
                 if args.nouns_verbs:
@@ -301,8 +697,8 @@ def get_utterances_randomized(tier, utterance_ids, args, session):
                        db_randomized.Result.morpheme,
                        db_randomized.Result.pos,
                        db_randomized.Result.session_id_fk]).where(db_randomized.Result.session_id_fk == session)
-        query = conn.execute(s)
-        for utterance, morphemes in groupby(query, lambda r: r['uid']):
+        query = execute(s)
+        for utterance, morphemes in groupby(query, lambda r: r[0]):
             temp = []
             for morpheme in morphemes:
                 if morpheme[1]:
@@ -323,8 +719,8 @@ def get_utterances_bnc(tier, utterance_ids, args, session):
         s = sa.select([
             db.Word.utterance_id_fk.label('uid'), db.Word.word, db.Word.pos, db.Word.session_id_fk,
         ]).where(sa.and_(db.Word.session_id_fk == session, db.Word.utterance_id_fk.in_(utterance_ids))).order_by(db.Word.id)
-        query = conn.execute(s)
-        for utterance, words in groupby(query, lambda r: r['uid']):
+        query = execute(s)
+        for utterance, words in groupby(query, lambda r: r[0]):
             temp = []
             for word in words:
                 if args.nouns_verbs:
@@ -339,8 +735,8 @@ def get_utterances_bnc(tier, utterance_ids, args, session):
             [db.Morpheme.utterance_id_fk.label('uid'), db.Morpheme.morpheme,
                 db.Morpheme.pos],
             db.Morpheme.utterance_id_fk.in_(utterance_ids)).order_by(db.Morpheme.id)
-        query = conn.execute(s)
-        for utterance, morphemes in groupby(query, lambda r: r['uid']):
+        query = execute(s)
+        for utterance, morphemes in groupby(query, lambda r: r[0]):
             temp = []
             for morpheme in morphemes:
                 if morpheme[1]:
@@ -359,7 +755,7 @@ def get_session_utterances(args):
         # s = sa.select([db_randomized.Result.session_id_fk.label('session_id'), db_randomized.Result.utterance_id_fk_rand]).distinct()
         s = sa.select([db_randomized.Result.session_id_fk.label('session_id'),
                        db_randomized.Result.utterance_id_fk_rand]).distinct()
-        query = conn.execute(s)
+        query = execute(s)
         return query
 
     elif args.english_bnc:
@@ -374,7 +770,7 @@ def get_session_utterances(args):
             db.Utterance.source_id == db.Speaker.session_id_fk,
             db.Utterance.speaker_label == db.Speaker.speaker_label,
             db.Speaker.macrorole == "Adult")).order_by(db.Utterance.session_id_fk, db.Utterance.id)
-        query = conn.execute(s)
+        query = execute(s)
         return query
 
     elif args.chintang_adults:
@@ -393,7 +789,7 @@ def get_session_utterances(args):
             db.Utterance.session_id_fk == db.Speaker.session_id_fk,
             db.Utterance.speaker_id_fk == db.Speaker.id,
             db.Speaker.macrorole == "Adult")).order_by(db.Utterance.id)
-        query = conn.execute(s)
+        query = execute(s)
         return query
 
     else:
@@ -408,18 +804,33 @@ def get_session_utterances(args):
             db.Utterance.session_id_fk == db.Speaker.session_id_fk,
             db.Utterance.speaker_id_fk == db.Speaker.id,
             db.Speaker.macrorole == "Adult")).order_by(db.Utterance.id)
-        query = conn.execute(s)
+        query = execute(s)
         return query
 
 
+def load_sessions(args):
+    """Returns the (session_id, total_utterances, utterances) of every session from the database."""
+    # Read the whole corpus with one query instead of one query per session
+    return loaders.load_sessions(conn, args, raw)
+
+
+def read_sessions(args):
+    """Returns the (session_id, total_utterances, utterances) of every session of the database in args.filename,
+    from the token cache if --cache is given."""
+    setup(args.filename, args.raw_sqlite)
+    if args.cache:
+        return token_cache.cached_sessions(args.cache, args.filename, args, partial(load_sessions, args))
+    return load_sessions(args)
+
+
 def main(args):
-    setup(args.filename)
-    query = get_session_utterances(args)
+    sessions = read_sessions(args)
     # file_check(out_file)  # Check if file already exists on disk (give user option for exiting)
-    write_output(query, args)  # Write CSV to disk
+    write_output(sessions, args)  # Write CSV to disk
 
 
-if __name__ == "__main__":
+def get_parser():
+    """The command line parser of get_variation_sets.py."""
     parser = argparse.ArgumentParser(description="Search for variation sets")
     parser.add_argument("-f", "--file", dest="filename", type=str, help="required: name of file *.sqlite")
     parser.add_argument("-t", "--tier", dest="tier", type=str, default="words", help="morphemes or words; "
@@ -435,7 +846,12 @@ if __name__ == "__main__":
     parser.add_argument("-v", dest="nouns_verbs", action="store_true",
                         help="make variation sets only on nouns and verbs")
     parser.add_argument("-z", dest="fuzzy", action="append",
-                        help="fuzzy matching, number is how much overlap there should be")
+                        help="""fuzzy matching, number is how much overlap there should be; use several times to
+                        get the output for several thresholds in one run ex: -z 0.6 -z 0.8""")
+    parser.add_argument("--case-folding", dest="case_folding", action="append",
+                        help="""how tokens are lowercased: unicode (like Python, the default), ascii (only ASCII
+                        letters, all in SQLite) or none (the default for BNC); use LANGUAGE=RULE to set the rule of the
+                        sessions in one language, ex: --case-folding none --case-folding Russian=unicode""")
     parser.add_argument("-e", dest="english_bnc", action="store_true",
                         help="Run this code on the English BNC corpus")
     parser.add_argument("-c", dest="chintang_adults", action="store_true",
@@ -444,9 +860,45 @@ if __name__ == "__main__":
                         help="Run this code on the randomized data")
     parser.add_argument("-o", dest="write_output", action="store_true",
                         help="Write the utterances to disk")
-
-
-    args = parser.parse_args()
+    parser.add_argument("--compact", dest="compact", action="store_true",
+                        help="""with -o, write the matched pairs and the text of their utterances to separate, much
+                        smaller files (see compact_dumps.py)""")
+    parser.add_argument("--format", dest="output_format", choices=columnar.FORMATS, default="csv",
+                        help="""write typed columnar files instead of CSV: parquet or feather (requires pyarrow), npz
+                        (requires numpy) or sqlite; columnar picks the first of parquet, npz and sqlite that can be
+                        written. The files are named as the CSV files, with another extension""")
+    parser.add_argument("--tail", dest="tail", action="store_true",
+                        help="""keep sliding the window to the end of each session, so that the last utterances are
+                        anchors too (fixes the fence post problem)""")
+    parser.add_argument("--checkpoint", dest="checkpoint", action="store_true",
+                        help="""record every finished session in a checkpoint next to the output files, so that the
+                        run can be carried on with --resume if it is cut short""")
+    parser.add_argument("--resume", dest="resume", action="store_true",
+                        help="""carry on with a run with --checkpoint that was cut short, skipping the sessions it
+                        finished and appending the others to its output files""")
+    parser.add_argument("--queue-size", dest="queue_size", type=int, default=pipeline.QUEUE_SIZE,
+                        help="""sessions that are loaded ahead of and waiting to be written behind the one that is
+                        matched; 0 loads, matches and writes one session after another""")
+    parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1,
+                        help="number of processes to match sessions in; the output is the same as with one")
+    parser.add_argument("--cache", dest="cache", type=str,
+                        help="""directory for caching the tokenised database, so that later runs on the same database,
+                        tier and -v don't have to read it again (requires numpy)""")
+    parser.add_argument("--result-cache", dest="result_cache", type=str,
+                        help="""file to cache the counts (and with -o the matches) of every window size and minimum
+                        matches in, so that a later run over a wider range only computes the new ones""")
+    parser.add_argument("--result-cache-size", dest="result_cache_size", type=int, default=1024,
+                        help="size in MB the result cache is kept under, the least recently used results are dropped")
+    parser.add_argument("--sqlite3", dest="raw_sqlite", action="store_true",
+                        help="read the database with the sqlite3 module instead of SQLAlchemy, which is faster")
+    parser.add_argument("--numpy", dest="numpy", action="store_true",
+                        help="Use the vectorized NumPy backend for strict matching (requires numpy)")
+    return parser
+
+
+def parse_args(argv=None):
+    """Parse and check the command line arguments (sys.argv by default), exiting with a message if they are wrong."""
+    args = get_parser().parse_args(argv)
 
     if not args.filename:
         sys.exit("You need to pass a filename: -f filename")
@@ -455,8 +907,42 @@ if __name__ == "__main__":
 
     args.fuzzy = _type_checker(args.fuzzy)
 
+    try:
+        loaders.parse_case_folding(args.case_folding)
+    except ValueError as e:
+        sys.exit("--case-folding: %s" % e)
+
+    if len(set(type(fuzzy) for fuzzy in args.fuzzy)) > 1:
+        sys.exit("-z values must either all be integers or all be floats")
+    if args.cache and not token_cache.available():
+        sys.exit("--cache requires numpy: pip install numpy")
+    if args.numpy and not numpy_backend.available():
+        sys.exit("--numpy requires numpy: pip install numpy")
+    args.output_format = columnar.resolve(args.output_format)
+    if not columnar.available(args.output_format):
+        needs = "numpy" if args.output_format == 'npz' else "pyarrow"
+        sys.exit("--format %s requires %s: pip install %s" % (args.output_format, needs, needs))
+    # Resuming carries on checkpointing
+    args.checkpoint = args.checkpoint or args.resume
+    if args.checkpoint and args.output_format != 'csv':
+        sys.exit("--checkpoint and --resume only work with CSV output, the other formats are written at the end of the "
+                 "run")
+    if args.compact and not args.write_output:
+        sys.exit("--compact only changes the utterance files of -o")
+    if args.queue_size < 0:
+        sys.exit("--queue-size can't be negative")
+    if args.result_cache_size < 1:
+        sys.exit("--result-cache-size must be at least 1")
+    if args.numpy and args.fuzzy[0] is not None:
+        sys.exit("--numpy only supports strict matching, it can't be combined with -z")
+
     _range_check(args.window)
     _range_check(args.minimum_matches)
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
 
     # Main
     start_time = time.time()
@@ -0,0 +1,297 @@
+"""Streaming corpus loaders. Instead of first listing the utterance ids of every session and then querying their
+words or morphemes with one IN (...) per session, a loader reads the whole corpus with one joined query ordered
+by session and utterance, and yields the sessions ready to be matched."""
+
+from itertools import groupby
+
+import sqlalchemy as sa
+import db_backend as db
+import db_backend_randomized as db_randomized
+import sqlite_backend
+import utils as vs
+
+# Chintang adult session IDs that aren't missing speaker information
+CHINTANG_ADULT_SESSIONS = [498, 504, 506, 520, 527, 533, 561, 562, 576, 577, 582, 587, 665, 671, 689, 700, 702, 711]
+
+# How tokens are case-folded: lowercased the way Python does it (str.lower(), which SQLite can't do), only ASCII
+# letters lowercased (lower() in SQLite), or not at all
+CASE_FOLDING_RULES = ['unicode', 'ascii', 'none']
+ASCII_LOWER = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+
+def _tier_columns(tier):
+    """Table and (id, utterance id, session id, token, pos) columns of a tier."""
+    if tier == 'words':
+        return db.Word, (db.Word.id, db.Word.utterance_id_fk, db.Word.session_id_fk, db.Word.word, db.Word.pos)
+    return db.Morpheme, (db.Morpheme.id, db.Morpheme.utterance_id_fk, db.Morpheme.session_id_fk,
+                         db.Morpheme.morpheme, db.Morpheme.pos)
+
+
+def speaker_resolution_query():
+    """Select of the (utterance id, speaker id, session id) of every utterance of a BNC-format database, whose speakers
+    are linked by the session's source id and the speaker label."""
+    return sa.select([db.Utterance.id, db.Speaker.id, db.Utterance.session_id_fk]).select_from(
+        sa.join(db.Utterance, db.Speaker, sa.and_(db.Utterance.source_id == db.Speaker.session_id_fk,
+                                                  db.Utterance.speaker_label == db.Speaker.speaker_label)))
+
+
+def adult_utterances_query(args, resolved=False):
+    """Select of the (session id, utterance id) of every adult utterance, finding the speakers of utterances the
+    ACQDIV or the BNC way depending on args. If resolved, BNC's speakers are found by their integer ids in the
+    speaker_resolution table made by prepare_db.py. Every utterance comes out once, even if its BNC source id and
+    speaker label match several adult speakers."""
+    if args.english_bnc and resolved:
+        resolution = db.SpeakerResolution.__table__
+        adult = sa.exists().where(sa.and_(resolution.c.speaker_id_fk == db.Speaker.id, db.Speaker.macrorole == "Adult"))
+        return sa.select([resolution.c.session_id_fk, resolution.c.utterance_id_fk.label('id')]).where(
+            adult).distinct()
+    if args.english_bnc:
+        # BNC's speakers are linked by the session's source id and the speaker label
+        speakers = sa.and_(db.Utterance.source_id == db.Speaker.session_id_fk,
+                           db.Utterance.speaker_label == db.Speaker.speaker_label,
+                           db.Speaker.macrorole == "Adult")
+    else:
+        speakers = sa.and_(db.Utterance.session_id_fk == db.Speaker.session_id_fk,
+                           db.Utterance.speaker_id_fk == db.Speaker.id,
+                           db.Speaker.macrorole == "Adult")
+    # EXISTS rather than a join, which would repeat an utterance for every speaker it matches
+    return sa.select([db.Utterance.session_id_fk, db.Utterance.id]).where(sa.exists().where(speakers))
+
+
+def parse_case_folding(options, default='unicode'):
+    """Given --case-folding options, RULE for all languages or LANGUAGE=RULE for one, returns the default rule (the
+    given one if there's no option for it) and a dict of the rules by language. Raises ValueError for an unknown
+    rule."""
+    languages = {}
+    for option in options or []:
+        language, _, rule = option.rpartition('=')
+        if rule not in CASE_FOLDING_RULES:
+            raise ValueError("unknown case folding rule %r, use one of: %s" % (rule, ", ".join(CASE_FOLDING_RULES)))
+        if language:
+            languages[language] = rule
+        else:
+            default = rule
+    return default, languages
+
+
+def _default_case_folding(args):
+    """ACQDIV is lowercased the way Python does it, BNC and the randomized data aren't case-folded."""
+    return 'none' if args.english_bnc or args.random_text else 'unicode'
+
+
+def session_case_folding(conn, args):
+    """The default case folding rule and a dict of the rules of the sessions whose language has its own rule."""
+    default, languages = parse_case_folding(args.case_folding, _default_case_folding(args))
+    if not languages:
+        return default, {}
+    rows = conn.execute(sa.select([db.Session.id, db.Session.language]).where(db.Session.language.in_(languages)))
+    return default, {session: languages[language] for session, language in rows}
+
+
+def _fold(token, session_column, folding):
+    """The token column, lowercased by SQLite in the sessions with the ascii rule."""
+    default, sessions = folding
+    lowered = sa.func.lower(token)
+    if default == 'ascii':
+        exceptions = sorted(session for session, rule in sessions.items() if rule != 'ascii')
+        return sa.case([(session_column.in_(exceptions), token)], else_=lowered) if exceptions else lowered
+    exceptions = sorted(session for session, rule in sessions.items() if rule == 'ascii')
+    return sa.case([(session_column.in_(exceptions), lowered)], else_=token) if exceptions else token
+
+
+def corpus_query(args, materialized=False, folding=None, resolved=False):
+    """One select over the adult utterances of the corpus joined to their words or morphemes, ordered by session,
+    utterance and token. Empty morphemes and, with -v, tokens other than nouns and verbs are left out by the join and
+    the tokens of the sessions with the ascii rule are lowercased by SQLite, according to folding (see
+    session_case_folding, the default rule of args if not given). Utterances without any words/morphemes that pass
+    come out as one row with a NULL token id, and has_tokens tells apart the ones that do have words/morphemes in the
+    database.
+    If materialized, the adult utterances are read from the adult_utterances table made by prepare_db.py instead of
+    joining utterances to speakers, otherwise resolved is passed on to adult_utterances_query."""
+    table, (token_id, utterance_id_fk, session_id_fk, token, pos) = _tier_columns(args.tier)
+    if folding is None:
+        folding = _default_case_folding(args), {}
+
+    if materialized:
+        utterances = db.AdultUtterance.__table__
+    else:
+        utterances = adult_utterances_query(args, resolved).alias('adult_utterances')
+    session_column = utterances.c.session_id_fk
+    utterance_column = utterances.c.id
+
+    tokens = utterance_id_fk == utterance_column
+    if args.english_bnc and args.tier == 'words':
+        tokens = sa.and_(tokens, session_id_fk == session_column)
+
+    filters = []
+    if args.tier == 'morphemes':
+        filters.extend([token.isnot(None), token != ''])
+    if args.nouns_verbs:
+        filters.append(pos.in_(['N', 'V']))
+
+    if filters:
+        # An utterance whose tokens are all filtered out is still a (empty) utterance
+        unfiltered = table.__table__.alias('unfiltered')
+        exists = unfiltered.c.utterance_id_fk == utterance_column
+        if args.english_bnc and args.tier == 'words':
+            exists = sa.and_(exists, unfiltered.c.session_id_fk == session_column)
+        has_tokens = sa.case([(token_id.is_(None), sa.exists().where(exists))], else_=sa.true())
+        tokens = sa.and_(tokens, *filters)
+    else:
+        has_tokens = token_id.isnot(None)
+
+    s = sa.select([session_column.label('session_id'),
+                   utterance_column.label('uid'),
+                   token_id.label('token_id'),
+                   _fold(token, session_column, folding).label('token'),
+                   has_tokens.label('has_tokens')]).select_from(utterances.outerjoin(table, tokens))
+    if args.chintang_adults and not args.english_bnc:
+        s = s.where(session_column.in_(CHINTANG_ADULT_SESSIONS))
+    return s.order_by(session_column, utterance_column, token_id)
+
+
+def randomized_query(args):
+    """One select over the randomized table, ordered by session and, within a session, by row, i.e. in the order of
+    the (randomized) utterances and their tokens."""
+    token = db_randomized.Result.word if args.tier == 'words' else db_randomized.Result.morpheme
+    return sa.select([db_randomized.Result.session_id_fk.label('session_id'),
+                      db_randomized.Result.utterance_id_fk_rand.label('uid'),
+                      token.label('token'),
+                      db_randomized.Result.pos.label('pos')]).order_by(db_randomized.Result.session_id_fk,
+                                                                       db_randomized.Result.id)
+
+
+def sessions_from_randomized_rows(rows, args, rule='none'):
+    """Given (session_id, uid, token, pos) rows of randomized_query, yields (session_id, total_utterances, utterances)
+    the same as get_variation_sets.get_utterances_randomized: every run of rows of an utterance is an utterance, empty
+    if all of its tokens are filtered out, and the total is the number of distinct utterance ids. The utterances are a
+    utils.Utterances with the utterance ids."""
+    morphemes = args.tier == 'morphemes'
+    for session, session_rows in groupby(rows, lambda r: r[0]):
+        uids = set()
+        utterances = vs.Utterances()
+        for uid, tokens in groupby(session_rows, lambda r: r[1]):
+            uids.add(uid)
+            utterances.utterance_ids.append(uid)
+            temp = []
+            for row in tokens:
+                token = row[2]
+                if morphemes and not token:
+                    continue
+                if args.nouns_verbs and row[3] != 'N' and row[3] != 'V':
+                    continue
+                if token is not None and rule != 'none':
+                    token = token.lower() if rule == 'unicode' else _ascii_lower(token)
+                temp.append(token)
+            utterances.append(temp)
+        yield session, len(uids), utterances
+
+
+def _ascii_lower(token):
+    """Lowercase only A-Z, like SQLite's lower()."""
+    return token.translate(ASCII_LOWER)
+
+
+def _has_rows(conn, table):
+    """Whether the table is in the database and isn't empty."""
+    if not conn.dialect.has_table(conn, table.name):
+        return False
+    return conn.execute(sa.select([sa.literal(1)]).select_from(table).limit(1)).first() is not None
+
+
+def prepared_mode(args):
+    """The kind of database a table made by prepare_db.py is for, as the join of utterances and speakers differs."""
+    return 'bnc' if args.english_bnc else 'acqdiv'
+
+
+def _is_prepared(conn, table, mode):
+    """Whether prepare_db.py has filled in the table for mode and the utterances and speakers haven't changed since,
+    which the triggers of db_backend.prepared_triggers() keep track of. A table made for another mode or before the
+    database changed is reported and not used."""
+    if not _has_rows(conn, table):
+        return False
+    prepared = db.PreparedTable.__table__
+    row = None
+    triggers = [name for name, _ in db.prepared_triggers()]
+    if conn.dialect.has_table(conn, prepared.name) and conn.execute(
+            sa.text("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name IN :names").bindparams(
+                sa.bindparam('names', expanding=True)), names=triggers).scalar() == len(triggers):
+        row = conn.execute(sa.select([prepared.c.mode]).where(prepared.c.name == table.name)).first()
+    if row is None or row[0] != mode:
+        print("Not using the %s table, it is out of date; rerun prepare_db.py" % table.name)
+        return False
+    return True
+
+
+def is_materialized(conn, args):
+    """Whether prepare_db.py has filled in the adult_utterances table for the kind of database of args."""
+    return _is_prepared(conn, db.AdultUtterance.__table__, prepared_mode(args))
+
+
+def is_resolved(conn):
+    """Whether prepare_db.py has filled in the speaker_resolution table."""
+    return _is_prepared(conn, db.SpeakerResolution.__table__, 'bnc')
+
+
+def _describe(args):
+    """Print which kind of corpus is being loaded."""
+    if args.random_text:
+        print("Processing randomized text format")
+    elif args.english_bnc:
+        print("Processing English BNC corpus for ADS")
+    elif args.chintang_adults:
+        print("Processing Chintang ADS in ACQDIV database format")
+    else:
+        print("Processing ACQDIV database for CDS")
+
+
+def sessions_from_rows(rows, args, folding=None):
+    """Given (session_id, uid, token_id, token, has_tokens) rows of corpus_query, yields
+    (session_id, total_utterances, utterances) with the utterances as lists of tokens, the same as
+    get_variation_sets.get_utterances and get_utterances_bnc. Utterances without any tokens count towards the total
+    but aren't in the list, like with the per-session queries, while the ones whose tokens are all filtered out are
+    kept as empty lists. The tokens of the sessions with the unicode rule of folding are lowercased here. The
+    utterances are a utils.Utterances with the database id of every utterance."""
+    default, sessions = folding or (_default_case_folding(args), {})
+    for session, session_rows in groupby(rows, lambda r: r[0]):
+        lower = sessions.get(session, default) == 'unicode'
+        total = 0
+        utterances = vs.Utterances()
+        for uid, tokens in groupby(session_rows, lambda r: r[1]):
+            total += 1
+            first = next(tokens)
+            if first[2] is None:
+                # outer join row of an utterance without words/morphemes that pass the filters
+                if first[4]:
+                    utterances.append([])
+                    utterances.utterance_ids.append(uid)
+                continue
+            if lower:
+                utterance = [first[3] if first[3] is None else first[3].lower()]
+                utterance.extend(row[3] if row[3] is None else row[3].lower() for row in tokens)
+            else:
+                utterance = [first[3]]
+                utterance.extend(row[3] for row in tokens)
+            utterances.append(utterance)
+            utterances.utterance_ids.append(uid)
+        yield session, total, utterances
+
+
+def load_sessions(conn, args, raw=None):
+    """Yields (session_id, total_utterances, utterances) for every session, reading the whole corpus (ACQDIV, the
+    Chintang adults, BNC or the randomized data, depending on args) with a single query. If raw, a connection from
+    sqlite_backend.connect(), the query is run on it instead."""
+    _describe(args)
+    if args.random_text:
+        # The randomized table doesn't know the language of its sessions
+        rule = parse_case_folding(args.case_folding, _default_case_folding(args))[0]
+        query = randomized_query(args)
+        rows = conn.execute(query) if raw is None else sqlite_backend.execute(raw, query)
+        return sessions_from_randomized_rows(rows, args, rule)
+    folding = session_case_folding(conn, args)
+    materialized = is_materialized(conn, args)
+    resolved = args.english_bnc and not materialized and is_resolved(conn)
+    query = corpus_query(args, materialized, folding, resolved)
+    if raw is not None:
+        return sessions_from_rows(sqlite_backend.execute(raw, query), args, folding)
+    return sessions_from_rows(conn.execute(query), args, folding)
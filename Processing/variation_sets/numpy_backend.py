@@ -0,0 +1,96 @@
+"""Optional NumPy backend for strict variation set counting.
+
+A session is turned into a sparse utterance x vocabulary incidence (one key per unique token id in an utterance)
+and the overlap of every utterance with the utterances that follow it is computed only within the band up to the
+largest window, by intersecting the keys with a shifted copy of themselves. The anchor and incremental counts then
+become array reductions over that band. Requires numpy; see available()."""
+
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def available():
+    """Whether numpy could be imported."""
+    return np is not None
+
+
+def overlap_band(interned, max_distance, vocabulary_size):
+    """Given a session of interned utterances (see utils.intern_utterances), returns an array of shape
+    (utterances, max_distance) where band[i, k - 1] is the number of token ids utterance i shares with utterance
+    i + k, i.e. the strict utils.overlap_table. Cells past the end of the session are -1."""
+    n = len(interned)
+    band = np.full((n, max_distance), -1, dtype=np.int64)
+    if n == 0 or max_distance < 1:
+        return band
+
+    lengths = np.fromiter((len(utterance) for utterance in interned), dtype=np.int64, count=n)
+    rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+    token_ids = np.fromiter(chain.from_iterable(interned), dtype=np.int64, count=int(lengths.sum()))
+    # vocabulary_size is only a stride, so it just has to be larger than every id
+    stride = max(vocabulary_size, int(token_ids.max()) + 1 if len(token_ids) else 1)
+
+    keys = rows * stride + token_ids
+    keys.sort()
+    key_rows = keys // stride
+
+    for k in range(1, min(max_distance, n - 1) + 1):
+        # move every utterance k positions back; shared keys are shared tokens of utterance i and i + k
+        shifted = keys[key_rows >= k] - k * stride
+        common = np.intersect1d(keys, shifted, assume_unique=True)
+        band[:n - k, k - 1] = np.bincount(common // stride, minlength=n)[:n - k]
+    return band
+
+
+def sweep_anchor(band, window_size, minimum_matches, tail=False, dump=True, stop=None):
+    """Array version of utils.sweep_anchor over an overlap_band."""
+    n = band.shape[0]
+    # with tail the last utterances are anchors too, the band is padded with -1 past the end of the session
+    anchors = n - 1 if tail else n - window_size + 1
+    if stop is not None:
+        anchors = min(anchors, stop)
+    if anchors <= 0 or window_size < 2:
+        return 0, []
+    hits = band[:anchors, :window_size - 1] >= minimum_matches
+    matched = hits.any(axis=1)
+    if not dump:
+        return int(matched.sum()), []
+    first = hits.argmax(axis=1)
+    indices = np.flatnonzero(matched)
+    pairs = list(zip(indices.tolist(), (indices + first[indices] + 1).tolist()))
+    return int(matched.sum()), pairs
+
+
+def sweep_incremental(band, window_size, minimum_matches, tail=False, dump=True, stop=None):
+    """Array version of utils.sweep_incremental over an overlap_band."""
+    n = band.shape[0]
+    windows = n - 1 if tail else n - window_size + 1
+    if stop is not None:
+        windows = min(windows, stop)
+    if windows <= 0 or window_size < 2:
+        return 0, []
+    adjacent = band[:, 0] >= minimum_matches
+    # every window counts the adjacent matches it contains, i.e. a difference of prefix sums
+    prefix = np.concatenate(([0], np.cumsum(adjacent)))
+    starts = np.arange(windows)
+    ends = np.minimum(starts + window_size, n)
+    per_window = prefix[ends - 1] - prefix[starts]
+    if not dump:
+        return int(per_window.sum()), []
+
+    pairs = list()
+    hit_positions = np.flatnonzero(adjacent)
+    for i in np.flatnonzero(per_window).tolist():
+        for j in hit_positions[np.searchsorted(hit_positions, i):np.searchsorted(hit_positions, ends[i] - 1)]:
+            pairs.append((int(j), int(j) + 1))
+    return int(per_window.sum()), pairs
+
+
+def sweep(band, cells, incremental=False, tail=False, dump=True, stop=None):
+    """Array version of utils.sweep over an overlap_band."""
+    if incremental:
+        return [sweep_incremental(band, window_size, minimum, tail, dump, stop) for window_size, minimum in cells]
+    return [sweep_anchor(band, window_size, minimum, tail, dump, stop) for window_size, minimum in cells]
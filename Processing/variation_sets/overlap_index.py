@@ -0,0 +1,281 @@
+"""Persistent index of how much every utterance overlaps with the utterances that follow it, so that the variation
+sets of any window size (up to the largest one the index was built for) and any minimum matches can be counted
+without reading the database or matching again. `build` reads a database like get_variation_sets.py and stores the
+utils.overlap_table of every session for every -z value, along with the tokens, in one .npz file:
+
+    bands              overlaps, of shape (-z values, utterances, largest window - 1), -1 where there is none
+    token_ids          token id of every token of every utterance, -1 for NULL tokens
+    utterance_offsets  where each utterance starts in token_ids (plus the end)
+    session_offsets    where each session starts in the utterances (plus the end)
+    session_totals     total (adult) utterances of each session, including the ones without tokens
+    utterance_ids      database id of every utterance, -1 where it isn't known
+    session_ids        the session ids (JSON)
+    vocabulary         the tokens, indexed by token id (JSON)
+    meta               the get_variation_sets.py arguments that select the sessions, the -z values and the largest
+                       window (JSON)
+
+`query` writes the files get_variation_sets.py would write for the same database and the given -w, -m, -n, --tail,
+-o, --compact and --format, e.g.:
+
+    python overlap_index.py build chintang.npz -f chintang.sqlite3 -t morphemes -w 2 -w 10 -m 1 -z 0.6
+    python overlap_index.py query chintang.npz -w 2 -w 8 -m 1 -m 4 -o
+
+Requires numpy; see available()."""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import utils as vs
+import columnar
+import numpy_backend
+import get_variation_sets as gvs
+
+# Bump when the layout changes
+VERSION = 2
+
+
+def available():
+    """Whether numpy could be imported."""
+    return np is not None
+
+
+def session_bands(utterances, args, max_distance):
+    """The overlap of every utterance of a session with the max_distance utterances that follow it, as a
+    numpy_backend.overlap_band for every -z value in args.fuzzy."""
+    interned = vs.intern_utterances(utterances, gvs.vocabulary)
+    if args.fuzzy[0] is None:
+        return [numpy_backend.overlap_band(interned, max_distance, len(gvs.vocabulary))]
+
+    bands = []
+    for score in gvs.session_scores(interned, args, max_distance):
+        band = np.full((len(interned), max_distance), -1, dtype=np.int64)
+        for i, row in enumerate(vs.overlap_table(interned, max_distance, score)):
+            band[i, :len(row)] = [-1 if value is None else value for value in row]
+        bands.append(band)
+    return bands
+
+
+def _loader_argv(args):
+    """The get_variation_sets.py arguments that decide which sessions and tokens are read and how they are scored."""
+    argv = ['-f', args.filename, '-t', args.tier]
+    for flag, option in [('-v', 'nouns_verbs'), ('-e', 'english_bnc'), ('-c', 'chintang_adults'),
+                         ('-r', 'random_text')]:
+        if getattr(args, option):
+            argv.append(flag)
+    for rule in args.case_folding or []:
+        argv.extend(['--case-folding', rule])
+    for fuzzy in args.fuzzy:
+        if fuzzy is not None:
+            argv.extend(['-z', str(fuzzy)])
+    return argv
+
+
+def _smallest_dtype(values):
+    """The smallest signed integer type that holds the values."""
+    largest = int(values.max()) if values.size else 0
+    for dtype in [np.int8, np.int16, np.int32]:
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def build(path, sessions, args, executor=None):
+    """Write the index of the (session_id, total_utterances, utterances) sessions to path, for windows up to the
+    largest -w in args. The sessions are scored in the process pool executor if one is given."""
+    max_window = max(window_size for window_size, _ in gvs._win_min_iter(args))
+    max_distance = max_window - 1
+
+    vocabulary = {}
+    token_ids = []
+    utterance_offsets = [0]
+    session_offsets = [0]
+    session_totals = []
+    session_ids = []
+    utterance_ids = []
+    sessions = list(sessions)
+    for session, total, utterances in sessions:
+        utterance_ids.extend(-1 if uid is None else uid for uid in vs.utterance_ids(utterances))
+        for utterance in utterances:
+            for token in utterance:
+                token_ids.append(-1 if token is None else vocabulary.setdefault(token, len(vocabulary)))
+            utterance_offsets.append(len(token_ids))
+        session_offsets.append(len(utterance_offsets) - 1)
+        session_totals.append(total)
+        session_ids.append(session)
+
+    score = partial(session_bands, args=args, max_distance=max_distance)
+    utterances = (utterances for _, _, utterances in sessions)
+    scored = executor.map(score, utterances, chunksize=16) if executor is not None else map(score, utterances)
+    per_fuzzy = [[] for _ in args.fuzzy]
+    for bands in scored:
+        for fuzzy_bands, band in zip(per_fuzzy, bands):
+            fuzzy_bands.append(band)
+    bands = np.stack([np.concatenate(fuzzy_bands) if fuzzy_bands else np.zeros((0, max_distance), dtype=np.int64)
+                      for fuzzy_bands in per_fuzzy])
+
+    meta = {'version': VERSION, 'argv': _loader_argv(args), 'fuzzy': args.fuzzy, 'max_window': max_window}
+    # Written next to the index and moved into place, so that a half written index is never read
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        np.savez(f, bands=bands.astype(_smallest_dtype(bands)),
+                 token_ids=np.array(token_ids, dtype=np.int32),
+                 utterance_offsets=np.array(utterance_offsets, dtype=np.int64),
+                 session_offsets=np.array(session_offsets, dtype=np.int64),
+                 session_totals=np.array(session_totals, dtype=np.int64),
+                 utterance_ids=np.array(utterance_ids, dtype=np.int64),
+                 session_ids=np.array(json.dumps(session_ids)),
+                 vocabulary=np.array(json.dumps(sorted(vocabulary, key=vocabulary.get), ensure_ascii=False)),
+                 meta=np.array(json.dumps(meta)))
+    os.replace(temporary, path)
+
+
+class OverlapIndex(object):
+    """An index written by build()."""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            meta = json.loads(str(data['meta']))
+            if meta['version'] != VERSION:
+                raise ValueError("%s is an index of version %s, build it again" % (path, meta['version']))
+            self.bands = data['bands']
+            self.token_ids = data['token_ids']
+            self.utterance_offsets = data['utterance_offsets']
+            self.session_offsets = data['session_offsets']
+            self.session_totals = data['session_totals']
+            self.utterance_ids = data['utterance_ids']
+            self.session_ids = json.loads(str(data['session_ids']))
+            self.vocabulary = json.loads(str(data['vocabulary'])) + [None]  # so that -1 is None
+        self.argv = meta['argv']
+        self.fuzzy = meta['fuzzy']
+        self.max_window = meta['max_window']
+        self.positions = {session: k for k, session in enumerate(self.session_ids)}
+
+    def check(self, cells, incremental=False):
+        """Raises ValueError if the index can't answer for the (window size, minimum matches) cells."""
+        if not incremental and max(window_size for window_size, _ in cells) > self.max_window:
+            raise ValueError("the index only has windows of up to %d utterances" % self.max_window)
+
+    def match(self, position, cells, incremental=False, tail=False, dump=True):
+        """For every -z value of the index, the (count, matched pairs) of every (window size, minimum matches) cell
+        of the session at position, the same as get_variation_sets.match_session gives them."""
+        first, last = int(self.session_offsets[position]), int(self.session_offsets[position + 1])
+        return [numpy_backend.sweep(band[first:last], cells, incremental, tail, dump) for band in self.bands]
+
+    def query(self, cells, incremental=False, tail=False, dump=True):
+        """Yields the session id, total utterances and match() of every session."""
+        self.check(cells, incremental)
+        for position, session in enumerate(self.session_ids):
+            yield session, int(self.session_totals[position]), self.match(position, cells, incremental, tail, dump)
+
+    def results(self, session, args):
+        """match() of a session for the cells of get_variation_sets.py arguments, see get_variation_sets.write_output.
+        """
+        cells = list(gvs._win_min_iter(args))
+        return self.match(self.positions[session], cells, args.incremental, args.tail, args.write_output)
+
+    def sessions(self):
+        """Yields the (session_id, total_utterances, utterances) of every session."""
+        for position, session in enumerate(self.session_ids):
+            first, last = int(self.session_offsets[position]), int(self.session_offsets[position + 1])
+            offsets = self.utterance_offsets[first:last + 1].tolist()
+            tokens = self.token_ids[offsets[0]:offsets[-1]].tolist()
+            base = offsets[0]
+            utterances = vs.Utterances([self.vocabulary[t] for t in tokens[start - base:end - base]]
+                                       for start, end in zip(offsets, offsets[1:]))
+            utterances.utterance_ids = [None if uid < 0 else uid for uid in self.utterance_ids[first:last].tolist()]
+            yield session, int(self.session_totals[position]), utterances
+
+
+def query_argv(args):
+    """get_variation_sets.py arguments for the query options."""
+    argv = []
+    for window_size in args.window:
+        argv.extend(['-w', window_size])
+    for minimum in args.minimum_matches:
+        argv.extend(['-m', minimum])
+    for flag, option in [('-n', 'incremental'), ('--tail', 'tail'), ('-o', 'write_output'), ('--compact', 'compact'),
+                         ('--checkpoint', 'checkpoint'), ('--resume', 'resume')]:
+        if getattr(args, option):
+            argv.append(flag)
+    if args.output_format != 'csv':
+        argv.extend(['--format', args.output_format])
+    return argv
+
+
+def get_parser():
+    """The command line parser of overlap_index.py."""
+    parser = argparse.ArgumentParser(description="Build and query a persistent index of variation set overlaps")
+    commands = parser.add_subparsers(dest="command")
+
+    build_parser = commands.add_parser("build", help="index a database")
+    build_parser.add_argument("index", type=str, help="index file to write")
+    build_parser.add_argument("arguments", nargs=argparse.REMAINDER,
+                              help="""get_variation_sets.py arguments that select the sessions and -z; the index covers
+                              windows up to the largest -w""")
+
+    query_parser = commands.add_parser("query", help="write the output of get_variation_sets.py from an index")
+    query_parser.add_argument("index", type=str, help="index file to read")
+    query_parser.add_argument("-w", "-window", action="append", dest="window",
+                              help="window size, use once for a single window, twice for a range")
+    query_parser.add_argument("-m", "-minimum", action="append", dest="minimum_matches",
+                              help="minimum matches, use once for a single minimum match size, twice for a range")
+    query_parser.add_argument("-n", "--incremental", dest="incremental", action="store_true",
+                              help="incremental scanning, otherwise defaults to anchor")
+    query_parser.add_argument("-o", dest="write_output", action="store_true",
+                              help="write the utterances of the variation sets as well")
+    query_parser.add_argument("--compact", dest="compact", action="store_true",
+                              help="with -o, write the matched pairs and their texts to separate files")
+    query_parser.add_argument("--format", dest="output_format", choices=columnar.FORMATS, default="csv",
+                              help="write typed columnar files instead of CSV, as get_variation_sets.py --format")
+    query_parser.add_argument("--tail", dest="tail", action="store_true",
+                              help="keep sliding the window to the end of each session")
+    query_parser.add_argument("--checkpoint", dest="checkpoint", action="store_true",
+                              help="checkpoint every finished session, so that the query can be resumed")
+    query_parser.add_argument("--resume", dest="resume", action="store_true",
+                              help="carry on with a query with --checkpoint that was cut short")
+    return parser
+
+
+def main(args):
+    if args.command == "build":
+        build_args = gvs.parse_args(args.arguments)
+        if max(window_size for window_size, _ in gvs._win_min_iter(build_args)) < 2:
+            sys.exit("The index needs a window of at least 2: -w 2")
+        sessions = gvs.read_sessions(build_args)
+        if build_args.jobs > 1:
+            with ProcessPoolExecutor(max_workers=build_args.jobs) as executor:
+                build(args.index, sessions, build_args, executor)
+        else:
+            build(args.index, sessions, build_args)
+
+    else:
+        try:
+            index = OverlapIndex(args.index)
+            query_args = gvs.parse_args(index.argv + query_argv(args))
+            index.check(list(gvs._win_min_iter(query_args)), query_args.incremental)
+        except ValueError as e:
+            sys.exit("Can't query %s: %s" % (args.index, e))
+        gvs.write_output(index.sessions(), query_args, index=index)
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    if args.command is None:
+        sys.exit("Give a command: build or query")
+    if not available():
+        sys.exit("overlap_index.py requires numpy: pip install numpy")
+
+    start_time = time.time()
+    main(args)
+    print("%s seconds --- Finished" % (time.time() - start_time))
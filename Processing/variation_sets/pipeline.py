@@ -0,0 +1,142 @@
+"""Pipelining of the stages of a run of get_variation_sets.py: the sessions are loaded by one thread, matched by the
+main thread (or its process pool) and written by another thread, connected by bounded queues. Reading the database
+and writing the output files then overlap with matching, and a slow stage holds the others back once its queue is
+full instead of letting sessions pile up in memory. Every queue counts how often and for how long each side of it
+had to wait, which shows the stage that holds the run up."""
+
+import queue
+import threading
+import time
+
+# Sessions a queue holds before the stage feeding it waits
+QUEUE_SIZE = 4
+
+# Marks the end of a queue
+_DONE = object()
+
+
+class BoundedQueue(object):
+    """A queue.Queue between a producer and a consumer stage that keeps track of their waiting."""
+
+    def __init__(self, producer, consumer, size=QUEUE_SIZE):
+        self.queue = queue.Queue(size)
+        self.producer = producer
+        self.consumer = consumer
+        # The producer waits for room, the consumer for items; each counter is only touched by its own side
+        self.full_waits = 0
+        self.full_time = 0.0
+        self.empty_waits = 0
+        self.empty_time = 0.0
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put(item)
+            self.full_waits += 1
+            self.full_time += time.perf_counter() - start
+
+    def get(self):
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            start = time.perf_counter()
+            item = self.queue.get()
+            self.empty_waits += 1
+            self.empty_time += time.perf_counter() - start
+            return item
+
+    def describe(self):
+        """Summary of the waiting on both sides."""
+        return "%s waited %.2fs for the %s (%d times), %s waited %.2fs for the %s (%d times)" % (
+            self.consumer, self.empty_time, self.producer, self.empty_waits,
+            self.producer, self.full_time, self.consumer, self.full_waits)
+
+
+def prefetch(items, stats, size=QUEUE_SIZE):
+    """Returns a generator of the items, which a thread of their own reads ahead of time (once the generator is
+    started) through a BoundedQueue, appended to stats. An exception raised while reading is raised by the
+    generator."""
+    loaded = BoundedQueue("loader", "matcher", size)
+    stats.append(loaded)
+    return _prefetched(items, loaded)
+
+
+def _prefetched(items, loaded):
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                loaded.put((item, None))
+                if stop.is_set():
+                    return
+        except BaseException as e:
+            loaded.put((_DONE, e))
+        else:
+            loaded.put((_DONE, None))
+
+    thread = threading.Thread(target=produce, name="loader", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = loaded.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Make room until the loader notices that it can stop
+        stop.set()
+        while thread.is_alive():
+            try:
+                loaded.queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+class Writer(object):
+    """Calls write(item) for every item put, in a thread of its own, fed through a BoundedQueue appended to stats.
+    Used as a context manager, the items put are all written when the with block is left, even by an exception; an
+    exception raised by write is raised by the next put or when the block is left."""
+
+    def __init__(self, write, stats, size=QUEUE_SIZE):
+        self.write = write
+        self.results = BoundedQueue("matcher", "writer", size)
+        stats.append(self.results)
+        self.error = None
+        self.thread = threading.Thread(target=self._drain, name="writer", daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        while True:
+            item = self.results.get()
+            if item is _DONE:
+                return
+            if self.error is None:
+                try:
+                    self.write(item)
+                except BaseException as e:
+                    # Keep taking items so that put doesn't block
+                    self.error = e
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        self.results.put(item)
+
+    def close(self):
+        """Wait until every item has been written."""
+        self.results.put(_DONE)
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        if exc_type is None and self.error is not None:
+            raise self.error
+        return False
@@ -0,0 +1,135 @@
+"""Prepare an ACQDIV (or BNC, or randomized NAL) sqlite database for repeated variation set runs: creates the
+covering indexes declared in db_backend.py and db_backend_randomized.py, runs ANALYZE, resolves the speakers of BNC's
+utterances to integer ids, materializes the adult utterances of every session into the adult_utterances table and
+reports the query plans of the loader queries.
+To see all of the options, you can call this script with the -h flag."""
+
+import sys
+import time
+import argparse
+
+import sqlalchemy as sa
+import db_backend as db
+import db_backend_randomized as db_randomized
+
+import loaders
+
+
+def create_indexes(engine):
+    """Create the indexes declared on the ORM tables that are in the database but don't have them yet."""
+    inspector = sa.inspect(engine)
+    tables = set(inspector.get_table_names())
+    for metadata in [db.Base.metadata, db_randomized.Base.metadata]:
+        for table in metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            existing = set(index['name'] for index in inspector.get_indexes(table.name))
+            for index in table.indexes:
+                if index.name in existing:
+                    print("Index already exists:", index.name)
+                    continue
+                try:
+                    index.create(engine)
+                    print("Created index:", index.name)
+                except sa.exc.OperationalError as e:
+                    # e.g. a column this kind of database doesn't have
+                    print("Skipped index %s: %s" % (index.name, e.orig))
+
+
+def record_prepared(conn, table, mode):
+    """Note in the prepared_tables table that the table has been filled in for mode from the utterances and speakers
+    as they are now. The triggers of db_backend.prepared_triggers() forget it when they change, so that the loaders
+    can tell when the table is out of date."""
+    prepared = db.PreparedTable.__table__
+    prepared.create(conn, checkfirst=True)
+    for _, statement in db.prepared_triggers():
+        conn.execute(statement)
+    conn.execute(prepared.delete().where(prepared.c.name == table.name))
+    conn.execute(prepared.insert().values(name=table.name, mode=mode))
+
+
+def resolve_speakers(engine):
+    """(Re)create the speaker_resolution table of a BNC-format database, so that its utterances are joined to their
+    speakers by integer id instead of by source id and speaker label."""
+    table = db.SpeakerResolution.__table__
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    with engine.begin() as conn:
+        conn.execute(table.insert().from_select(['utterance_id_fk', 'speaker_id_fk', 'session_id_fk'],
+                                                loaders.speaker_resolution_query()))
+        record_prepared(conn, table, 'bnc')
+        count = conn.execute(sa.select([sa.func.count()]).select_from(table)).scalar()
+    print("Resolved the speakers of %d utterances" % count)
+
+
+def materialize_adult_utterances(engine, args):
+    """(Re)create the adult_utterances table from the utterances/speakers join."""
+    table = db.AdultUtterance.__table__
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    with engine.begin() as conn:
+        resolved = args.english_bnc and loaders.is_resolved(conn)
+        conn.execute(table.insert().from_select(['session_id_fk', 'id'],
+                                                loaders.adult_utterances_query(args, resolved)))
+        record_prepared(conn, table, loaders.prepared_mode(args))
+        count = conn.execute(sa.select([sa.func.count()]).select_from(table)).scalar()
+    print("Materialized %d adult utterances" % count)
+
+
+def explain(conn, query):
+    """Returns the rows of sqlite's EXPLAIN QUERY PLAN for a select."""
+    compiled = query.compile(dialect=conn.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    return conn.execute("EXPLAIN QUERY PLAN " + str(compiled), *params).fetchall()
+
+
+def report_query_plans(conn, args):
+    """Print the query plan of the loader query for both tiers."""
+    materialized = loaders.is_materialized(conn, args)
+    resolved = args.english_bnc and loaders.is_resolved(conn)
+    for tier in ['words', 'morphemes']:
+        tier_args = argparse.Namespace(**dict(vars(args), tier=tier, nouns_verbs=False))
+        if args.random_text:
+            query = loaders.randomized_query(tier_args)
+        else:
+            query = loaders.corpus_query(tier_args, materialized, resolved=resolved)
+        print()
+        print("Query plan for the %s loader:" % tier)
+        for row in explain(conn, query):
+            print("   ", row[-1])
+            if row[-1].startswith("SCAN") and "USING" not in row[-1]:
+                print("    ^ full table scan")
+
+
+def main(args):
+    engine = sa.create_engine("sqlite:///" + args.filename)
+    # Everything is prepared again, and an older prepare_db.py may have made the table with other columns
+    db.PreparedTable.__table__.drop(engine, checkfirst=True)
+    create_indexes(engine)
+    if args.english_bnc:
+        resolve_speakers(engine)
+    if not args.random_text:
+        materialize_adult_utterances(engine, args)
+    with engine.connect() as conn:
+        conn.execute("ANALYZE")
+        print("Analyzed")
+        report_query_plans(conn, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prepare a database for get_variation_sets.py")
+    parser.add_argument("-f", "--file", dest="filename", type=str, help="required: name of file *.sqlite")
+    parser.add_argument("-e", dest="english_bnc", action="store_true",
+                        help="The database is in the English BNC format")
+    parser.add_argument("-c", dest="chintang_adults", action="store_true",
+                        help="Report the query plans for the Chintang adult data")
+    parser.add_argument("-r", dest="random_text", action="store_true",
+                        help="The database has the randomized data from NAL")
+    args = parser.parse_args()
+
+    if not args.filename:
+        sys.exit("You need to pass a filename: -f filename")
+
+    start_time = time.time()
+    main(args)
+    print("%s seconds --- Finished" % (time.time() - start_time))
@@ -0,0 +1,161 @@
+"""Cache of the results of single (window size, minimum matches) cells, so that a run over a wider range of windows
+or minimum matches than an earlier one only computes the new cells. A cell is keyed by the content of its session
+(a hash of its tokens), the tier, -v, the method, --tail, the window size, the minimum matches and the -z value, and
+stores the count and, if it was computed with -o, the matched pairs of utterance indices. Alongside the cells, it
+keeps the utils.overlap_table of every session and -z value up to the largest distance a run has needed, so that the
+new cells of a wider run are swept from it, scoring only the utterances beyond that distance. The cache is a sqlite
+database whose size is bounded, the cells and tables of the least recently used sessions are evicted first."""
+
+import json
+import sqlite3
+import hashlib
+
+# Default bound on the size of the cache
+MAX_BYTES = 1 << 30
+
+# Rough size of a cell besides its pairs
+CELL_BYTES = 100
+
+# Sessions stored per transaction, a killed run only loses the results of the last ones
+COMMIT_EVERY = 1000
+
+
+def session_hash(utterances):
+    """sha256 of the tokens of a session."""
+    return hashlib.sha256(json.dumps(utterances, ensure_ascii=False).encode()).hexdigest()
+
+
+class ResultCache(object):
+    """Results of (window size, minimum matches) cells of sessions."""
+
+    def __init__(self, path, max_bytes=MAX_BYTES):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS cells (
+            session TEXT, options TEXT, fuzzy TEXT, window INTEGER, minimum INTEGER,
+            count INTEGER, pairs TEXT, size INTEGER,
+            PRIMARY KEY (session, options, fuzzy, window, minimum))""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS tables (
+            session TEXT, fuzzy TEXT, distance INTEGER, scores TEXT, size INTEGER,
+            PRIMARY KEY (session, fuzzy))""")
+        # When each session was last used, kept apart from the cells so that using them doesn't rewrite their pairs
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (session TEXT PRIMARY KEY, used INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS ix_sessions_used ON sessions (used)")
+        self.db.commit()
+        self.max_bytes = max_bytes
+        self.size = self.db.execute("SELECT (SELECT total(size) FROM cells) + (SELECT total(size) FROM tables)"
+                                    ).fetchone()[0]
+        self.clock = self.db.execute("SELECT coalesce(max(used), 0) FROM sessions").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.pending = 0
+
+    @staticmethod
+    def options(args):
+        """The part of the key that comes from the run's arguments."""
+        return json.dumps([args.tier, args.nouns_verbs, args.incremental, args.tail])
+
+    def get(self, session, args, cells):
+        """For every -z value of args, a list with the (count, pairs) of each cell, or None for the ones that aren't
+        cached (or were cached without pairs while args.write_output needs them)."""
+        self.clock += 1
+        self.db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?)", (session, self.clock))
+        options = self.options(args)
+        found = {}
+        rows = self.db.execute("SELECT fuzzy, window, minimum, count, pairs FROM cells WHERE session = ? AND "
+                               "options = ?", (session, options))
+        for fuzzy, window_size, minimum, count, pairs in rows:
+            if pairs is None and args.write_output:
+                continue
+            found[fuzzy, window_size, minimum] = count, [tuple(pair) for pair in json.loads(pairs)] if pairs else []
+
+        results = []
+        for fuzzy in args.fuzzy:
+            fuzzy_results = [found.get((repr(fuzzy),) + cell) for cell in cells]
+            self.hits += sum(result is not None for result in fuzzy_results)
+            self.misses += sum(result is None for result in fuzzy_results)
+            results.append(fuzzy_results)
+        return results
+
+    def get_tables(self, session, args, missing):
+        """For every -z value of args with cells missing (a list of cells per -z value), the (distance, overlap table)
+        of the session cached for it, or None."""
+        found = {}
+        for fuzzy, distance, scores in self.db.execute("SELECT fuzzy, distance, scores FROM tables WHERE session = ?",
+                                                        (session,)):
+            found[fuzzy] = distance, scores
+        tables = []
+        for fuzzy, fuzzy_cells in zip(args.fuzzy, missing):
+            table = found.get(repr(fuzzy)) if fuzzy_cells else None
+            tables.append(None if table is None else (table[0], json.loads(table[1])))
+        return tables
+
+    def put(self, session, args, cells, results, tables=None):
+        """Store the (count, pairs) of the cells of every -z value of args (a list of cells and one of results per -z
+        value) and the (distance, overlap table) of the -z values that have one in tables, then evict the least
+        recently used sessions if the cache has grown too large."""
+        options = self.options(args)
+        rows = []
+        for fuzzy, fuzzy_cells, fuzzy_results in zip(args.fuzzy, cells, results):
+            for (window_size, minimum), (count, pairs) in zip(fuzzy_cells, fuzzy_results):
+                pairs = json.dumps(pairs) if args.write_output else None
+                size = CELL_BYTES + (len(pairs) if pairs else 0)
+                rows.append((session, options, repr(fuzzy), window_size, minimum, count, pairs, size))
+                self.size += size
+        # Cells cached without pairs are replaced
+        replaced = {row[2:5] for row in rows}
+        for fuzzy, window_size, minimum, size in self.db.execute(
+                "SELECT fuzzy, window, minimum, size FROM cells WHERE session = ? AND options = ?", (session, options)):
+            if (fuzzy, window_size, minimum) in replaced:
+                self.size -= size
+        self.db.executemany("INSERT OR REPLACE INTO cells (session, options, fuzzy, window, minimum, count, pairs, "
+                            "size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+        for fuzzy, table in zip(args.fuzzy, tables or []):
+            if table is None:
+                continue
+            distance, scores = table
+            scores = json.dumps(scores)
+            size = CELL_BYTES + len(scores)
+            # A table reaching further replaces the one it was extended from
+            old = self.db.execute("SELECT size FROM tables WHERE session = ? AND fuzzy = ?",
+                                  (session, repr(fuzzy))).fetchone()
+            self.size += size - (old[0] if old else 0)
+            self.db.execute("INSERT OR REPLACE INTO tables (session, fuzzy, distance, scores, size) VALUES "
+                            "(?, ?, ?, ?, ?)", (session, repr(fuzzy), distance, scores, size))
+
+        self.pending += 1
+        if self.size > self.max_bytes:
+            self.evict()
+        if self.pending >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self):
+        """Write the stored results to disk."""
+        self.db.commit()
+        self.pending = 0
+
+    def evict(self):
+        """Remove the cells and tables of the least recently used sessions until the cache is back to 90% of its
+        bound."""
+        evicted = []
+        for session, size in self.db.execute(
+                "SELECT session, (SELECT total(size) FROM cells WHERE cells.session = sessions.session) + "
+                "(SELECT total(size) FROM tables WHERE tables.session = sessions.session) FROM sessions "
+                "ORDER BY used").fetchall():
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            evicted.append((session,))
+            self.size -= size
+        for table in ['cells', 'tables', 'sessions']:
+            self.db.executemany("DELETE FROM %s WHERE session = ?" % table, evicted)
+
+    def hit_rate(self):
+        """Share of the cells looked up that were cached."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def close(self):
+        self.commit()
+        self.db.close()
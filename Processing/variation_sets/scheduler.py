@@ -0,0 +1,112 @@
+"""Scheduling of the per-session work of a parallel run. Session sizes vary by orders of magnitude, so the sessions
+are given to the workers largest first, and a session that would keep one worker busy long after the others are
+done is split into chunks of window starts. A chunk carries the window - 1 utterances after its last window start
+as well, so that its windows are the same as in the whole session, and the results of the chunks of a session are
+stitched back together in order. The sessions are scheduled in batches, so that the next batch can be read while
+one is matched."""
+
+# A session is split if it would cost more than this share of what one worker has to do
+MAX_SHARE = 0.5
+
+# Chunks have at least this many window starts, so that the overlap between them stays small
+MIN_CHUNK = 100
+
+# Sessions are scheduled in batches of at least this many utterances
+BATCH_UTTERANCES = 50000
+
+
+def estimate_cost(utterances, max_distance, fuzzy):
+    """Rough cost of matching a session: every utterance is compared to the max_distance utterances that follow it,
+    which is linear in the number of tokens for strict matching and quadratic for -z, once per -z value."""
+    if not utterances:
+        return 0
+    mean_tokens = sum(len(utterance) for utterance in utterances) / len(utterances)
+    per_comparison = mean_tokens if fuzzy[0] is None else mean_tokens ** 2
+    return len(utterances) * max_distance * per_comparison * len(fuzzy)
+
+
+def batches(sessions, utterances=None):
+    """Split the (session_id, total_utterances, utterances) sessions into lists of consecutive sessions, each (but the
+    last) with at least the given number of utterances between them. Reads the sessions one batch at a time."""
+    if utterances is None:
+        utterances = BATCH_UTTERANCES
+    batch = []
+    size = 0
+    for session in sessions:
+        batch.append(session)
+        size += len(session[2])
+        if size >= utterances:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def chunk_bounds(length, max_window, chunks):
+    """Split the window starts of a session of length utterances into (at most) chunks pieces. Returns a list of
+    (first utterance, stop, end): the chunk has the windows starting at first up to (not including) first + stop and
+    needs the utterances from first up to (not including) end."""
+    starts = max(length - 1, 0)
+    chunks = max(min(chunks, starts), 1)
+    bounds = []
+    for k in range(chunks):
+        first = starts * k // chunks
+        last = starts * (k + 1) // chunks
+        if k == chunks - 1:
+            # the last chunk takes the end of the session, and with it the windows cut short by it
+            bounds.append((first, length - first, length))
+        else:
+            bounds.append((first, last - first, min(last - 1 + max_window, length)))
+    return bounds
+
+
+def plan(costs, lengths, max_window, jobs, min_chunk=None):
+    """Given the estimated cost and number of utterances of every session, returns the tasks as
+    (session index, chunk index, first utterance, stop, end) tuples, most expensive first, along with the number of
+    chunks of every session."""
+    if min_chunk is None:
+        min_chunk = MIN_CHUNK
+    limit = MAX_SHARE * sum(costs) / jobs
+    tasks = []
+    chunks = []
+    for index, (cost, length) in enumerate(zip(costs, lengths)):
+        pieces = 1
+        if limit and cost > limit:
+            pieces = min(int(-(-cost // limit)), max(length - 1, 1) // min_chunk or 1)
+        bounds = chunk_bounds(length, max_window, pieces)
+        chunks.append(len(bounds))
+        for k, (first, stop, end) in enumerate(bounds):
+            share = cost * (end - first) / length if length else 0
+            tasks.append((share, index, k, first, stop, end))
+    tasks.sort(key=lambda task: -task[0])
+    return [task[1:] for task in tasks], chunks
+
+
+def stitch(chunk_results, firsts):
+    """Put the results of the chunks of a session, as lists (one per -z value) of lists of (count, pairs) cells,
+    back together: the counts are added up and the pairs moved to the session's indices and concatenated."""
+    stitched = []
+    for fuzzy_results in zip(*chunk_results):
+        cells = []
+        for chunk_cells in zip(*fuzzy_results):
+            count = 0
+            pairs = []
+            for (chunk_count, chunk_pairs), first in zip(chunk_cells, firsts):
+                count += chunk_count
+                pairs.extend((i + first, j + first) for i, j in chunk_pairs)
+            cells.append((count, pairs))
+        stitched.append(cells)
+    return stitched
+
+
+def stitch_tables(chunk_tables):
+    """Put the overlap tables of the chunks of a session back together, given for every chunk the
+    (distance, rows for the windows of the chunk) of each -z value (or None, if it wasn't scored)."""
+    stitched = []
+    for fuzzy_tables in zip(*chunk_tables):
+        if fuzzy_tables[0] is None:
+            stitched.append(None)
+        else:
+            stitched.append((fuzzy_tables[0][0], [row for _, rows in fuzzy_tables for row in rows]))
+    return stitched
@@ -0,0 +1,45 @@
+"""Read-only loader backend on the stdlib sqlite3 module. The selects are still built with SQLAlchemy Core, but they
+are compiled once and run on a plain sqlite3 connection that returns tuples, fetched in batches, so that the tens of
+millions of word rows of a full corpus don't each become a RowProxy. The connection is opened read-only with a large
+memory map and page cache."""
+
+import sqlite3
+
+from pathlib import Path
+
+from sqlalchemy.dialects import sqlite
+
+# sqlite's memory map and page cache (negative cache_size is in KiB)
+MMAP_SIZE = 1 << 30
+CACHE_SIZE = -(1 << 18)
+
+# Rows per fetchmany
+BATCH_SIZE = 10000
+
+
+def connect(filename, mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE):
+    """Open the sqlite database read-only, for use by one thread at a time."""
+    raw = sqlite3.connect(Path(filename).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+    raw.execute("PRAGMA mmap_size = %d" % mmap_size)
+    raw.execute("PRAGMA cache_size = %d" % cache_size)
+    return raw
+
+
+def compile_query(query):
+    """The SQL and positional parameters of a SQLAlchemy select for sqlite."""
+    compiled = query.compile(dialect=sqlite.dialect())
+    return str(compiled), [compiled.params[name] for name in compiled.positiontup]
+
+
+def execute(raw, query, batch_size=BATCH_SIZE):
+    """Yields the rows of a SQLAlchemy select as tuples, run on a connection from connect()."""
+    sql, params = compile_query(query)
+    cursor = raw.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        cursor.close()
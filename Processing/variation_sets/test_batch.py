@@ -0,0 +1,88 @@
+"""
+Tests for batch.py
+"""
+
+import os
+import shutil
+import argparse
+import tempfile
+import unittest
+
+import batch
+import get_variation_sets as gvs
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.directory, 'manifest.txt')
+        with open(self.manifest, 'w') as f:
+            f.write("# gold\n"
+                    "-f fixtures/gold.sqlite3 -w 2 -m 1\n"
+                    "\n"
+                    "-f fixtures/gold-cats-bnc.sqlite3 -e -w 2 -w 4 -m 1 -z 0.5 -z 0.8\n"
+                    "-f fixtures/gold.sqlite3 -w 2 -w 3 -m 1 -n -o\n"
+                    "-f fixtures/gold.sqlite3 -t morphemes -w 2 -m 1\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_manifest(self):
+        jobs = batch.read_manifest(self.manifest)
+        assert [job.filename for job in jobs] == ["fixtures/gold.sqlite3", "fixtures/gold-cats-bnc.sqlite3",
+                                                  "fixtures/gold.sqlite3", "fixtures/gold.sqlite3"]
+        assert jobs[1].fuzzy == [0.5, 0.8]
+        assert jobs[2].incremental and jobs[2].write_output
+        assert jobs[3].tier == "morphemes"
+
+    def test_group_jobs(self):
+        groups = batch.group_jobs(batch.read_manifest(self.manifest))
+        assert [[job.window for job in group] for group in groups] == [[['2'], ['2', '3']], [['2', '4']], [['2']]]
+
+    def test_per_job_jobs(self):
+        with open(self.manifest, 'a') as f:
+            f.write("-f fixtures/gold.sqlite3 -w 2 -m 1 -j 2\n")
+        with self.assertRaises(SystemExit):
+            batch.read_manifest(self.manifest)
+
+    def test_corpus_key(self):
+        jobs = [gvs.parse_args(["-f", "fixtures/gold.sqlite3", "-w", "2", "-m", "1"] + flags)
+                for flags in [[], ["--sqlite3"], ["--cache", self.directory], ["-n"]]]
+        self.assertEqual(len(batch.group_jobs(jobs)), 3)
+
+    def test_main(self):
+        filename = os.path.abspath("fixtures/gold.sqlite3")
+        lines = ["-f %s -w 2 -w 3 -m 1 -m 2 -z 0.5 -o" % filename, "-f %s -w 2 -m 1 -n" % filename]
+        with open(self.manifest, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        try:
+            os.mkdir("results")
+            expected = {}
+            for line in lines:
+                args = gvs.parse_args(line.split())
+                gvs.main(args)
+                expected.update(self.read_files(args))
+            for jobs in [1, 2]:
+                shutil.rmtree("results")
+                os.mkdir("results")
+                batch.main(argparse.Namespace(manifest=self.manifest, jobs=jobs))
+                files = {}
+                for args in batch.read_manifest(self.manifest):
+                    files.update(self.read_files(args))
+                self.assertEqual(files, expected)
+        finally:
+            os.chdir(cwd)
+
+    def read_files(self, args):
+        files = {}
+        for filename in gvs._out_filename(args):
+            with open(filename) as f:
+                files[filename] = f.read()
+        return files
+
+
+if __name__ == '__main__':
+    unittest.main()
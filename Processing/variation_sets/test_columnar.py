@@ -0,0 +1,120 @@
+"""
+Tests for columnar.py
+"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import columnar
+
+
+class ColumnarTest(unittest.TestCase):
+    header = ["session_id", "total_utterances", "strict_2_1"]
+    rows = [[1, 12, 5], [2, 24, 0]]
+    texts = [["session_id", "utterance", "text"], [1, 0, "ɨŋ eat"], [1, 3, "ɨŋ eat"], [2, 1, "see"]]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, output_format, name, rows):
+        path = columnar.filename(os.path.join(self.directory, name + ".csv"), output_format)
+        writer = columnar.ColumnWriter(path, output_format)
+        writer.writerow(rows[0])
+        writer.writerows(rows[1:])
+        writer.close()
+        return path
+
+    def test_filename(self):
+        assert columnar.filename("results/acq_w_2_m_1_counts.csv", "npz") == "results/acq_w_2_m_1_counts.npz"
+        assert columnar.filename("results/acq_w_2_m_1_counts.csv", "sqlite") == "results/acq_w_2_m_1_counts.sqlite3"
+
+    def test_resolve(self):
+        assert columnar.resolve("csv") == "csv"
+        assert columnar.resolve("columnar") in ["parquet", "npz", "sqlite"]
+        assert columnar.available(columnar.resolve("columnar"))
+
+    def test_sqlite(self):
+        path = self.write("sqlite", "x_counts", [self.header] + self.rows)
+        db = sqlite3.connect(path)
+        assert db.execute("SELECT * FROM counts ORDER BY rowid").fetchall() == [tuple(row) for row in self.rows]
+        assert [row[2] for row in db.execute("PRAGMA table_info(counts)")] == ["INTEGER"] * 3
+        path = self.write("sqlite", "x_texts", self.texts)
+        assert sqlite3.connect(path).execute("SELECT text FROM texts").fetchall() == [("ɨŋ eat",), ("ɨŋ eat",),
+                                                                                      ("see",)]
+
+    @unittest.skipUnless(columnar.available("npz"), "requires numpy")
+    def test_npz(self):
+        import numpy as np
+        with np.load(self.write("npz", "x_counts", [self.header] + self.rows)) as data:
+            assert data["strict_2_1"].tolist() == [5, 0]
+            assert data["session_id"].dtype == np.int64
+        with np.load(self.write("npz", "x_texts", self.texts)) as data:
+            assert data["text_levels"][data["text"]].tolist() == ["ɨŋ eat", "ɨŋ eat", "see"]
+
+    @unittest.skipUnless(columnar.available("parquet"), "requires pyarrow")
+    def test_arrow(self):
+        import pyarrow.feather as feather
+        import pyarrow.parquet as pq
+        table = pq.read_table(self.write("parquet", "x_counts", [self.header] + self.rows))
+        assert table.to_pydict() == {"session_id": [1, 2], "total_utterances": [12, 24], "strict_2_1": [5, 0]}
+        table = feather.read_table(self.write("feather", "x_texts", self.texts))
+        assert table.column("text").to_pylist() == ["ɨŋ eat", "ɨŋ eat", "see"]
+
+    def test_batches(self):
+        rows = [self.texts[0]] + self.texts[1:] * 3
+        formats = [output_format for output_format in ["parquet", "feather", "npz", "sqlite"]
+                   if columnar.available(output_format)]
+        for output_format in formats:
+            whole = self.write(output_format, "whole_texts", rows)
+            batch_size = columnar.ROWS_PER_BATCH
+            columnar.ROWS_PER_BATCH = 2
+            try:
+                batched = self.write(output_format, "batched_texts", rows)
+            finally:
+                columnar.ROWS_PER_BATCH = batch_size
+            if output_format == "sqlite":
+                assert (sqlite3.connect(batched).execute("SELECT * FROM texts ORDER BY rowid").fetchall() ==
+                        sqlite3.connect(whole).execute("SELECT * FROM texts ORDER BY rowid").fetchall())
+            elif output_format == "npz":
+                import numpy as np
+                with np.load(whole) as expected, np.load(batched) as data:
+                    assert sorted(data.keys()) == sorted(expected.keys())
+                    for name in expected.keys():
+                        assert data[name].tolist() == expected[name].tolist()
+                        assert data[name].dtype == expected[name].dtype
+            else:
+                import pyarrow.feather as feather
+                import pyarrow.parquet as pq
+                read = pq.read_table if output_format == "parquet" else feather.read_table
+                assert read(batched).equals(read(whole))
+                if output_format == "parquet":
+                    assert pq.ParquetFile(batched).num_row_groups == 5
+            assert not os.path.exists(batched + ".tmp")
+
+    def test_missing_text(self):
+        rows = self.texts + [[2, 2, None]]
+        path = self.write("sqlite", "x_texts", rows)
+        assert sqlite3.connect(path).execute("SELECT text FROM texts WHERE utterance = 2").fetchall() == [(None,)]
+        if columnar.available("npz"):
+            import numpy as np
+            with np.load(self.write("npz", "x_texts", rows)) as data:
+                assert data["text_levels"][data["text"]].tolist()[-1] == ""
+        if columnar.available("parquet"):
+            import pyarrow.feather as feather
+            import pyarrow.parquet as pq
+            assert pq.read_table(self.write("parquet", "x_texts", rows)).column("text").to_pylist()[-1] is None
+            assert feather.read_table(self.write("feather", "x_texts", rows)).column("text").to_pylist()[-1] is None
+
+    def test_empty(self):
+        path = self.write("sqlite", "x_pairs", [["session_id", "anchor", "partner", "window_size", "matches"]])
+        assert sqlite3.connect(path).execute("SELECT count(*) FROM pairs").fetchone() == (0,)
+
+
+if __name__ == '__main__':
+    unittest.main()
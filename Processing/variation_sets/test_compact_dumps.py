@@ -0,0 +1,53 @@
+"""
+Tests for compact_dumps.py
+"""
+
+import io
+import csv
+import unittest
+
+import get_variation_sets as gvs
+import compact_dumps
+import utils as vs
+
+
+class CompactDumpsTest(unittest.TestCase):
+    utterances = [['a', 'b'], ['a', None, 'c'], ['ɨŋ', 'a'], ['d']]
+
+    def test_filenames(self):
+        assert compact_dumps.filenames("results/acq_w_2_m_1_z07_utterances.csv") == (
+            "results/acq_w_2_m_1_z07_pairs.csv", "results/acq_w_2_m_1_z07_texts.csv")
+
+    def test_text_rows(self):
+        rows = list(compact_dumps.text_rows([[(0, 1)], [], [(1, 2), (0, 2)]], self.utterances, 7))
+        assert rows == [[7, 0, None, 'a b'], [7, 1, None, 'a c'], [7, 2, None, 'ɨŋ a']]
+        utterances = vs.Utterances(self.utterances, [10, 12, 13, 15])
+        rows = list(compact_dumps.text_rows([[(0, 2)]], utterances, 7))
+        assert rows == [[7, 0, 10, 'a b'], [7, 2, 13, 'ɨŋ a']]
+
+    def test_expand(self):
+        cells = [((2, 1), [(0, 1), (1, 2)]), ((3, 1), [(0, 1), (0, 2), (1, 2)]), ((3, 2), [])]
+        sessions = [(1, vs.Utterances(self.utterances, [3, 4, 6, 7])), (2, [['"x"', 'y'], ['x\ny']])]
+        pairs, texts, expected = io.StringIO(), io.StringIO(), io.StringIO()
+        pairs_out = csv.writer(pairs, dialect='unix')
+        texts_out = csv.writer(texts, dialect='unix')
+        expected_out = csv.writer(expected, dialect='unix')
+        pairs_out.writerow(compact_dumps.PAIRS_HEADER)
+        texts_out.writerow(compact_dumps.TEXTS_HEADER)
+        expected_out.writerow(compact_dumps.UTTERANCES_HEADER)
+        for session, utterances in sessions:
+            session_cells = cells if session == 1 else [((2, 1), [(0, 1)])]
+            for (window, matches), cell_pairs in session_cells:
+                pairs_out.writerows(compact_dumps.pair_rows(cell_pairs, window, matches, session))
+                expected_out.writerows(gvs.dump_rows(cell_pairs, utterances, window, matches, session))
+            texts_out.writerows(compact_dumps.text_rows([p for _, p in session_cells], utterances, session))
+
+        pairs.seek(0)
+        texts.seek(0)
+        expanded = io.StringIO()
+        compact_dumps.expand(pairs, texts, expanded)
+        assert expanded.getvalue() == expected.getvalue()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,23 @@
 
 import get_variation_sets as gvs
 import utils as vs
-
+import loaders
+import db_backend_randomized as db_randomized
+import prepare_db
+import scheduler
+import compact_dumps
+import columnar
+
+import os
+import csv
+import shutil
+import sqlite3
+import tempfile
 import unittest
 import argparse
 
+import sqlalchemy as sa
+
 from itertools import groupby
 
 
@@ -391,3 +404,533 @@ class GoldTest(unittest.TestCase):
                       (1, [(['D', 'F', 'G'], ['D', 'F', 'G'])])]]
 
         self.assertEqual(gold_gold, self.get_counts(args))
+
+
+def loader_args(*flags):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-t", dest="tier", default="words")
+    parser.add_argument("-v", dest="nouns_verbs", action="store_true")
+    parser.add_argument("-e", dest="english_bnc", action="store_true")
+    parser.add_argument("-c", dest="chintang_adults", action="store_true")
+    parser.add_argument("-r", dest="random_text", action="store_true")
+    parser.add_argument("--case-folding", dest="case_folding", action="append")
+    return parser.parse_args(list(flags))
+
+
+class LoaderTest(unittest.TestCase):
+    """The single-query loaders must give the same sessions as the per-session queries."""
+
+    def assert_same_sessions(self, filename, *flags):
+        gvs.setup(filename)
+        args = loader_args(*flags)
+        expected = list(gvs.sessions_from_query(gvs.get_session_utterances(args), args))
+        self.assertEqual(list(loaders.load_sessions(gvs.conn, args)), expected)
+
+    def test_load_sessions_words(self):
+        self.assert_same_sessions("fixtures/gold.sqlite3")
+        self.assert_same_sessions("fixtures/gold.sqlite3", "-v")
+
+    def test_load_sessions_morphemes(self):
+        self.assert_same_sessions("fixtures/gold.sqlite3", "-t", "morphemes")
+        self.assert_same_sessions("fixtures/gold.sqlite3", "-t", "morphemes", "-v")
+
+    def test_load_sessions_bnc(self):
+        self.assert_same_sessions("fixtures/gold-cats-bnc.sqlite3", "-e")
+        self.assert_same_sessions("fixtures/gold-cats-bnc.sqlite3", "-e", "-t", "morphemes")
+
+    def test_load_sessions_bnc_duplicate_speakers(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "bnc.sqlite3")
+            shutil.copy("fixtures/gold-cats-bnc.sqlite3", filename)
+            # a second adult with the same source id and speaker label as speaker 1
+            with sqlite3.connect(filename) as c:
+                c.execute("INSERT INTO speakers (session_id_fk, corpus, language, speaker_label, macrorole) "
+                          "SELECT session_id_fk, corpus, language, speaker_label, macrorole FROM speakers WHERE id = 1")
+            args = loader_args("-e")
+            gvs.setup("fixtures/gold-cats-bnc.sqlite3")
+            expected = list(loaders.load_sessions(gvs.conn, args))
+            gvs.setup(filename)
+            self.assertEqual(list(loaders.load_sessions(gvs.conn, args)), expected)
+            gvs.setup(filename, raw_sqlite=True)
+            self.assertEqual(list(loaders.load_sessions(gvs.conn, args, gvs.raw)), expected)
+        finally:
+            gvs.setup("fixtures/gold.sqlite3")
+            shutil.rmtree(directory)
+
+    def test_load_sessions_gold(self):
+        gvs.setup("fixtures/gold.sqlite3")
+        sessions = list(loaders.load_sessions(gvs.conn, loader_args()))
+        self.assertEqual([(session, total) for session, total, _ in sessions], [(1, 5), (2, 4), (3, 6)])
+        self.assertEqual(sessions[1][2], [['a', 'b', 'x'], ['x', 'c', 'd'], ['d', 'x', 'e'], ['f', 'x', 'g']])
+
+    def test_utterance_ids(self):
+        args = loader_args()
+        for raw_sqlite in [False, True]:
+            gvs.setup("fixtures/gold.sqlite3", raw_sqlite)
+            for session, _, utterances in loaders.load_sessions(gvs.conn, args, gvs.raw):
+                self.assertEqual(len(utterances.utterance_ids), len(utterances))
+                for uid, utterance in zip(utterances.utterance_ids, utterances):
+                    self.assertEqual(gvs.get_utterances(args.tier, [uid], args), [utterance])
+        gvs.setup("fixtures/gold.sqlite3")
+
+
+class RawSqliteTest(unittest.TestCase):
+    """Loading through the sqlite3 module must give the same sessions as through SQLAlchemy."""
+
+    def assert_same_sessions_raw(self, filename, *flags):
+        args = loader_args(*flags)
+        gvs.setup(filename)
+        expected = list(gvs.sessions_from_query(gvs.get_session_utterances(args), args))
+        self.assertEqual(list(loaders.load_sessions(gvs.conn, args)), expected)
+
+        gvs.setup(filename, raw_sqlite=True)
+        self.assertEqual(list(gvs.sessions_from_query(gvs.get_session_utterances(args), args)), expected)
+        self.assertEqual(list(loaders.load_sessions(gvs.conn, args, gvs.raw)), expected)
+        gvs.setup(filename)
+
+    def test_raw_words(self):
+        self.assert_same_sessions_raw("fixtures/gold.sqlite3")
+        self.assert_same_sessions_raw("fixtures/gold-cats.sqlite3", "-v")
+
+    def test_raw_morphemes(self):
+        self.assert_same_sessions_raw("fixtures/gold.sqlite3", "-t", "morphemes")
+        self.assert_same_sessions_raw("fixtures/gold-cats.sqlite3", "-t", "morphemes", "-v")
+
+    def test_raw_bnc(self):
+        self.assert_same_sessions_raw("fixtures/gold-cats-bnc.sqlite3", "-e")
+        self.assert_same_sessions_raw("fixtures/gold-cats-bnc.sqlite3", "-e", "-t", "morphemes")
+
+    def test_raw_read_only(self):
+        gvs.setup("fixtures/gold.sqlite3", raw_sqlite=True)
+        with self.assertRaises(sqlite3.OperationalError):
+            gvs.raw.execute("CREATE TABLE test (id INTEGER)")
+        gvs.setup("fixtures/gold.sqlite3")
+
+
+class RandomizedLoaderTest(unittest.TestCase):
+    """The randomized loader must give the same sessions as the per-session queries."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "randomized.sqlite3")
+        engine = sa.create_engine("sqlite:///" + self.filename)
+        db_randomized.create_tables(engine)
+        rows = []
+        # utterance ids in the order of the randomized text, not sorted
+        for session, utterances in [(1, [(3, "Aa:N b:V"), (1, "c:ADJ"), (2, "a:N d:N e:V")]),
+                                    (2, [(2, "Ff:V"), (5, "g:N a:V"), (4, ":N")])]:
+            for uid, tokens in utterances:
+                for token in tokens.split():
+                    word, pos = token.split(":")
+                    rows.append(dict(session_id_fk=session, utterance_id_fk_rand=uid, word=word or "x",
+                                     pos_word_stem="", morpheme=word, pos=pos))
+        engine.execute(db_randomized.Result.__table__.insert(), rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_randomized_loader(self):
+        gvs.setup(self.filename)
+        for flags in [[], ["-v"], ["-t", "morphemes"], ["-t", "morphemes", "-v"]]:
+            args = loader_args("-r", *flags)
+            expected = list(gvs.sessions_from_query(gvs.get_session_utterances(args), args))
+            self.assertEqual(list(loaders.load_sessions(gvs.conn, args)), expected)
+
+    def test_randomized_order(self):
+        gvs.setup(self.filename, raw_sqlite=True)
+        sessions = list(loaders.load_sessions(gvs.conn, loader_args("-r", "-v")))
+        self.assertEqual(sessions, [(1, 3, [['Aa', 'b'], [], ['a', 'd', 'e']]), (2, 3, [['Ff'], ['g', 'a'], ['x']])])
+        sessions = list(loaders.load_sessions(gvs.conn, loader_args("-r", "--case-folding", "ascii")))
+        self.assertEqual(sessions[0][2][0], ['aa', 'b'])
+        gvs.setup(self.filename)
+
+
+class CaseFoldingTest(unittest.TestCase):
+    """Lowercasing in SQLite and in Python, by language."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "gold.sqlite3")
+        shutil.copy("fixtures/gold.sqlite3", self.filename)
+        with sqlite3.connect(self.filename) as c:
+            c.execute("UPDATE words SET word = 'ŊA' WHERE id = 1")
+            c.execute("UPDATE words SET word = 'Bb' WHERE id = (SELECT min(id) FROM words WHERE session_id_fk = 2)")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def first_tokens(self, *flags):
+        gvs.setup(self.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, loader_args(*flags)))
+        return [utterances[0][0] for _, _, utterances in sessions[:2]]
+
+    def test_parse_case_folding(self):
+        self.assertEqual(loaders.parse_case_folding(None), ('unicode', {}))
+        self.assertEqual(loaders.parse_case_folding(None, 'none'), ('none', {}))
+        self.assertEqual(loaders.parse_case_folding(['ascii', 'Cree=none']), ('ascii', {'Cree': 'none'}))
+        with self.assertRaises(ValueError):
+            loaders.parse_case_folding(['Cree=upper'])
+
+    def test_default_case_folding(self):
+        self.assertEqual(self.first_tokens(), ['ŋa', 'bb'])
+        args = loader_args()
+        self.assertEqual(list(loaders.load_sessions(gvs.conn, args)),
+                         list(gvs.sessions_from_query(gvs.get_session_utterances(args), args)))
+
+    def test_case_folding_by_language(self):
+        self.assertEqual(self.first_tokens("--case-folding", "ascii"), ['Ŋa', 'bb'])
+        self.assertEqual(self.first_tokens("--case-folding", "none", "--case-folding", "Cree=unicode"), ['ŊA', 'bb'])
+        self.assertEqual(self.first_tokens("--case-folding", "Chintang=none", "--case-folding", "Cree=ascii"),
+                         ['ŊA', 'bb'])
+
+
+class PrepareDbTest(unittest.TestCase):
+    """Loading from a prepared database must give the same sessions."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_same_sessions_prepared(self, fixture, *flags):
+        filename = os.path.join(self.directory, os.path.basename(fixture))
+        shutil.copy(fixture, filename)
+        args = loader_args(*flags)
+
+        gvs.setup(filename)
+        expected = list(loaders.load_sessions(gvs.conn, args))
+        self.assertFalse(loaders.is_materialized(gvs.conn, args))
+
+        engine = sa.create_engine("sqlite:///" + filename)
+        prepare_db.create_indexes(engine)
+        if args.english_bnc:
+            prepare_db.resolve_speakers(engine)
+            gvs.setup(filename)
+            self.assertTrue(loaders.is_resolved(gvs.conn))
+            self.assertEqual(list(loaders.load_sessions(gvs.conn, args)), expected)
+        prepare_db.materialize_adult_utterances(engine, args)
+        gvs.setup(filename)
+        self.assertTrue(loaders.is_materialized(gvs.conn, args))
+        self.assertEqual(list(loaders.load_sessions(gvs.conn, args)), expected)
+
+    def prepare(self, fixture, *flags):
+        filename = os.path.join(self.directory, os.path.basename(fixture))
+        shutil.copy(fixture, filename)
+        engine = sa.create_engine("sqlite:///" + filename)
+        args = loader_args(*flags)
+        if args.english_bnc:
+            prepare_db.resolve_speakers(engine)
+        prepare_db.materialize_adult_utterances(engine, args)
+        return filename
+
+    def test_prepared_out_of_date(self):
+        filename = self.prepare("fixtures/gold.sqlite3")
+        with sqlite3.connect(filename) as c:
+            c.execute("UPDATE speakers SET macrorole = 'Target_Child' WHERE id = "
+                      "(SELECT speaker_id_fk FROM utterances WHERE id = 1)")
+        gvs.setup(filename)
+        args = loader_args()
+        self.assertFalse(loaders.is_materialized(gvs.conn, args))
+        self.assertEqual(list(loaders.load_sessions(gvs.conn, args)),
+                         list(gvs.sessions_from_query(gvs.get_session_utterances(args), args)))
+
+    def test_prepared_speaker_changed(self):
+        filename = self.prepare("fixtures/gold.sqlite3")
+        args = loader_args()
+        gvs.setup(filename)
+        prepared = list(loaders.load_sessions(gvs.conn, args))
+        # the same length as the speaker it replaces, on a speaker of another session
+        with sqlite3.connect(filename) as c:
+            c.execute("UPDATE utterances SET speaker_id_fk = '2' WHERE id = 3")
+        gvs.setup(filename)
+        self.assertFalse(loaders.is_materialized(gvs.conn, args))
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        self.assertEqual(sessions, list(gvs.sessions_from_query(gvs.get_session_utterances(args), args)))
+        self.assertNotEqual(sessions, prepared)
+
+    def test_prepared_other_mode(self):
+        filename = self.prepare("fixtures/gold-cats-bnc.sqlite3", "-e")
+        gvs.setup(filename)
+        self.assertTrue(loaders.is_materialized(gvs.conn, loader_args("-e")))
+        self.assertFalse(loaders.is_materialized(gvs.conn, loader_args()))
+
+    def test_prepared_duplicate_speakers(self):
+        os.mkdir(os.path.join(self.directory, "source"))
+        filename = os.path.join(self.directory, "source", "duplicates.sqlite3")
+        shutil.copy("fixtures/gold-cats-bnc.sqlite3", filename)
+        with sqlite3.connect(filename) as c:
+            c.execute("INSERT INTO speakers (session_id_fk, corpus, language, speaker_label, macrorole) "
+                      "SELECT session_id_fk, corpus, language, speaker_label, macrorole FROM speakers WHERE id = 1")
+        self.assert_same_sessions_prepared(filename, "-e")
+
+    def test_prepared_acqdiv(self):
+        self.assert_same_sessions_prepared("fixtures/gold.sqlite3")
+
+    def test_prepared_bnc(self):
+        self.assert_same_sessions_prepared("fixtures/gold-cats-bnc.sqlite3", "-e")
+        self.assert_same_sessions_prepared("fixtures/gold-cats-bnc.sqlite3", "-e", "-t", "morphemes", "-v")
+
+
+class ParallelTest(unittest.TestCase):
+    """Matching the sessions in a process pool must give the same rows, in the same order."""
+
+    def assert_same_rows(self, **options):
+        gvs.setup("fixtures/gold.sqlite3")
+        args = argparse.Namespace(window=[2, 4], minimum_matches=[1, 3], fuzzy=[None], incremental=False,
+                                  tail=False, write_output=True, compact=False, numpy=False, jobs=2,
+                                  **vars(loader_args()))
+        vars(args).update(options)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        expected = [gvs.session_rows(session, total, utterances, args) for session, total, utterances in sessions]
+        self.assertEqual(list(gvs.parallel_session_rows(sessions, args)), expected)
+
+    def test_parallel_anchor(self):
+        self.assert_same_rows()
+
+    def test_parallel_incremental_fuzzy(self):
+        self.assert_same_rows(incremental=True, fuzzy=[0.5, 0.8])
+
+    def test_parallel_similarity_counts(self):
+        gvs.setup("fixtures/gold.sqlite3")
+        args = argparse.Namespace(window=[2, 4], minimum_matches=[1, 3], fuzzy=[0.5], incremental=False,
+                                  tail=False, write_output=False, compact=False, numpy=False, jobs=2,
+                                  **vars(loader_args()))
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        gvs.similarities.clear()
+        for session, total, utterances in sessions:
+            gvs.session_rows(session, total, utterances, args)
+        lookups = gvs.similarities[0.5].hits + gvs.similarities[0.5].misses
+        gvs.similarities.clear()
+        list(gvs.parallel_session_rows(sessions, args))
+        # the workers' lookups are added up in this process
+        self.assertEqual(gvs.similarities[0.5].hits + gvs.similarities[0.5].misses, lookups)
+        self.assertGreater(lookups, 0)
+
+    def test_parallel_chunked(self):
+        min_chunk = scheduler.MIN_CHUNK
+        scheduler.MIN_CHUNK = 1
+        try:
+            self.assert_same_rows()
+            self.assert_same_rows(incremental=True, tail=True, fuzzy=[1])
+        finally:
+            scheduler.MIN_CHUNK = min_chunk
+
+
+    def test_parallel_batches(self):
+        gvs.setup("fixtures/gold.sqlite3")
+        args = argparse.Namespace(window=[2, 4], minimum_matches=[1, 3], fuzzy=[None], incremental=False,
+                                  tail=False, write_output=True, compact=False, numpy=False, jobs=2,
+                                  **vars(loader_args()))
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        expected = [gvs.session_rows(session, total, utterances, args) for session, total, utterances in sessions]
+        read = []
+
+        def reading():
+            for session in sessions:
+                read.append(session[0])
+                yield session
+
+        batch_utterances = scheduler.BATCH_UTTERANCES
+        scheduler.BATCH_UTTERANCES = 1
+        try:
+            rows = gvs.parallel_session_rows(reading(), args)
+            self.assertEqual(next(rows), expected[0])
+            # the first session is matched while the second one is read, not after all of them are
+            self.assertEqual(read, [session for session, _, _ in sessions[:2]])
+            self.assertEqual(list(rows), expected[1:])
+        finally:
+            scheduler.BATCH_UTTERANCES = batch_utterances
+
+
+class OutputTest(unittest.TestCase):
+    """Runs write_output in a temporary directory."""
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.abspath("fixtures/gold.sqlite3")
+        os.chdir(self.directory)
+        os.mkdir("results")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def run_files(self, args, sessions):
+        gvs.write_output(sessions, args)
+        return self.read_files(args)
+
+    def read_files(self, args):
+        files = {}
+        for fuzzy in args.fuzzy:
+            for filename in gvs._out_filename(args, fuzzy):
+                with open(filename) as f:
+                    files[filename] = f.read()
+        return files
+
+
+class PipelineOutputTest(OutputTest):
+    """Loading and writing the sessions in threads of their own must write the same files as one after another."""
+
+    def test_queue_size(self):
+        argv = ["-f", self.filename, "-w", "2", "-w", "4", "-m", "1", "-m", "2", "-z", "0.5", "-o"]
+        gvs.setup(self.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, gvs.parse_args(argv)))
+        expected = self.run_files(gvs.parse_args(argv + ["--queue-size", "0"]), iter(sessions))
+        batch_utterances = scheduler.BATCH_UTTERANCES
+        scheduler.BATCH_UTTERANCES = 1
+        try:
+            for options in [[], ["-j", "2"], ["-j", "2", "--queue-size", "0"]]:
+                self.assertEqual(self.run_files(gvs.parse_args(argv + options), iter(sessions)), expected)
+        finally:
+            scheduler.BATCH_UTTERANCES = batch_utterances
+
+
+class ResumeTest(OutputTest):
+    """A run that is cut short and resumed must write the same files as one that isn't."""
+
+    def cut_short(self, sessions, after):
+        for k, session in enumerate(sessions):
+            if k == after:
+                raise KeyboardInterrupt
+            yield session
+
+    def test_resume(self):
+        args = gvs.parse_args(["-f", self.filename, "-w", "2", "-w", "4", "-m", "1", "-m", "2", "-z", "0.5",
+                               "-z", "0.8", "-o", "--checkpoint"])
+        gvs.setup(self.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        expected = self.run_files(args, sessions)
+        self.assertFalse(os.path.exists(gvs._checkpoint_filename(args)))
+
+        with self.assertRaises(KeyboardInterrupt):
+            gvs.write_output(self.cut_short(sessions, 2), args)
+        self.assertTrue(os.path.exists(gvs._checkpoint_filename(args)))
+        # half of the next session made it to the files
+        for filename in expected:
+            with open(filename, 'a') as f:
+                f.write("3,half a row")
+
+        args.resume = True
+        self.assertEqual(self.run_files(args, sessions), expected)
+        self.assertFalse(os.path.exists(gvs._checkpoint_filename(args)))
+
+    def test_no_checkpoint(self):
+        args = gvs.parse_args(["-f", self.filename, "-w", "2", "-m", "1"])
+        gvs.setup(self.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        with self.assertRaises(KeyboardInterrupt):
+            gvs.write_output(self.cut_short(sessions, 1), args)
+        self.assertFalse(os.path.exists(gvs._checkpoint_filename(args)))
+        self.assertTrue(gvs.parse_args(["-f", self.filename, "-w", "2", "-m", "1", "--resume"]).checkpoint)
+
+    def test_resume_other_run(self):
+        args = gvs.parse_args(["-f", self.filename, "-w", "2", "-m", "1", "--checkpoint"])
+        gvs.setup(self.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        with self.assertRaises(KeyboardInterrupt):
+            gvs.write_output(self.cut_short(sessions, 1), args)
+        args.resume = True
+        args.case_folding = ['ascii']
+        with self.assertRaises(SystemExit):
+            gvs.write_output(sessions, args)
+
+
+class ResultCacheTest(OutputTest):
+    """A run over a wider range with the result cache must write the same files as one without it."""
+
+    def test_widened_range(self):
+        gvs.setup(self.filename)
+        argv = ["-f", self.filename, "-w", "2", "-w", "4", "-m", "1", "-m", "3", "-z", "0.5", "-o"]
+        args = gvs.parse_args(argv)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        expected = self.run_files(args, sessions)
+
+        cached = argv + ["--result-cache", "results.sqlite3"]
+        self.run_files(gvs.parse_args(["-f", self.filename, "-w", "3", "-m", "1", "-m", "2", "-z", "0.5",
+                                       "--result-cache", "results.sqlite3"]), sessions)
+        for jobs in ["1", "2"]:
+            self.assertEqual(self.run_files(gvs.parse_args(cached + ["-j", jobs]), sessions), expected)
+
+    def test_widened_tables(self):
+        gvs.setup(self.filename)
+        argv = ["-f", self.filename, "-w", "2", "-w", "5", "-m", "1", "-m", "3", "-z", "0.5", "-z", "0.8", "-o"]
+        sessions = list(loaders.load_sessions(gvs.conn, gvs.parse_args(argv)))
+        expected = self.run_files(gvs.parse_args(argv), sessions)
+        min_chunk = scheduler.MIN_CHUNK
+        scheduler.MIN_CHUNK = 1
+        try:
+            for jobs in ["1", "2"]:
+                cache = ["--result-cache", "results%s.sqlite3" % jobs, "-j", jobs]
+                # a narrower window, then another -z value and wider windows, extending the cached tables
+                self.run_files(gvs.parse_args(["-f", self.filename, "-w", "2", "-w", "3", "-m", "1", "-m", "3",
+                                               "-z", "0.8", "-o"] + cache), sessions)
+                self.assertEqual(self.run_files(gvs.parse_args(argv + cache), sessions), expected)
+        finally:
+            scheduler.MIN_CHUNK = min_chunk
+
+        # cells of windows the tables already reach are swept from them without scoring anything
+        gvs.similarities.clear()
+        self.run_files(gvs.parse_args(["-f", self.filename, "-w", "4", "-m", "4", "-z", "0.5", "-o",
+                                       "--result-cache", "results1.sqlite3"]), sessions)
+        self.assertFalse(gvs.similarities)
+
+
+class CompactTest(OutputTest):
+    """The compact dumps must expand to the utterances files."""
+
+    def test_compact(self):
+        argv = ["-f", self.filename, "-w", "2", "-w", "4", "-m", "1", "-m", "2", "-z", "0.5", "-z", "0.8", "-o"]
+        args = gvs.parse_args(argv)
+        gvs.setup(self.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        expected = self.run_files(args, sessions)
+
+        args = gvs.parse_args(argv + ["--compact"])
+        gvs.write_output(sessions, args)
+        for fuzzy in args.fuzzy:
+            _, utterances_filename = gvs._out_filename(args, fuzzy)
+            os.remove(utterances_filename)
+            pairs_filename, _ = compact_dumps.filenames(utterances_filename)
+            compact_dumps.main(argparse.Namespace(pairs=pairs_filename))
+        self.assertEqual(self.read_files(args), expected)
+
+
+class ColumnarOutputTest(OutputTest):
+    """A run with --format sqlite must have the rows of the CSV files."""
+
+    def test_sqlite(self):
+        self.assert_same_rows([])
+
+    def test_batches(self):
+        # the rows are written out by the writer thread in many batches
+        batch_size = columnar.ROWS_PER_BATCH
+        columnar.ROWS_PER_BATCH = 5
+        try:
+            self.assert_same_rows(["--queue-size", "2"])
+        finally:
+            columnar.ROWS_PER_BATCH = batch_size
+
+    def assert_same_rows(self, options):
+        argv = ["-f", self.filename, "-w", "2", "-w", "4", "-m", "1", "-m", "2", "-z", "0.5", "-o"] + options
+        args = gvs.parse_args(argv)
+        gvs.setup(self.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        self.run_files(args, sessions)
+
+        args = gvs.parse_args(argv + ["--format", "sqlite"])
+        gvs.write_output(sessions, args)
+        for filename in gvs._out_filename(args):
+            with open(filename) as f:
+                rows = list(csv.reader(f))
+            table = filename[:-len(".csv")].rsplit("_", 1)[-1]
+            db = sqlite3.connect(columnar.filename(filename, "sqlite"))
+            cursor = db.execute("SELECT * FROM %s ORDER BY rowid" % table)
+            self.assertEqual([[column[0] for column in cursor.description]] +
+                             [[str(value) for value in row] for row in cursor], rows)
+
+    def test_no_resume(self):
+        with self.assertRaises(SystemExit):
+            gvs.parse_args(["-f", self.filename, "-w", "2", "-m", "1", "--format", "sqlite", "--resume"])
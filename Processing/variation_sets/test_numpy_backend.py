@@ -0,0 +1,48 @@
+"""
+Tests for numpy_backend.py
+"""
+
+import random
+import unittest
+
+import numpy_backend
+import utils
+
+
+@unittest.skipUnless(numpy_backend.available(), "requires numpy")
+class OverlapBandTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+        self.vocabulary = {}
+        utterances = [[random.choice('ABCDEFG') for _ in range(random.randint(0, 4))] for _ in range(40)]
+        self.interned = utils.intern_utterances(utterances, self.vocabulary)
+        self.cells = [(w, m) for w in range(1, 7) for m in range(0, 4)]
+
+    def score(self, a, b):
+        return utils.match_score(a, b, None)
+
+    def test_overlap_band(self):
+        band = numpy_backend.overlap_band(self.interned, 5, len(self.vocabulary))
+        table = utils.overlap_table(self.interned, 5, self.score)
+        assert [list(row[:len(table_row)]) for row, table_row in zip(band, table)] == table
+
+    def test_sweep_anchor(self):
+        band = numpy_backend.overlap_band(self.interned, 5, len(self.vocabulary))
+        table = utils.overlap_table(self.interned, 5, self.score)
+        assert numpy_backend.sweep(band, self.cells) == utils.sweep(table, self.cells)
+
+    def test_sweep_incremental(self):
+        band = numpy_backend.overlap_band(self.interned, 1, len(self.vocabulary))
+        table = utils.overlap_table(self.interned, 1, self.score)
+        assert numpy_backend.sweep(band, self.cells, True) == utils.sweep(table, self.cells, True)
+
+    def test_sweep_tail(self):
+        band = numpy_backend.overlap_band(self.interned, 5, len(self.vocabulary))
+        table = utils.overlap_table(self.interned, 5, self.score)
+        assert numpy_backend.sweep(band, self.cells, tail=True) == utils.sweep(table, self.cells, tail=True)
+        assert numpy_backend.sweep(band, self.cells, True, True) == utils.sweep(table, self.cells, True, True)
+
+    def test_overlap_band_short_session(self):
+        band = numpy_backend.overlap_band(self.interned[:1], 3, len(self.vocabulary))
+        assert band.tolist() == [[-1, -1, -1]]
+        assert numpy_backend.sweep(band, [(2, 0)]) == [(0, [])]
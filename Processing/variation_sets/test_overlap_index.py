@@ -0,0 +1,84 @@
+"""
+Tests for overlap_index.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import argparse
+
+import get_variation_sets as gvs
+import loaders
+import overlap_index
+
+
+def loader_args(**options):
+    args = argparse.Namespace(filename="fixtures/gold.sqlite3", tier="words", nouns_verbs=False, english_bnc=False,
+                              chintang_adults=False, random_text=False, case_folding=None, window=['2', '5'],
+                              minimum_matches=['1'], fuzzy=[None], incremental=False, tail=False, write_output=True,
+                              numpy=False)
+    vars(args).update(options)
+    return args
+
+
+@unittest.skipUnless(overlap_index.available(), "requires numpy")
+class OverlapIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'gold.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assert_same_results(self, **options):
+        args = loader_args(**options)
+        gvs.setup(args.filename)
+        sessions = list(loaders.load_sessions(gvs.conn, args))
+        overlap_index.build(self.path, sessions, args)
+        index = overlap_index.OverlapIndex(self.path)
+        assert list(index.sessions()) == sessions
+        assert ([utterances.utterance_ids for _, _, utterances in index.sessions()] ==
+                [utterances.utterance_ids for _, _, utterances in sessions])
+
+        for window, minimum_matches in [(['2', '5'], ['1', '3']), (['3'], ['2']), (['1', '4'], ['0', '1'])]:
+            for incremental in [False, True]:
+                for tail in [False, True]:
+                    query = loader_args(window=window, minimum_matches=minimum_matches, incremental=incremental,
+                                        tail=tail, fuzzy=args.fuzzy)
+                    cells = list(gvs._win_min_iter(query))
+                    expected = [gvs.match_session(utterances, query)[1] for _, _, utterances in sessions]
+                    assert [results for _, _, results in index.query(cells, incremental, tail)] == expected
+                    assert [index.results(session, query) for session, _, _ in sessions] == expected
+
+    def test_strict(self):
+        self.assert_same_results()
+
+    def test_levenshtein(self):
+        self.assert_same_results(fuzzy=[1, 2], nouns_verbs=True)
+
+    def test_difflib(self):
+        self.assert_same_results(fuzzy=[0.5, 0.8])
+
+    def test_larger_window(self):
+        args = loader_args()
+        overlap_index.build(self.path, [(1, 2, [['a'], ['a']])], args)
+        index = overlap_index.OverlapIndex(self.path)
+        with self.assertRaises(ValueError):
+            list(index.query([(6, 1)]))
+        # incremental matching only ever needs the neighbours
+        assert list(index.query([(6, 1)], incremental=True, tail=True)) == [(1, 2, [[(1, [(0, 1)])]])]
+
+    def test_query_argv(self):
+        args = overlap_index.get_parser().parse_args(["query", self.path, "-w", "2", "-m", "1", "-o", "--format",
+                                                      "sqlite"])
+        assert overlap_index.query_argv(args) == ["-w", "2", "-m", "1", "-o", "--format", "sqlite"]
+        query_args = gvs.parse_args(["-f", "fixtures/gold.sqlite3"] + overlap_index.query_argv(args))
+        assert query_args.output_format == "sqlite"
+        args = overlap_index.get_parser().parse_args(["query", self.path, "-w", "2", "-m", "1"])
+        assert "--format" not in overlap_index.query_argv(args)
+
+
+if __name__ == '__main__':
+    unittest.main()
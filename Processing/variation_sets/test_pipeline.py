@@ -0,0 +1,85 @@
+"""
+Tests for pipeline.py
+"""
+
+import time
+import unittest
+
+import pipeline
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_prefetch(self):
+        stats = []
+        assert list(pipeline.prefetch(iter(range(10)), stats, 2)) == list(range(10))
+        assert len(stats) == 1
+
+    def test_prefetch_error(self):
+        def items():
+            yield 1
+            raise KeyboardInterrupt
+
+        loaded = pipeline.prefetch(items(), [])
+        assert next(loaded) == 1
+        with self.assertRaises(KeyboardInterrupt):
+            next(loaded)
+
+    def test_prefetch_stops_early(self):
+        read = []
+
+        def items():
+            for k in range(1000):
+                read.append(k)
+                yield k
+
+        loaded = pipeline.prefetch(items(), [], 2)
+        assert next(loaded) == 0
+        loaded.close()
+        # the loader stopped instead of reading everything
+        assert len(read) < 10
+
+    def test_backpressure(self):
+        stats = []
+
+        def items():
+            for k in range(5):
+                yield k
+
+        loaded = pipeline.prefetch(items(), stats, 1)
+        for _ in loaded:
+            time.sleep(0.01)
+        # the matcher was slower, so the loader had to wait for room
+        assert stats[0].full_waits > 0
+        assert stats[0].full_time > 0
+
+    def test_writer(self):
+        written = []
+        stats = []
+        with pipeline.Writer(written.append, stats, 2) as writer:
+            for k in range(10):
+                writer.put(k)
+        assert written == list(range(10))
+        assert len(stats) == 1
+
+    def test_writer_finishes_on_error(self):
+        written = []
+        with self.assertRaises(KeyboardInterrupt):
+            with pipeline.Writer(written.append, [], 2) as writer:
+                writer.put(1)
+                writer.put(2)
+                raise KeyboardInterrupt
+        # what was put before is written
+        assert written == [1, 2]
+
+    def test_writer_error(self):
+        def write(item):
+            raise IOError("disk full")
+
+        with self.assertRaises(IOError):
+            with pipeline.Writer(write, []) as writer:
+                writer.put(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""
+Tests for result_cache.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import argparse
+
+import result_cache
+
+
+class ResultCacheTest(unittest.TestCase):
+    utterances = [['a', 'b'], ['b', 'c'], ['ɨŋ']]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'results.sqlite3')
+        self.args = argparse.Namespace(tier='words', nouns_verbs=False, incremental=False, tail=False,
+                                       fuzzy=[None], write_output=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_session_hash(self):
+        assert result_cache.session_hash(self.utterances) == result_cache.session_hash([['a', 'b'], ['b', 'c'],
+                                                                                        ['ɨŋ']])
+        assert result_cache.session_hash(self.utterances) != result_cache.session_hash([['a', 'b'], ['b', 'c']])
+
+    def test_round_trip(self):
+        cache = result_cache.ResultCache(self.path)
+        session = result_cache.session_hash(self.utterances)
+        assert cache.get(session, self.args, [(2, 1), (3, 1)]) == [[None, None]]
+        cache.put(session, self.args, [[(2, 1)]], [[(1, [(0, 1)])]])
+        cache.close()
+
+        cache = result_cache.ResultCache(self.path)
+        assert cache.get(session, self.args, [(2, 1), (3, 1)]) == [[(1, [(0, 1)]), None]]
+        assert (cache.hits, cache.misses) == (1, 1)
+        # the options are part of the key
+        self.args.incremental = True
+        assert cache.get(session, self.args, [(2, 1)]) == [[None]]
+        cache.close()
+
+    def test_pairs_only_with_write_output(self):
+        cache = result_cache.ResultCache(self.path)
+        self.args.write_output = False
+        cache.put('session', self.args, [[(2, 1)]], [[(1, [(0, 1)])]])
+        assert cache.get('session', self.args, [(2, 1)]) == [[(1, [])]]
+        # counts without the pairs are no use to a run with -o
+        self.args.write_output = True
+        assert cache.get('session', self.args, [(2, 1)]) == [[None]]
+        cache.put('session', self.args, [[(2, 1)]], [[(1, [(0, 1)])]])
+        assert cache.get('session', self.args, [(2, 1)]) == [[(1, [(0, 1)])]]
+        cache.close()
+
+    def test_fuzzy(self):
+        cache = result_cache.ResultCache(self.path)
+        self.args.fuzzy = [0.5, 0.8]
+        cache.put('session', self.args, [[(2, 1)], [(2, 1)]], [[(2, [])], [(1, [])]])
+        self.args.fuzzy = [0.8, 1]
+        assert cache.get('session', self.args, [(2, 1)]) == [[(1, [])], [None]]
+        cache.close()
+
+    def test_tables(self):
+        cache = result_cache.ResultCache(self.path)
+        self.args.fuzzy = [0.5, 0.8]
+        cache.put('session', self.args, [[(2, 1)], []], [[(1, [])], []], [(1, [[2], [None], []]), None])
+        cache.close()
+
+        cache = result_cache.ResultCache(self.path)
+        self.args.fuzzy = [0.8, 0.5]
+        assert cache.get_tables('session', self.args, [[(3, 1)], [(3, 1)]]) == [None, (1, [[2], [None], []])]
+        # only the tables of the -z values with missing cells are looked up
+        assert cache.get_tables('session', self.args, [[(3, 1)], []]) == [None, None]
+        self.args.fuzzy = [0.5]
+        cache.put('session', self.args, [[(3, 1)]], [[(1, [])]], [(2, [[2, 0], [None], []])])
+        assert cache.get_tables('session', self.args, [[(4, 1)]]) == [(2, [[2, 0], [None], []])]
+        assert cache.size == sum(row[0] for row in cache.db.execute("SELECT size FROM cells UNION ALL "
+                                                                    "SELECT size FROM tables"))
+        cache.close()
+
+    def test_evict(self):
+        cache = result_cache.ResultCache(self.path, max_bytes=5 * result_cache.CELL_BYTES)
+        self.args.write_output = False
+        cache.get('table', self.args, [])
+        cache.put('table', self.args, [[]], [[]], [(3, [[0] * 10])])
+        cache.get('old', self.args, [])
+        cache.put('old', self.args, [[(2, 1), (3, 1), (4, 1)]], [[(1, []), (1, []), (1, [])]])
+        cache.get('new', self.args, [])
+        cache.put('new', self.args, [[(2, 1), (3, 1), (4, 1)]], [[(1, []), (1, []), (1, [])]])
+        assert cache.size <= 5 * result_cache.CELL_BYTES
+        assert cache.get('new', self.args, [(2, 1), (3, 1), (4, 1)]) == [[(1, []), (1, []), (1, [])]]
+        assert None in cache.get('old', self.args, [(2, 1), (3, 1), (4, 1)])[0]
+        assert cache.get_tables('table', self.args, [[(2, 1)]]) == [None]
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""
+Tests for scheduler.py
+"""
+
+import unittest
+
+import utils
+import scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    utterances = [('A', 'B', 'C'), ('D', 'E', 'F'), ('D', 'G', 'H'), ('D', 'G', 'I'), ('D', 'G', 'I'),
+                  ('X', 'Y', 'Z'), ('A', 'B', 'C'), ('A', 'B', 'C'), ('D', 'G'), ('G', 'I', 'B')]
+    cells = [(w, m) for w in range(2, 6) for m in range(0, 4)]
+
+    def score(self, a, b):
+        return utils.match_score(a, b, None)
+
+    def chunked(self, chunks, incremental=False, tail=False):
+        max_distance = 1 if incremental else 4
+        results = []
+        bounds = scheduler.chunk_bounds(len(self.utterances), 5, chunks)
+        for first, stop, end in bounds:
+            table = utils.overlap_table(self.utterances[first:end], max_distance, self.score)
+            results.append([utils.sweep(table, self.cells, incremental, tail, stop=stop)])
+        return scheduler.stitch(results, [first for first, _, _ in bounds])[0]
+
+    def test_batches(self):
+        sessions = [(1, 2, [['a'], ['b']]), (2, 1, [['c']]), (3, 0, []), (4, 4, [['d']] * 4), (5, 1, [['e']])]
+        assert list(scheduler.batches(iter(sessions), 3)) == [sessions[:2], sessions[2:4], sessions[4:]]
+        assert list(scheduler.batches(iter(sessions), 100)) == [sessions]
+        assert list(scheduler.batches(iter([]), 3)) == []
+
+    def test_estimate_cost(self):
+        assert scheduler.estimate_cost([], 4, [None]) == 0
+        assert scheduler.estimate_cost([['a', 'b'], ['c', 'd']], 4, [None]) == 16
+        assert scheduler.estimate_cost([['a', 'b'], ['c', 'd']], 4, [1, 2]) == 64
+
+    def test_chunk_bounds(self):
+        assert scheduler.chunk_bounds(10, 5, 1) == [(0, 10, 10)]
+        assert scheduler.chunk_bounds(10, 5, 3) == [(0, 3, 7), (3, 3, 10), (6, 4, 10)]
+        assert scheduler.chunk_bounds(3, 5, 4) == [(0, 1, 3), (1, 2, 3)]
+        assert scheduler.chunk_bounds(0, 5, 4) == [(0, 0, 0)]
+
+    def test_stitched_chunks(self):
+        for incremental in [False, True]:
+            for tail in [False, True]:
+                table = utils.overlap_table(self.utterances, 1 if incremental else 4, self.score)
+                expected = utils.sweep(table, self.cells, incremental, tail)
+                for chunks in range(1, 10):
+                    assert self.chunked(chunks, incremental, tail) == expected
+
+    def test_plan(self):
+        tasks, chunks = scheduler.plan([10, 100, 20], [10, 300, 20], 5, 2, min_chunk=50)
+        assert chunks == [1, 4, 1]
+        assert tasks == [(1, 1, 74, 75, 153), (1, 2, 149, 75, 228), (1, 0, 0, 74, 78), (1, 3, 224, 76, 300),
+                         (2, 0, 0, 20, 20), (0, 0, 0, 10, 10)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+"""
+Tests for token_cache.py
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import argparse
+
+import token_cache
+import utils as vs
+
+
+@unittest.skipUnless(token_cache.available(), "requires numpy")
+class TokenCacheTest(unittest.TestCase):
+    sessions = [(1, 3, [['a', 'b'], [], [None, 'a', 'ɨŋ']]),
+                (5, 0, []),
+                (7, 2, [['c'], ['b', 'b']])]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.args = argparse.Namespace(tier='words', nouns_verbs=False, english_bnc=False, chintang_adults=False,
+                                       random_text=False, case_folding=None)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        path = os.path.join(self.directory, 'view')
+        assert list(token_cache.write_cache(path, iter(self.sessions))) == self.sessions
+        assert list(token_cache.read_cache(path)) == self.sessions
+
+    def test_utterance_ids(self):
+        path = os.path.join(self.directory, 'view')
+        sessions = [(1, 4, vs.Utterances([['a'], ['b']], [3, 9])), (2, 1, [['c']])]
+        list(token_cache.write_cache(path, iter(sessions)))
+        assert [utterances.utterance_ids for _, _, utterances in token_cache.read_cache(path)] == [[3, 9], [None]]
+
+    def test_not_written_until_finished(self):
+        path = os.path.join(self.directory, 'view')
+        sessions = token_cache.write_cache(path, iter(self.sessions))
+        next(sessions)
+        assert not os.path.exists(path)
+
+    def test_cached_sessions(self):
+        database = os.path.join(self.directory, 'db.sqlite3')
+        with open(database, 'w') as f:
+            f.write('not really a database')
+        cache = os.path.join(self.directory, 'cache')
+        assert list(token_cache.cached_sessions(cache, database, self.args, lambda: iter(self.sessions))) == self.sessions
+        assert list(token_cache.cached_sessions(cache, database, self.args, lambda: iter([]))) == self.sessions
+
+    def test_cache_key(self):
+        database = os.path.join(self.directory, 'db.sqlite3')
+        with open(database, 'w') as f:
+            f.write('not really a database')
+        key = token_cache.cache_key(database, self.args)
+        self.args.nouns_verbs = True
+        assert token_cache.cache_key(database, self.args) != key
+        with open(database, 'w') as f:
+            f.write('a different database')
+        self.args.nouns_verbs = False
+        assert token_cache.cache_key(database, self.args) != key
+        key = token_cache.cache_key(database, self.args)
+        self.args.case_folding = ['ascii']
+        assert token_cache.cache_key(database, self.args) != key
@@ -2,6 +2,8 @@
 Tests for utils.py
 """
 
+import pickle
+import random
 import unittest
 import utils
 
@@ -16,6 +18,20 @@ class WindowsTest(unittest.TestCase):
         assert list(utils.window(a, 3)) == [('A', 'B', 'C'), ('B', 'C', 'D')]
 
 
+class WindowBoundsTest(unittest.TestCase):
+    def test_window_bounds_same_as_windows(self):
+        a = ["A", "B", "C", "D", "E"]
+        for n in range(1, 7):
+            assert [tuple(a[start:end]) for start, end in utils.window_bounds(len(a), n)] == list(utils.window(a, n))
+
+    def test_window_bounds_tail(self):
+        assert list(utils.window_bounds(4, 3, tail=True)) == [(0, 3), (1, 4), (2, 4)]
+
+    def test_window_bounds_tail_short(self):
+        assert list(utils.window_bounds(3, 5)) == []
+        assert list(utils.window_bounds(3, 5, tail=True)) == [(0, 3), (1, 3)]
+
+
 class MatchesAnchorTest(unittest.TestCase):
     a = [[('A', 'B', 'C'), ('D', 'E', 'F'), ('D', 'G', 'H'), ('D', 'G', 'I'), ('D', 'G', 'I')]]
 
@@ -61,6 +77,12 @@ class MatchesAnchorTest(unittest.TestCase):
         assert utils.matches_anchor(iter(b), 3, None) == (1, [(('A', 'B', 'C'), ('A', 'B', 'C'))])
 
 
+    def test_iter_matches_anchor(self):
+        matches = utils.iter_matches_anchor(iter(self.a), 0, None)
+        assert next(matches) == (('A', 'B', 'C'), ('D', 'E', 'F'))
+        assert list(matches) == []
+
+
 class MatchesIncrementalTest(unittest.TestCase):
     def test_matches_incremental_gap(self):
         a = [[('A', 'B', 'C'), ('X', 'Y', 'Z'), ('A', 'B', 'C')]]
@@ -81,7 +103,197 @@ class MatchesIncrementalTest(unittest.TestCase):
         assert utils.matches_incremental(iter(a), 3, None) == (2, [(('A', 'B', 'C'), ('A', 'B', 'C')),
                                                                    (('A', 'B', 'C'), ('A', 'B', 'C'))])
 
+    def test_iter_matches_incremental(self):
+        a = [[('A', 'B', 'C'), ('A', 'B', 'C'), ('A', 'B', 'C')]]
+        assert list(utils.iter_matches_incremental(iter(a), 2, None)) == [(('A', 'B', 'C'), ('A', 'B', 'C')),
+                                                                         (('A', 'B', 'C'), ('A', 'B', 'C'))]
+
     def test_matches_incremental_2_utts_to_many(self):
         a = [[('A', 'B', 'C'), ('A', 'B', 'C')],
              [('A', 'B', 'C'), ('A', 'B', 'C')]]
         assert utils.matches_incremental(iter(a), 4, None) == (0, [])
+
+
+class InternUtterancesTest(unittest.TestCase):
+    def test_intern_utterances(self):
+        vocabulary = {}
+        a = utils.intern_utterances([['a', 'b', 'a'], ['b', None], []], vocabulary)
+        assert vocabulary == {'a': 0, 'b': 1, None: 2}
+        assert a == [frozenset([0, 1]), frozenset([1, 2]), frozenset()]
+        assert a[0].tokens == ['a', 'b', 'a']
+
+    def test_intern_utterances_shared_vocabulary(self):
+        vocabulary = {}
+        utils.intern_utterances([['a', 'b']], vocabulary)
+        a = utils.intern_utterances([['c', 'a']], vocabulary)
+        assert a == [frozenset([2, 0])]
+
+    def test_utterances(self):
+        a = utils.Utterances([['a'], ['b']], [4, 7])
+        assert a == [['a'], ['b']]
+        assert utils.utterance_ids(a) == [4, 7]
+        # the ids go along to the worker processes
+        assert pickle.loads(pickle.dumps(a)).utterance_ids == [4, 7]
+        assert utils.utterance_ids([['a'], ['b']]) == [None, None]
+
+    def test_matches_anchor_interned(self):
+        b = [utils.intern_utterances([('A', 'B', 'C'), ('X', 'Y', 'Z'), ('A', 'B', 'C')], {})]
+        count, dump = utils.matches_anchor(iter(b), 3, None)
+        assert count == 1
+        assert [(i.tokens, j.tokens) for i, j in dump] == [(('A', 'B', 'C'), ('A', 'B', 'C'))]
+
+
+class SweepTest(unittest.TestCase):
+    utterances = [('A', 'B', 'C'), ('D', 'E', 'F'), ('D', 'G', 'H'), ('D', 'G', 'I'), ('D', 'G', 'I'),
+                  ('X', 'Y', 'Z'), ('A', 'B', 'C'), ('A', 'B', 'C')]
+    cells = [(w, m) for w in range(1, 6) for m in range(0, 4)]
+
+    def score(self, a, b):
+        return utils.match_score(a, b, None)
+
+    def test_sweep_anchor(self):
+        table = utils.overlap_table(self.utterances, 4, self.score)
+        for (w, m), (count, pairs) in zip(self.cells, utils.sweep(table, self.cells)):
+            expected = utils.matches_anchor(utils.window(self.utterances, w), m, None)
+            assert (count, [(self.utterances[i], self.utterances[j]) for i, j in pairs]) == expected
+
+    def test_sweep_incremental(self):
+        table = utils.overlap_table(self.utterances, 1, self.score)
+        for (w, m), (count, pairs) in zip(self.cells, utils.sweep(table, self.cells, incremental=True)):
+            expected = utils.matches_incremental(utils.window(self.utterances, w), m, None)
+            assert (count, [(self.utterances[i], self.utterances[j]) for i, j in pairs]) == expected
+
+    def test_sweep_anchor_tail(self):
+        table = utils.overlap_table(self.utterances, 2, self.score)
+        assert utils.sweep_anchor(table, 3, 3, tail=True) == (2, [(3, 4), (6, 7)])
+
+    def test_sweep_incremental_tail(self):
+        table = utils.overlap_table(self.utterances, 1, self.score)
+        assert utils.sweep_incremental(table, 3, 3, tail=True) == (4, [(3, 4), (3, 4), (6, 7), (6, 7)])
+
+    def test_sweep_stop(self):
+        table = utils.overlap_table(self.utterances, 2, self.score)
+        assert utils.sweep_anchor(table, 3, 3, tail=True, stop=5) == (1, [(3, 4)])
+        assert utils.sweep_incremental(table, 3, 3, tail=True, stop=3) == (1, [(3, 4)])
+
+    def test_sweep_count_only(self):
+        table = utils.overlap_table(self.utterances, 4, self.score)
+        assert utils.sweep(table, self.cells, dump=False) == [(count, []) for count, _ in utils.sweep(table, self.cells)]
+
+    def test_extend_overlap_table(self):
+        for distance in [1, 2]:
+            table = utils.overlap_table(self.utterances, distance, self.score)
+            table = utils.extend_overlap_table(self.utterances, table, 4, self.score)
+            assert table == utils.overlap_table(self.utterances, 4, self.score)
+
+    def test_iter_anchor_pairs(self):
+        table = utils.overlap_table(self.utterances, 2, self.score)
+        pairs = utils.iter_anchor_pairs(table, 3, 2)
+        assert next(pairs) == (2, 3)
+        assert list(pairs) == [(3, 4)]
+
+    def test_sweep_anchor_pairs(self):
+        table = utils.overlap_table(self.utterances, 2, self.score)
+        assert utils.sweep_anchor(table, 3, 2) == (2, [(2, 3), (3, 4)])
+
+
+class LevenshteinTest(unittest.TestCase):
+    def test_levenshtein_dist(self):
+        assert utils.levenshtein_dist('kitten', 'sitting') == 3
+        assert utils.levenshtein_dist('', 'abc') == 3
+
+    def test_levenshtein_within(self):
+        assert utils.levenshtein_within('kitten', 'sitting', 3)
+        assert not utils.levenshtein_within('kitten', 'sitting', 2)
+        assert utils.levenshtein_within('dog', 'dog', 0)
+        assert not utils.levenshtein_within('dog', 'dogs', 0)
+        assert not utils.levenshtein_within('dog', 'dog', -1)
+
+    def test_levenshtein_within_same_as_levenshtein_dist(self):
+        random.seed(3)
+        for _ in range(2000):
+            s1 = ''.join(random.choice('abc') for _ in range(random.randint(0, 7)))
+            s2 = ''.join(random.choice('abc') for _ in range(random.randint(0, 7)))
+            distance = utils.levenshtein_dist(s1, s2)
+            for max_dist in range(0, 5):
+                assert utils.levenshtein_within(s1, s2, max_dist) == (distance <= max_dist), (s1, s2, max_dist)
+
+
+class LevenshteinNeighboursTest(unittest.TestCase):
+    def test_levenshtein_neighbours(self):
+        vocabulary = {'dog': 0, 'dogs': 1, 'fog': 2, 'cat': 3}
+        neighbours = utils.levenshtein_neighbours(vocabulary, 1)
+        assert neighbours == {0: frozenset([0, 1, 2]), 1: frozenset([0, 1]), 2: frozenset([0, 2]), 3: frozenset([3])}
+
+    def test_levenshtein_neighbours_same_as_levenshtein_within(self):
+        random.seed(5)
+        words = {''.join(random.choice('abcd') for _ in range(random.randint(1, 6))) for _ in range(150)}
+        vocabulary = {word: i for i, word in enumerate(sorted(words))}
+        for max_dist in range(0, 3):
+            neighbours = utils.levenshtein_neighbours(vocabulary, max_dist)
+            for word, i in vocabulary.items():
+                expected = frozenset(j for other, j in vocabulary.items()
+                                     if utils.levenshtein_within(word, other, max_dist))
+                assert neighbours[i] == expected
+
+    def test_levenshtein_indexed(self):
+        vocabulary = {}
+        a, b = utils.intern_utterances([['dog', 'dog', None, 'cat'], ['dogs', None, 'bird']], vocabulary)
+        neighbours = utils.levenshtein_neighbours({k: v for k, v in vocabulary.items() if k is not None}, 1)
+        assert utils.levenshtein_indexed(a, b, neighbours) == utils.levenshtein(a.tokens, b.tokens, 1) == 2
+        assert utils.levenshtein_indexed(b, a, neighbours) == utils.levenshtein(b.tokens, a.tokens, 1) == 1
+
+
+class SimilarityEngineTest(unittest.TestCase):
+    def test_score_same_as_match_score(self):
+        random.seed(11)
+        words = [''.join(random.choice('abcde') for _ in range(random.randint(1, 6))) for _ in range(30)]
+        utterances = [[random.choice(words) for _ in range(random.randint(0, 4))] for _ in range(60)]
+        interned = utils.intern_utterances(utterances, {})
+        for threshold in [0.3, 0.55, 0.8]:
+            engine = utils.SimilarityEngine(threshold)
+            for a, b in zip(interned, interned[1:] + interned[:1]):
+                assert engine.score(a, b) == utils.match_score(a.tokens, b.tokens, threshold)
+            assert engine.hits > 0
+
+    def test_hit_rate(self):
+        a, b = utils.intern_utterances([['dog'], ['dogs']], {})
+        engine = utils.SimilarityEngine(0.8)
+        assert engine.hit_rate() == 0.0
+        assert engine.score(a, b) == 1
+        assert engine.score(a, b) == 1
+        assert (engine.hits, engine.misses) == (1, 1)
+        assert engine.hit_rate() == 0.5
+
+    def test_bounded(self):
+        a, b = utils.intern_utterances([['dog', 'cat', 'bird'], ['dogs', 'cats']], {})
+        engine = utils.SimilarityEngine(0.8, max_size=2)
+        engine.score(a, b)
+        assert len(engine.ratios) == 2
+
+
+class GraphTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(13)
+        words = [''.join(random.choice('abcde') for _ in range(random.randint(1, 6))) for _ in range(30)]
+        utterances = [[random.choice(words) for _ in range(random.randint(0, 4))] for _ in range(40)]
+        self.vocabulary = {}
+        self.interned = utils.intern_utterances(utterances, self.vocabulary)
+
+    def test_graph_score(self):
+        graph = utils.similarity_graph(self.interned, 3, 0.5)
+        for threshold in [0.5, 0.6, 0.8]:
+            for i, a in enumerate(self.interned):
+                for b in self.interned[i + 1:i + 4]:
+                    assert utils.graph_score(a, b, graph, threshold) == utils.match_score(a.tokens, b.tokens, threshold)
+
+    def test_graph_min_distance(self):
+        graph = utils.similarity_graph(self.interned, 3, 0.5, min_distance=3)
+        for threshold in [0.5, 0.8]:
+            for a, b in zip(self.interned, self.interned[3:]):
+                assert utils.graph_score(a, b, graph, threshold) == utils.match_score(a.tokens, b.tokens, threshold)
+
+    def test_graph_neighbours(self):
+        graph = utils.levenshtein_graph(self.vocabulary, 2)
+        for max_dist in range(0, 3):
+            assert utils.graph_neighbours(graph, max_dist) == utils.levenshtein_neighbours(self.vocabulary, max_dist)
@@ -1,3 +1,12 @@
 #/bin/bash
 python3 -m unittest test_get_variation_sets.py
 python3 -m unittest test_utils.py
+python3 -m unittest test_numpy_backend.py
+python3 -m unittest test_token_cache.py
+python3 -m unittest test_scheduler.py
+python3 -m unittest test_batch.py
+python3 -m unittest test_result_cache.py
+python3 -m unittest test_overlap_index.py
+python3 -m unittest test_pipeline.py
+python3 -m unittest test_compact_dumps.py
+python3 -m unittest test_columnar.py
@@ -0,0 +1,136 @@
+"""Columnar on-disk cache of the tokenised corpus, so that runs that only change -w/-m/-z don't re-read the sqlite
+database. Each view of a database (tier, -v filter and the kind of corpus, which decides the lowercasing) is stored
+in its own directory, keyed by the content hash of the database file, as NumPy arrays that are opened memory-mapped:
+
+    token_ids.npy          token id of every token of every utterance, -1 for NULL tokens
+    utterance_offsets.npy  where each utterance starts in token_ids (plus the end)
+    session_offsets.npy    where each session starts in the utterances (plus the end)
+    session_totals.npy     total (adult) utterances of each session, including the ones without tokens
+    utterance_ids.npy      database id of every utterance, -1 where it isn't known
+    session_ids.json       the session ids
+    vocabulary.json        the tokens, indexed by token id
+
+Requires numpy; see available()."""
+
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import utils as vs
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Bump when the layout changes
+VERSION = 2
+
+
+def available():
+    """Whether numpy could be imported."""
+    return np is not None
+
+
+def file_hash(filename, block_size=1 << 20):
+    """sha256 of the file's content."""
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_key(filename, args):
+    """Directory name for this database and view of it."""
+    if args.random_text:
+        corpus = 'randomized'
+    elif args.english_bnc:
+        corpus = 'bnc'
+    elif args.chintang_adults:
+        corpus = 'chintang'
+    else:
+        corpus = 'acqdiv'
+    view = '%s_%s_%s_v%d' % (corpus, args.tier, 'nv' if args.nouns_verbs else 'all', VERSION)
+    if args.case_folding:
+        view += '_' + hashlib.sha256(' '.join(args.case_folding).encode()).hexdigest()[:12]
+    return file_hash(filename) + '_' + view
+
+
+def write_cache(path, sessions):
+    """Store the (session_id, total_utterances, utterances) of every session in the directory path, yielding each
+    session on the way through. The directory only appears once everything has been written."""
+    vocabulary = {}
+    token_ids = []
+    utterance_offsets = [0]
+    session_offsets = [0]
+    session_totals = []
+    session_ids = []
+    utterance_ids = []
+
+    for session, total, utterances in sessions:
+        utterance_ids.extend(-1 if uid is None else uid for uid in vs.utterance_ids(utterances))
+        for utterance in utterances:
+            for token in utterance:
+                if token is None:
+                    token_ids.append(-1)
+                else:
+                    token_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+            utterance_offsets.append(len(token_ids))
+        session_offsets.append(len(utterance_offsets) - 1)
+        session_totals.append(total)
+        session_ids.append(session)
+        yield session, total, utterances
+
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=parent)
+    np.save(os.path.join(temporary, 'token_ids.npy'), np.array(token_ids, dtype=np.int32))
+    np.save(os.path.join(temporary, 'utterance_offsets.npy'), np.array(utterance_offsets, dtype=np.int64))
+    np.save(os.path.join(temporary, 'session_offsets.npy'), np.array(session_offsets, dtype=np.int64))
+    np.save(os.path.join(temporary, 'session_totals.npy'), np.array(session_totals, dtype=np.int64))
+    np.save(os.path.join(temporary, 'utterance_ids.npy'), np.array(utterance_ids, dtype=np.int64))
+    with open(os.path.join(temporary, 'session_ids.json'), 'w') as f:
+        json.dump(session_ids, f)
+    with open(os.path.join(temporary, 'vocabulary.json'), 'w') as f:
+        json.dump(sorted(vocabulary, key=vocabulary.get), f)
+    if os.path.exists(path):
+        shutil.rmtree(temporary)
+    else:
+        os.rename(temporary, path)
+
+
+def read_cache(path):
+    """Yields the (session_id, total_utterances, utterances) of every session stored in the directory path."""
+    token_ids = np.load(os.path.join(path, 'token_ids.npy'), mmap_mode='r')
+    utterance_offsets = np.load(os.path.join(path, 'utterance_offsets.npy'), mmap_mode='r')
+    session_offsets = np.load(os.path.join(path, 'session_offsets.npy'), mmap_mode='r')
+    session_totals = np.load(os.path.join(path, 'session_totals.npy'), mmap_mode='r')
+    utterance_ids = np.load(os.path.join(path, 'utterance_ids.npy'), mmap_mode='r')
+    with open(os.path.join(path, 'session_ids.json')) as f:
+        session_ids = json.load(f)
+    with open(os.path.join(path, 'vocabulary.json')) as f:
+        vocabulary = json.load(f) + [None]  # so that -1 is None
+
+    for k, session in enumerate(session_ids):
+        first, last = int(session_offsets[k]), int(session_offsets[k + 1])
+        offsets = utterance_offsets[first:last + 1].tolist()
+        tokens = token_ids[offsets[0]:offsets[-1]].tolist()
+        base = offsets[0]
+        utterances = vs.Utterances([vocabulary[t] for t in tokens[start - base:end - base]]
+                                   for start, end in zip(offsets, offsets[1:]))
+        utterances.utterance_ids = [None if uid < 0 else uid for uid in utterance_ids[first:last].tolist()]
+        yield session, int(session_totals[k]), utterances
+
+
+def cached_sessions(cache_dir, filename, args, load):
+    """Yields the (session_id, total_utterances, utterances) of every session from the cache in cache_dir, or, if
+    this view of the database isn't cached yet, from load() while caching them."""
+    path = os.path.join(cache_dir, cache_key(filename, args))
+    if os.path.isdir(path):
+        print("Reading tokens from cache:", path)
+        return read_cache(path)
+    print("Caching tokens in:", path)
+    return write_cache(path, load())
@@ -1,5 +1,6 @@
 """Variation sets utils."""
 
+from collections import OrderedDict, defaultdict
 from itertools import islice
 import difflib
 
@@ -8,7 +9,7 @@ def window(seq, n=2):
     """Returns a sliding window (of width n) over data from the iterable s
     -> (s0,s1,...s[n-1]), (s1,s2,...,sn), ..."""
 
-    # TODO: this method of extracting pairs has a fence post problem
+    # TODO: this method of extracting pairs has a fence post problem, window_bounds(..., tail=True) doesn't
     it = iter(seq)
     result = tuple(islice(it, n))
     if len(result) == n:
@@ -18,6 +19,65 @@ def window(seq, n=2):
         yield result
 
 
+class InternedUtterance(frozenset):
+    """Frozen set of integer token ids for one utterance. The ids in utterance order and the original
+    tokens are kept on the object, the latter so that matched utterances can still be dumped as text."""
+
+    __slots__ = ('tokens', 'ids')
+
+    def __new__(cls, ids, tokens):
+        self = super().__new__(cls, ids)
+        self.tokens = tokens
+        self.ids = tuple(ids)
+        return self
+
+
+class Utterances(list):
+    """The token lists of the utterances of a session, as the loaders yield them. The database id of every utterance
+    is kept as utterance_ids, so that the positions the matched pairs are given by can be mapped back to the database.
+    Compares like a plain list."""
+
+    def __init__(self, utterances=(), utterance_ids=()):
+        super().__init__(utterances)
+        self.utterance_ids = list(utterance_ids)
+
+
+def utterance_ids(utterances):
+    """The database ids of the utterances of a session, None for the ones that aren't known."""
+    ids = getattr(utterances, 'utterance_ids', None)
+    return ids if ids is not None and len(ids) == len(utterances) else [None] * len(utterances)
+
+
+def intern_utterances(utterances, vocabulary):
+    """Given a list of token lists and a (corpus-level) vocabulary dict that maps tokens to dense
+    integer ids, returns a list of InternedUtterance. New tokens are added to the vocabulary, so the
+    same dict can be passed for every session."""
+    interned = []
+    for utterance in utterances:
+        ids = []
+        for token in utterance:
+            token_id = vocabulary.get(token)
+            if token_id is None:
+                token_id = vocabulary[token] = len(vocabulary)
+            ids.append(token_id)
+        interned.append(InternedUtterance(ids, utterance))
+    return interned
+
+
+def window_bounds(length, n=2, tail=False):
+    """Returns a sliding window (of width n) over the positions of a sequence of the given length as
+    (start, end) pairs, i.e. seq[start:end] for each of the windows window(seq, n) gives, without copying seq.
+
+    window has a fence post problem: the last n - 2 items are never at the start of a window, and a sequence
+    shorter than n has no windows at all. With tail, the window keeps sliding until it has only 2 items left,
+    cut short at the end of the sequence: (length - n + 1, length), ..., (length - 2, length)."""
+    for start in range(length - n + 1):
+        yield start, start + n
+    if tail:
+        for start in range(max(length - n + 1, 0), length - 1):
+            yield start, length
+
+
 def levenshtein_dist(s1, s2):
     """Input two strings, returns levenstein distance between the two"""
 
@@ -39,6 +99,45 @@ def levenshtein_dist(s1, s2):
     return d[S1 - 1, S2 - 1]
 
 
+def levenshtein_within(s1, s2, max_dist):
+    """Input two strings and a maximum distance, returns whether the levenstein distance between the two is at
+    most max_dist, i.e. levenshtein_dist(s1, s2) <= max_dist. Only the band of the table within max_dist of the
+    diagonal is filled in (Ukkonen) and it gives up as soon as a whole row of the band is over max_dist."""
+    if max_dist < 0:
+        return False
+    S1 = len(s1)
+    S2 = len(s2)
+    # the distance is at least the difference in length
+    if abs(S1 - S2) > max_dist:
+        return False
+    if s1 == s2:
+        return True
+    if max_dist == 0:
+        return False
+
+    over = max_dist + 1  # every value above max_dist is the same to us
+    previous = [j if j <= max_dist else over for j in range(S2 + 1)]
+    for i in range(1, S1 + 1):
+        current = [over] * (S2 + 1)
+        current[0] = i if i <= max_dist else over
+        row_min = current[0]
+        c1 = s1[i - 1]
+        for j in range(max(1, i - max_dist), min(S2, i + max_dist) + 1):
+            if c1 == s2[j - 1]:
+                d = previous[j - 1]
+            else:
+                d = min(previous[j], current[j - 1], previous[j - 1]) + 1
+                if d > over:
+                    d = over
+            current[j] = d
+            if d < row_min:
+                row_min = d
+        if row_min > max_dist:
+            return False
+        previous = current
+    return previous[S2] <= max_dist
+
+
 def levenshtein(A, B, match_type):
     """ 2 lists of strings and an integar
     returns the number of strings in common, adjusted by levenstein distance"""
@@ -50,33 +149,31 @@ def levenshtein(A, B, match_type):
         for word_ in B:
             if isinstance(word_, type(None)):
                 continue
-            if levenshtein_dist(word, word_) <= match_type:
+            if levenshtein_within(word, word_, match_type):
                 match_count += 1
                 break
     return match_count
 
 
-def matches_wrapper(utterance_A, utterance_B, match_type, minimum_matches):
-    """Input two lists of strings, a minimum number of matches,
-    and either None, Integar or Float
-    Returns: whether the required number of matches has been met for which ever type:
-    None: intersection of set of both lists
-    Integar: levenstein distance
-    Float: Python's difflib"""
+def match_score(utterance_A, utterance_B, match_type):
+    """Input two lists of strings and either None, Integar or Float
+    Returns: the number of matches between the two utterances for which ever type (see matches_wrapper),
+    or None if the pair can never count as a match"""
 
     if isinstance(match_type, type(None)):
-        if len(set(utterance_A).intersection(set(utterance_B))) >= minimum_matches:
-            return True
+        # interned utterances are already frozen sets of token ids
+        if not isinstance(utterance_A, frozenset):
+            utterance_A = set(utterance_A)
+        return len(utterance_A.intersection(utterance_B))
 
     # TODO: revisit this
     elif isinstance(match_type, int):
-        if levenshtein(utterance_A, utterance_B, match_type) >= minimum_matches:
-            return True
+        return levenshtein(utterance_A, utterance_B, match_type)
 
     elif isinstance(match_type, float):
         # difflib returns 1.0 for space, so skip any utterances that are blank, i.e. no N or V match
         if len(utterance_A) == 0 and len(utterance_B) == 0:
-            return False
+            return None
 
         matches = 0
         for item in utterance_A:
@@ -84,10 +181,7 @@ def matches_wrapper(utterance_A, utterance_B, match_type, minimum_matches):
                 if difflib.SequenceMatcher(lambda x: x == ' ', item, i).ratio() >= match_type:
                     matches += 1
         # TODO: this is wrong, i.e. for the multiple match scenario, i.e. at least two matches per VS, but this simply iterates and counts
-        if matches >= minimum_matches:
-            return True
-        else:
-            return False
+        return matches
 
     """ 
     elif isinstance(match_type, float):
@@ -102,34 +196,290 @@ def matches_wrapper(utterance_A, utterance_B, match_type, minimum_matches):
     """
 
 
-def matches_anchor(it, minimum_matches, match_type):
-    """Given an iterator, returns count of all variation sets found using the anchor algorithm."""
+def _deletes(word, max_dist):
+    """Returns the set of all strings that can be made by deleting up to max_dist characters from word."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(max_dist):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants.update(frontier)
+    return variants
+
+
+def levenshtein_neighbours(vocabulary, max_dist):
+    """Input a vocabulary dict of words to token ids (e.g. of one session) and an integar.
+    Returns a dict from every token id to the frozen set of token ids within levenstein distance max_dist.
+
+    Uses a symmetric deletion index: two words within max_dist edits always share a string made by deleting
+    up to max_dist characters from each, so only words sharing a deletion are checked with levenshtein_within."""
+    if max_dist < 0:
+        return {token_id: frozenset() for token_id in vocabulary.values()}
+    index = defaultdict(set)
+    for word, token_id in vocabulary.items():
+        for variant in _deletes(word, max_dist):
+            index[variant].add(word)
+
+    neighbours = {}
+    for word, token_id in vocabulary.items():
+        candidates = set()
+        for variant in _deletes(word, max_dist):
+            candidates.update(index[variant])
+        neighbours[token_id] = frozenset(vocabulary[candidate] for candidate in candidates
+                                         if levenshtein_within(word, candidate, max_dist))
+    return neighbours
+
+
+def levenshtein_indexed(A, B, neighbours):
+    """2 interned utterances and the levenshtein_neighbours of their token ids
+    returns the same count as levenshtein, i.e. the number of words in A within distance of some word in B.
+    Token ids without neighbours (i.e. None) never match."""
+    match_count = 0
+    empty = frozenset()
+    for token_id in A.ids:
+        if not neighbours.get(token_id, empty).isdisjoint(B):
+            match_count += 1
+    return match_count
+
+
+class SimilarityEngine(object):
+    """Counts difflib matches between two interned utterances, like the float branch of match_score.
+
+    Ratios are memoized by (token id, token id) in a bounded LRU table, pairs are rejected early with the
+    real_quick_ratio/quick_ratio upper bounds, and one SequenceMatcher is reused with set_seq2 for all the
+    comparisons against the same word. For rejected pairs the table keeps the upper bound instead of the ratio,
+    which is below the threshold all the same."""
+
+    def __init__(self, threshold, max_size=1000000):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ratios = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.matcher = difflib.SequenceMatcher(lambda x: x == ' ')
+
+    def ratio(self, id_a, a, id_b, b):
+        """Returns the (memoized) ratio of a against b, or an upper bound of it if that is below the threshold."""
+        key = (id_a, id_b)
+        ratio = self.ratios.get(key)
+        if ratio is not None:
+            self.hits += 1
+            self.ratios.move_to_end(key)
+            return ratio
+
+        self.misses += 1
+        # setting the second sequence is the expensive part, so it's only redone when b changes
+        if self.matcher.b != b:
+            self.matcher.set_seq2(b)
+        self.matcher.set_seq1(a)
+        ratio = self.matcher.real_quick_ratio()
+        if ratio >= self.threshold:
+            ratio = self.matcher.quick_ratio()
+            if ratio >= self.threshold:
+                ratio = self.matcher.ratio()
+
+        self.ratios[key] = ratio
+        if len(self.ratios) > self.max_size:
+            self.ratios.popitem(last=False)
+        return ratio
+
+    def score(self, utterance_A, utterance_B):
+        """Same as match_score(utterance_A, utterance_B, threshold) for interned utterances."""
+        # difflib returns 1.0 for space, so skip any utterances that are blank, i.e. no N or V match
+        if len(utterance_A) == 0 and len(utterance_B) == 0:
+            return None
+
+        matches = 0
+        # compare every word of A against one word of B at a time, so the matcher keeps the same b
+        for id_b, b in zip(utterance_B.ids, utterance_B.tokens):
+            for id_a, a in zip(utterance_A.ids, utterance_A.tokens):
+                if self.ratio(id_a, a, id_b, b) >= self.threshold:
+                    matches += 1
+        return matches
+
+    def hit_rate(self):
+        """Share of the ratio lookups that were answered by the memo table."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+def similarity_graph(utterances, max_distance, threshold, similarity=None, min_distance=1):
+    """Input a session of interned utterances, a maximum distance and the lowest difflib threshold of interest.
+    Returns a sparse graph {id_a: {id_b: ratio}} of the ratio of every word a against every word b that
+    follows it within max_distance utterances (and at least min_distance), keeping only the ratios of at least
+    threshold. similarity is an optional SimilarityEngine (with a threshold of at most threshold) to share memoized
+    ratios."""
+    if similarity is None:
+        similarity = SimilarityEngine(threshold)
+    words = {}
+    for utterance in utterances:
+        words.update(zip(utterance.ids, utterance.tokens))
+
+    # the distinct word pairs that ever co-occur within max_distance
+    pairs = set()
+    n = len(utterances)
+    for i, first in enumerate(utterances):
+        for j in range(i + min_distance, min(i + max_distance + 1, n)):
+            pairs.update((id_a, id_b) for id_b in utterances[j] for id_a in first)
+
+    graph = defaultdict(dict)
+    # sorted so that the matcher can keep the same second word
+    for id_a, id_b in sorted(pairs, key=lambda pair: (pair[1], pair[0])):
+        ratio = similarity.ratio(id_a, words[id_a], id_b, words[id_b])
+        if ratio >= threshold:
+            graph[id_a][id_b] = ratio
+    return dict(graph)
+
+
+def graph_score(utterance_A, utterance_B, graph, threshold):
+    """Same as match_score(utterance_A, utterance_B, threshold) for interned utterances, looking the ratios up in
+    a similarity_graph built with a threshold of at most threshold."""
+    # difflib returns 1.0 for space, so skip any utterances that are blank, i.e. no N or V match
+    if len(utterance_A) == 0 and len(utterance_B) == 0:
+        return None
     matches = 0
-    utterances_to_dump = list()
+    for id_a in utterance_A.ids:
+        edges = graph.get(id_a)
+        if edges:
+            for id_b in utterance_B.ids:
+                if edges.get(id_b, -1.0) >= threshold:
+                    matches += 1
+    return matches
+
+
+def levenshtein_graph(vocabulary, max_dist):
+    """Input a vocabulary dict of words to token ids and an integar.
+    Returns a sparse graph {id: {id: distance}} of the levenstein distances of all the words within max_dist."""
+    words = {token_id: word for word, token_id in vocabulary.items()}
+    graph = {}
+    for token_id, neighbours in levenshtein_neighbours(vocabulary, max_dist).items():
+        word = words[token_id]
+        graph[token_id] = {other: levenshtein_dist(word, words[other]) for other in neighbours}
+    return graph
+
+
+def graph_neighbours(graph, max_dist):
+    """Given a levenshtein_graph, returns the levenshtein_neighbours for any max_dist up to the graph's."""
+    return {token_id: frozenset(other for other, distance in edges.items() if distance <= max_dist)
+            for token_id, edges in graph.items()}
+
+
+def matches_wrapper(utterance_A, utterance_B, match_type, minimum_matches):
+    """Input two lists of strings, a minimum number of matches,
+    and either None, Integar or Float
+    Returns: whether the required number of matches has been met for which ever type:
+    None: intersection of set of both lists
+    Integar: levenstein distance
+    Float: Python's difflib"""
+    score = match_score(utterance_A, utterance_B, match_type)
+    return score is not None and score >= minimum_matches
+
 
+def iter_matches_anchor(it, minimum_matches, match_type):
+    """Same as matches_anchor, but lazily yields the matched pairs instead of collecting them."""
     for i in it:
         utterances = iter(i)
-        first = next(utterances)
+        first = next(utterances, None)
         for utterance in utterances:
             if matches_wrapper(first, utterance, match_type, minimum_matches):
-                matches += 1
-                utterances_to_dump.append((first, utterance))
+                yield first, utterance
                 break
-    return matches, utterances_to_dump
+
+
+def matches_anchor(it, minimum_matches, match_type):
+    """Given an iterator, returns count of all variation sets found using the anchor algorithm."""
+    utterances_to_dump = list(iter_matches_anchor(it, minimum_matches, match_type))
+    return len(utterances_to_dump), utterances_to_dump
+
+
+def iter_matches_incremental(it, minimum_matches, match_type):
+    """Same as matches_incremental, but lazily yields the matched pairs instead of collecting them."""
+    for i in it:
+        for j, k in window(i):
+            if matches_wrapper(j, k, match_type, minimum_matches):
+                yield j, k
 
 
 def matches_incremental(it, minimum_matches, match_type):
     """Given an iterator returns the minimum matches. Note that any changes here must be added to
     varseta_accuracy_test.py."""
-    matches = 0
-    utterances_to_dump = list()
-    for i in it:
-        pairs = window(i)
-        for i, j in pairs:
-            if matches_wrapper(i, j, match_type, minimum_matches):
-                utterances_to_dump.append((i, j))
-                matches += 1
-    return matches, utterances_to_dump
+    utterances_to_dump = list(iter_matches_incremental(it, minimum_matches, match_type))
+    return len(utterances_to_dump), utterances_to_dump
+
+
+def overlap_table(utterances, max_distance, score):
+    """Scans a session once: for every anchor utterance i, returns the score (e.g. match_score) with each of
+    the following utterances up to max_distance positions away, i.e. table[i][k - 1] is score(i, i + k)."""
+    table = []
+    n = len(utterances)
+    for i, first in enumerate(utterances):
+        table.append([score(first, utterances[j]) for j in range(i + 1, min(i + max_distance + 1, n))])
+    return table
+
+
+def extend_overlap_table(utterances, table, max_distance, score):
+    """Extends an overlap_table of the utterances that reaches fewer than max_distance utterances ahead, in place, to
+    max_distance, scoring only the utterances beyond it. Returns the table."""
+    n = len(utterances)
+    for i, (first, row) in enumerate(zip(utterances, table)):
+        row.extend(score(first, utterances[j]) for j in range(i + len(row) + 1, min(i + max_distance + 1, n)))
+    return table
+
+
+def iter_anchor_pairs(table, window_size, minimum_matches, tail=False, stop=None):
+    """Given an overlap_table, lazily yields the (anchor index, utterance index) pairs matches_anchor finds for
+    window(utterances, window_size). The table must reach window_size - 1 utterances ahead.
+    With tail, the last utterances are anchors too (see window_bounds). With stop, only the windows starting before
+    stop are looked at."""
+    for start, end in window_bounds(len(table), window_size, tail):
+        if stop is not None and start >= stop:
+            break
+        row = table[start]
+        for k in range(end - start - 1):
+            score = row[k]
+            if score is not None and score >= minimum_matches:
+                yield start, start + k + 1
+                break
+
+
+def iter_incremental_pairs(table, window_size, minimum_matches, tail=False, stop=None):
+    """Given an overlap_table, lazily yields the pairs of utterance indices matches_incremental finds for
+    window(utterances, window_size). Only the first column of the table (adjacent utterances) is used.
+    With tail, the windows cut short at the end of the session are counted too (see window_bounds). With stop,
+    only the windows starting before stop are looked at."""
+    adjacent = [bool(row) and row[0] is not None and row[0] >= minimum_matches for row in table]
+    for start, end in window_bounds(len(table), window_size, tail):
+        if stop is not None and start >= stop:
+            break
+        for j in range(start, end - 1):
+            if adjacent[j]:
+                yield j, j + 1
+
+
+def _count_or_collect(pairs, dump):
+    """Returns the number of pairs and, if dump, the list of them (otherwise an empty list)."""
+    if dump:
+        pairs = list(pairs)
+        return len(pairs), pairs
+    return sum(1 for _ in pairs), []
+
+
+def sweep_anchor(table, window_size, minimum_matches, tail=False, dump=True, stop=None):
+    """Given an overlap_table, returns the count and (if dump) the matched pairs of iter_anchor_pairs."""
+    return _count_or_collect(iter_anchor_pairs(table, window_size, minimum_matches, tail, stop), dump)
+
+
+def sweep_incremental(table, window_size, minimum_matches, tail=False, dump=True, stop=None):
+    """Given an overlap_table, returns the count and (if dump) the matched pairs of iter_incremental_pairs."""
+    return _count_or_collect(iter_incremental_pairs(table, window_size, minimum_matches, tail, stop), dump)
+
+
+def sweep(table, cells, incremental=False, tail=False, dump=True, stop=None):
+    """Derive the counts and matched pairs for every (window size, minimum matches) cell from one overlap_table.
+    Returns a list of (count, pairs) in the order of the cells; without dump, only the counts are worked out and
+    the pairs are empty. With stop, only the windows starting before stop are counted."""
+    if incremental:
+        return [sweep_incremental(table, window_size, minimum, tail, dump, stop) for window_size, minimum in cells]
+    return [sweep_anchor(table, window_size, minimum, tail, dump, stop) for window_size, minimum in cells]
 
 
 def get_exact_repetitions(utterances, n):